@@ -14,9 +14,14 @@ from services.maintenance_service import MaintenanceService
 from services.ai_service import AIService
 from services.notification_service import NotificationService
 from services.report_service import ReportService
+from services.ingest_queue import ingest_queue
+from services.llm_client import llm_client
+from services.training_service import TrainingService
+from services.snapshot_service import prediction_snapshots
+from services.recommendation_cache import recommendation_cache
 
 # Rotas
-from routers import auth, equipment, alert, maintenance, report
+from routers import auth, equipment, alert, maintenance, report, ai
 
 # Inicialização do Firebase Admin SDK
 cred_path = os.getenv("FIREBASE_CREDENTIALS_PATH", "./firebase-credentials.json")
@@ -78,6 +83,22 @@ app.include_router(equipment.router)
 app.include_router(alert.router)
 app.include_router(maintenance.router)
 app.include_router(report.router)
+app.include_router(ai.router)
+
+# Fila local de ingestão: drenada para o Firestore em segundo plano
+@app.on_event("startup")
+async def start_ingest_queue():
+    ingest_queue.start()
+    prediction_snapshots.start()
+    recommendation_cache.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_queue():
+    await ingest_queue.stop()
+    await prediction_snapshots.stop()
+    await recommendation_cache.stop()
+    await llm_client.aclose()
+    TrainingService.shutdown()
 
 # Endpoint raiz
 @app.get("/")
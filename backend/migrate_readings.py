@@ -0,0 +1,15 @@
+from dotenv import load_dotenv
+
+# Carregar variáveis de ambiente do arquivo .env
+load_dotenv()
+
+from services.timeseries_service import TimeSeriesService
+
+# Move as leituras legadas (array `operational_data` no documento do equipamento)
+# para os buckets diários e rollups de todos os equipamentos. Pode ser executado
+# mais de uma vez e em paralelo com a API: cada lote é migrado em uma transação.
+if __name__ == "__main__":
+    print("Migrando leituras legadas para os buckets diários...")
+    result = TimeSeriesService.migrate_all()
+    print(f"Equipamentos migrados: {result['equipment']}")
+    print(f"Leituras migradas: {result['migrated']}")
@@ -1,5 +1,5 @@
 from .user import User, UserCreate, UserUpdate, UserInDB, UserBase
-from .equipment import Equipment, EquipmentCreate, EquipmentUpdate, EquipmentBase, EquipmentComponent, OperationalData
+from .equipment import Equipment, EquipmentCreate, EquipmentUpdate, EquipmentBase, EquipmentComponent, OperationalData, OperationalDataAck
 from .alert import Alert, AlertCreate, AlertUpdate, AlertBase
 from .maintenance import Maintenance, MaintenanceCreate, MaintenanceUpdate, MaintenanceBase
 from .report import Report, ReportCreate, ReportUpdate, ReportBase, HealthReportContent, MaintenanceReportContent, PredictionReportContent
\ No newline at end of file
@@ -46,6 +46,20 @@ class OperationalData(BaseModel):
     vibration: Optional[float] = None
     cycles: Optional[int] = None
     additional_data: Optional[Dict[str, Any]] = None
+    sequence: Optional[int] = None  # Número de sequência do gateway, usado para descartar reenvios
+
+class OperationalDataAck(BaseModel):
+    equipment_id: str
+    accepted: bool = True
+    accepted_count: int = 1
+    duplicates: int = 0  # Leituras já recebidas anteriormente e ignoradas
+    queued: bool = False  # Gravado na fila local; totais e risco ainda não atualizados
+    total_usage_hours: Optional[float] = None
+    readings_count: Optional[int] = None
+    risk_level: Optional[str] = None
+    needs_maintenance: Optional[bool] = None
+    risk_changed: bool = False
+    anomalies: List[Dict[str, Any]] = []  # Anomalias detectadas nas leituras aceitas (AnomalyDetector)
 
 class Equipment(EquipmentBase):
     id: str
@@ -54,7 +68,14 @@ class Equipment(EquipmentBase):
     risk_level: str = "low"  # low, medium, high
     needs_maintenance: bool = False
     components: List[EquipmentComponent] = []
-    operational_data: List[OperationalData] = []
+    operational_data: List[OperationalData] = []  # Legado: leituras agora ficam em equipment/{id}/readings
+    readings_count: int = 0
+    last_reading_at: Optional[datetime] = None
+    # Estado interno mantido no documento do Firestore; não é devolvido pela API
+    health_state: Optional[Dict[str, Any]] = Field(None, exclude=True)  # Analisador incremental (HealthAnalyzer)
+    dedupe_index: Optional[Dict[str, Any]] = Field(None, exclude=True)  # Chaves recentes para deduplicação (DedupeIndex)
+    anomaly_state: Optional[Dict[str, Any]] = Field(None, exclude=True)  # Detector online de anomalias (AnomalyDetector)
+    recent_anomalies: List[Dict[str, Any]] = []  # Últimas anomalias detectadas na ingestão
     mttf: Optional[float] = None  # Mean Time To Failure in hours
     maintenance_cycle: Optional[int] = None  # Recommended days between maintenance
     total_usage_hours: float = 0
@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Body, Query, Path
 from typing import List, Dict, Any, Optional
+from datetime import datetime
 
+from models.user import User
 from services import AIService
-from services.auth_service import get_current_user_id  # ✅ ajuste aqui
+from services.auth_service import get_current_user, get_current_user_id  # ✅ ajuste aqui
+from services.snapshot_service import SNAPSHOT_MAX_AGE
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
@@ -10,10 +13,71 @@ router = APIRouter(prefix="/ai", tags=["ai"])
 async def predict_equipment_failure(
     equipment_id: str = Path(..., description="ID do equipamento"),
     user_id: str = Depends(get_current_user_id),  # ✅ ajuste aqui
-    days_ahead: int = Query(30, description="Número de dias para previsão")
+    days_ahead: int = Query(30, description="Número de dias para previsão"),
+    deferred: bool = Query(False, description="Responder sem esperar a recomendação da IA (gerada em segundo plano)")
 ):
     """Prevê a probabilidade de falha de um equipamento nos próximos X dias"""
-    return await AIService.predict_equipment_failure(equipment_id, days_ahead)
+    return await AIService.predict_equipment_failure(equipment_id, days_ahead, user_id=user_id, deferred=deferred)
+
+@router.get("/fleet/predict", response_model=Dict[str, Any])
+async def predict_fleet_failure(
+    user_id: str = Depends(get_current_user_id),
+    category: Optional[str] = Query(None, description="Filtrar por categoria"),
+    days_ahead: int = Query(30, description="Número de dias para previsão"),
+    limit: Optional[int] = Query(None, ge=1, description="Retornar apenas os N equipamentos de maior risco")
+):
+    """Prevê a probabilidade de falha de todos os equipamentos do usuário, ordenados por risco"""
+    return await AIService.predict_fleet_failure(user_id, category=category, days_ahead=days_ahead, limit=limit)
+
+@router.get("/fleet/snapshots", response_model=Dict[str, Any])
+async def list_prediction_snapshots(
+    user_id: str = Depends(get_current_user_id),
+    category: Optional[str] = Query(None, description="Filtrar por categoria"),
+    max_age: float = Query(SNAPSHOT_MAX_AGE, gt=0, description="Idade máxima (segundos) antes de um snapshot ser marcado como desatualizado")
+):
+    """Previsões pré-calculadas de todos os equipamentos do usuário, ordenadas por risco"""
+    return await AIService.list_prediction_snapshots(user_id, max_age=max_age, category=category)
+
+@router.get("/snapshots/{equipment_id}", response_model=Dict[str, Any])
+async def get_prediction_snapshot(
+    equipment_id: str = Path(..., description="ID do equipamento"),
+    user_id: str = Depends(get_current_user_id),
+    max_age: float = Query(SNAPSHOT_MAX_AGE, gt=0, description="Idade máxima (segundos) aceita; snapshots mais antigos são recalculados")
+):
+    """Previsão pré-calculada do equipamento, com o horário do cálculo (computed_at)"""
+    return await AIService.get_prediction_snapshot(equipment_id, user_id, max_age=max_age)
+
+@router.get("/fleet/anomalies", response_model=Dict[str, Any])
+async def detect_fleet_anomalies(
+    user_id: str = Depends(get_current_user_id),
+    category: Optional[str] = Query(None, description="Filtrar por categoria"),
+    window: int = Query(1, ge=1, le=16, description="Leituras mais recentes avaliadas por equipamento"),
+    limit: Optional[int] = Query(None, ge=1, description="Retornar apenas os N equipamentos mais anômalos")
+):
+    """Detecta anomalias multivariadas (Mahalanobis) nas leituras recentes da frota, por categoria"""
+    return await AIService.detect_fleet_anomalies(user_id, category=category, window=window, limit=limit)
+
+@router.get("/predict/enrichment/{job_id}", response_model=Dict[str, Any])
+async def get_prediction_enrichment(
+    job_id: str = Path(..., description="ID do job de recomendação"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Consulta a recomendação da IA gerada em segundo plano para uma previsão"""
+    return await AIService.get_prediction_enrichment(job_id, user_id)
+
+@router.get("/models/metrics", response_model=Dict[str, Any])
+async def get_model_registry_stats(
+    user_id: str = Depends(get_current_user_id)
+):
+    """Métricas do cache de modelos de falha"""
+    return AIService.get_model_registry_stats()
+
+@router.get("/llm/metrics", response_model=Dict[str, Any])
+async def get_llm_stats(
+    user_id: str = Depends(get_current_user_id)
+):
+    """Métricas do cliente do modelo de linguagem"""
+    return AIService.get_llm_stats()
 
 @router.get("/maintenance-schedule/{equipment_id}", response_model=Dict[str, Any])
 async def recommend_maintenance_schedule(
@@ -21,20 +85,54 @@ async def recommend_maintenance_schedule(
     user_id: str = Depends(get_current_user_id)
 ):
     """Recomenda um cronograma de manutenção para o equipamento"""
-    return await AIService.recommend_maintenance_schedule(equipment_id)
+    return await AIService.recommend_maintenance_schedule(equipment_id, user_id)
 
 @router.get("/analyze/{equipment_id}", response_model=Dict[str, Any])
 async def analyze_operational_data(
     equipment_id: str = Path(..., description="ID do equipamento"),
-    user_id: str = Depends(get_current_user_id)
+    user_id: str = Depends(get_current_user_id),
+    start: Optional[datetime] = Query(None, description="Início do intervalo analisado"),
+    end: Optional[datetime] = Query(None, description="Fim do intervalo analisado"),
+    window: int = Query(5, ge=1, le=1000, description="Janela da média móvel (leituras)"),
+    max_points: int = Query(500, ge=10, le=5000, description="Pontos máximos por série de tendência"),
+    anomaly_limit: int = Query(50, ge=1, le=500, description="Anomalias por canal nesta página"),
+    anomaly_offset: int = Query(0, ge=0, description="Anomalias a pular em cada canal")
 ):
     """Analisa dados operacionais para identificar padrões e anomalias"""
-    return await AIService.analyze_operational_data(equipment_id)
+    return await AIService.analyze_operational_data(
+        equipment_id, user_id, start=start, end=end, window=window, max_points=max_points,
+        anomaly_limit=anomaly_limit, anomaly_offset=anomaly_offset
+    )
 
 @router.post("/train/{equipment_id}", response_model=Dict[str, Any])
 async def train_custom_model(
     equipment_id: str = Path(..., description="ID do equipamento"),
+    user_id: str = Depends(get_current_user_id),
+    mode: str = Query("auto", pattern="^(auto|full|incremental)$", description="Modo de treino (auto, full ou incremental)")
+):
+    """Enfileira o treino de um modelo personalizado para um equipamento específico"""
+    return await AIService.train_custom_model(equipment_id, user_id, mode=mode)
+
+@router.post("/train/category/{category}", response_model=Dict[str, Any])
+async def train_category_model(
+    category: str = Path(..., description="Categoria dos equipamentos"),
+    current_user: User = Depends(get_current_user)
+):
+    """Enfileira o treino do modelo da categoria com os dados de toda a frota (apenas administradores)"""
+    return await AIService.train_category_model(category, current_user.id, role=current_user.role)
+
+@router.get("/train/jobs/{job_id}", response_model=Dict[str, Any])
+async def get_training_job(
+    job_id: str = Path(..., description="ID do job de treinamento"),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Consulta o estado e o progresso de um treino"""
+    return await AIService.get_training_job(job_id, user_id)
+
+@router.post("/train/jobs/{job_id}/cancel", response_model=Dict[str, Any])
+async def cancel_training_job(
+    job_id: str = Path(..., description="ID do job de treinamento"),
     user_id: str = Depends(get_current_user_id)
 ):
-    """Treina um modelo personalizado para um equipamento específico"""
-    return await AIService.train_custom_model(equipment_id, user_id)
+    """Cancela um treino enfileirado ou em execução"""
+    return await AIService.cancel_training_job(job_id, user_id)
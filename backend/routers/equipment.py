@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Query, Path
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Query, Path, UploadFile, File, WebSocket
 from typing import List, Dict, Any, Optional
+from datetime import datetime
 
-from models.equipment import EquipmentCreate, EquipmentUpdate, Equipment, OperationalData
+from models.equipment import EquipmentCreate, EquipmentUpdate, Equipment, OperationalData, OperationalDataAck
 from services.equipment_service import EquipmentService
-from services.auth_service import get_current_user  # Correção aqui
+from services.import_service import ImportService
+from services.ingest_stream import IngestStream
+from services.auth_service import get_current_user, get_current_user_id  # Correção aqui
 from models.user import User
 
 router = APIRouter(prefix="/equipment", tags=["equipment"])
@@ -30,6 +33,19 @@ async def get_all_equipment(
 async def get_equipment_stats(current_user: User = Depends(get_current_user)):
     return await EquipmentService.get_equipment_statistics(current_user.id)
 
+@router.websocket("/stream")
+async def stream_operational_data(
+    websocket: WebSocket,
+    token: str = Query(..., description="Token de acesso (JWT)")
+):
+    try:
+        user_id = await get_current_user_id(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    await IngestStream(user_id).serve(websocket)
+
 @router.get("/{equipment_id}", response_model=Equipment)
 async def get_equipment(
     equipment_id: str = Path(..., description="ID do equipamento"),
@@ -52,13 +68,46 @@ async def delete_equipment(
 ):
     return await EquipmentService.delete_equipment(equipment_id, current_user.id)
 
-@router.post("/{equipment_id}/operational-data", response_model=Equipment)
+@router.post("/{equipment_id}/operational-data", response_model=OperationalDataAck)
 async def add_operational_data(
     operational_data: OperationalData = Body(...),
     equipment_id: str = Path(..., description="ID do equipamento"),
     current_user: User = Depends(get_current_user)
 ):
-    return await EquipmentService.add_operational_data(equipment_id, operational_data, current_user.id)
+    return await EquipmentService.add_operational_data(equipment_id, current_user.id, operational_data)
+
+@router.post("/{equipment_id}/operational-data/import", response_model=Dict[str, Any])
+async def import_operational_data(
+    file: UploadFile = File(..., description="Arquivo CSV, XLSX ou NDJSON com as leituras"),
+    equipment_id: str = Path(..., description="ID do equipamento"),
+    current_user: User = Depends(get_current_user)
+):
+    return await ImportService.import_operational_data(equipment_id, current_user.id, file)
+
+@router.get("/{equipment_id}/operational-data", response_model=List[OperationalData])
+async def get_operational_data(
+    equipment_id: str = Path(..., description="ID do equipamento"),
+    current_user: User = Depends(get_current_user),
+    start: Optional[datetime] = Query(None, description="Data inicial das leituras"),
+    end: Optional[datetime] = Query(None, description="Data final das leituras"),
+    limit: Optional[int] = Query(None, ge=1, description="Retornar apenas as últimas N leituras do intervalo")
+):
+    return await EquipmentService.get_operational_data(
+        equipment_id, current_user.id, start=start, end=end, limit=limit
+    )
+
+@router.get("/{equipment_id}/rollups", response_model=List[Dict[str, Any]])
+async def get_operational_rollups(
+    equipment_id: str = Path(..., description="ID do equipamento"),
+    current_user: User = Depends(get_current_user),
+    resolution: str = Query("day", pattern="^(hour|day)$", description="Resolução dos agregados (hour ou day)"),
+    start: Optional[datetime] = Query(None, description="Início do intervalo"),
+    end: Optional[datetime] = Query(None, description="Fim do intervalo"),
+    limit: Optional[int] = Query(None, ge=1, description="Retornar apenas os N períodos mais recentes")
+):
+    return await EquipmentService.get_operational_rollups(
+        equipment_id, current_user.id, resolution=resolution, start=start, end=end, limit=limit
+    )
 
 @router.get("/{equipment_id}/health-analysis", response_model=Dict[str, Any])
 async def analyze_equipment_health(
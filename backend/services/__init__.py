@@ -4,6 +4,9 @@ from .alert_service import AlertService
 from .maintenance_service import MaintenanceService
 from .report_service import ReportService
 from .ai_service import AIService
+from .timeseries_service import TimeSeriesService
+from .import_service import ImportService
+from .ingest_stream import IngestStream
 
 __all__ = [
     'AuthService',
@@ -11,5 +14,8 @@ __all__ = [
     'AlertService',
     'MaintenanceService',
     'ReportService',
-    'AIService'
+    'AIService',
+    'TimeSeriesService',
+    'ImportService',
+    'IngestStream'
 ]
\ No newline at end of file
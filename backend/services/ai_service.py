@@ -3,60 +3,70 @@ from typing import List, Dict, Any, Optional, Tuple
 import json
 import numpy as np
 import pandas as pd
-import joblib
 import os
-import requests
-from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
-from lightgbm import LGBMRegressor, LGBMClassifier
 from datetime import datetime, timedelta
 from math import exp, log
-from scipy.stats import weibull_min
 
 from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 
 from config import db
-
-
-OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3:8b")
-
-
-# Definir um modelo de falha padrão para uso quando não houver dados suficientes
-class DefaultFailureModel:
-    def predict_proba(self, X):
-        # Retorna uma probabilidade de 50% para não falha e 50% para falha
-        return np.array([[0.5, 0.5]])
-
-    def predict(self, X):
-        # Retorna 0 (não falha) por padrão
-        return np.array([0])
-
+from services.history_cache import history_cache, ColumnarHistory, _to_epoch_ns
+from services.health_analyzer import HealthAnalyzer
+from services.model_registry import model_registry, MODELS_DIR
+from services.feature_pipeline import FeaturePipeline, FailureModel
+from services.compiled_model import CompiledFailureModel
+from services.weibull import weibull_cache, fit_weibull
+from services.multivariate_anomaly import baseline_cache, MULTIVARIATE_COLUMNS
+from services.snapshot_service import prediction_snapshots, SNAPSHOT_MAX_AGE
+from services.training_service import TrainingService
+from services.category_trainer import CategoryTrainer
+from services.llm_client import llm_client, LLMError, LLMUnavailableError
+from services.recommendation_cache import recommendation_cache, recommendation_fingerprint
+from services.enrichment_service import EnrichmentService, FALLBACK_ACTION
+from utils.downsampling import lttb
+
+
+# Modelos que recebem as features brutas e aplicam o próprio FeaturePipeline
+PIPELINE_MODELS = (FailureModel, CompiledFailureModel)
+
+# Canais usados como features pelos modelos de falha
+FEATURE_COLUMNS = ["hours_used", "temperature", "vibration", "noise_level", "cycles"]
+# Canais analisados em busca de anomalias e tendências
+ANALYSIS_COLUMNS = ["temperature", "vibration", "noise_level", "consumption"]
 
 
 class AIService:
     # Diretório para armazenar modelos treinados
-    MODELS_DIR = "./models/ai"
+    MODELS_DIR = MODELS_DIR
 
     @staticmethod
-    async def _call_ollama_model(prompt: str) -> str:
+    async def _call_ollama_model(prompt: str, timeout: Optional[float] = None) -> str:
         try:
-            headers = {'Content-Type': 'application/json'}
-            data = {
-                "model": OLLAMA_MODEL,
-                "prompt": prompt,
-                "stream": False
-            }
-            response = requests.post(OLLAMA_API_URL, headers=headers, json=data)
-            response.raise_for_status()  # Levanta um erro para status de resposta ruins (4xx ou 5xx)
-            return response.json().get("response", "")
-        except requests.exceptions.RequestException as e:
+            return await llm_client.generate(prompt, timeout=timeout)
+        except LLMUnavailableError as e:
+            print(f"Modelo Ollama indisponível: {e}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Modelo de IA indisponível no momento: {e}"
+            )
+        except LLMError as e:
             print(f"Erro ao chamar o modelo Ollama: {e}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Erro de comunicação com o modelo de IA: {e}"
             )
 
+    @staticmethod
+    async def _generate_recommendation(prompt: str) -> Optional[Dict[str, Any]]:
+        """Gera a recomendação com o Ollama; retorna None se a resposta não for um JSON válido"""
+        response_text = await AIService._call_ollama_model(prompt)
+        try:
+            recommendation = json.loads(response_text)
+        except json.JSONDecodeError:
+            print(f"Erro ao decodificar JSON do Ollama: {response_text}")
+            return None
+        return recommendation if isinstance(recommendation, dict) else None
 
     @staticmethod
     def _calculate_mtbf(failure_history: List[Dict[str, Any]], total_operational_time: float) -> float:
@@ -84,19 +94,10 @@ class AIService:
     @staticmethod
     def _fit_weibull_parameters(failure_times: List[float]) -> Tuple[float, float]:
         """Estima os parâmetros alpha (escala) e beta (forma) da distribuição de Weibull.
-        Requer pelo menos 2 pontos de falha para um ajuste razoável.
+        Requer pelo menos 2 pontos de falha para um ajuste razoável; o método
+        (regressão por postos medianos ou MLE) vem de WEIBULL_FIT_METHOD.
         """
-        if len(failure_times) < 2:
-            # Retorna valores padrão ou levanta um erro se não houver dados suficientes
-            return 1000.0, 2.0  # Exemplo: alpha=1000h, beta=2 (desgaste)
-        try:
-            # Ajusta os parâmetros da distribuição de Weibull aos dados de tempo de falha
-            # loc=0 é assumido para a distribuição de Weibull de 2 parâmetros
-            shape, loc, scale = weibull_min.fit(failure_times, floc=0)
-            return scale, shape
-        except Exception as e:
-            print(f"Erro ao ajustar Weibull: {e}")
-            return 1000.0, 2.0
+        return fit_weibull(failure_times)
 
     @staticmethod
     def _calculate_risk_score(failure_probability: float, component_risk: List[Dict[str, Any]]) -> float:
@@ -116,8 +117,14 @@ class AIService:
         return min(total_risk_score, 100.0)
 
     @staticmethod
-    async def predict_equipment_failure(equipment_id: str, days_ahead: int = 30) -> Dict[str, Any]:
-        """Prevê a probabilidade de falha de um equipamento nos próximos X dias"""
+    async def predict_equipment_failure(equipment_id: str, days_ahead: int = 30, user_id: Optional[str] = None,
+                                        deferred: bool = False) -> Dict[str, Any]:
+        """Prevê a probabilidade de falha de um equipamento nos próximos X dias.
+
+        Com `deferred`, a previsão numérica é devolvida sem esperar o modelo de
+        linguagem: se a recomendação não estiver em cache, ela é gerada em
+        segundo plano e o resultado traz o ID do job em `enrichment`.
+        """
         try:
             equipment_doc = db.collection("equipment").document(equipment_id).get()
             if not equipment_doc.exists:
@@ -126,7 +133,16 @@ class AIService:
                     detail="Equipamento não encontrado"
                 )
             equipment_data = equipment_doc.to_dict()
-            operational_data = equipment_data.get("operational_data", [])
+
+            # Verificar se o equipamento pertence ao usuário
+            if equipment_data["user_id"] != user_id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Acesso não autorizado a este equipamento"
+                )
+
+            # Pode recarregar o histórico completo: fora do loop de eventos
+            history = await run_in_threadpool(history_cache.get, equipment_id, equipment_data.get("readings_count"))
             failure_history = equipment_data.get("failure_history", [])
             total_usage_hours = equipment_data.get("total_usage_hours", 0.0)
 
@@ -135,18 +151,19 @@ class AIService:
             failure_rate = AIService._calculate_failure_rate(mtbf)
 
             # Preparar dados para previsão do modelo de ML
-            if len(operational_data) < 5:
+            if len(history) < 5:
                 # Dados insuficientes para previsão de ML, usar valores padrão ou baseados em MTBF
                 failure_probability_ml = 0.5 # Valor padrão
                 predicted_days_to_failure_ml = days_ahead
+                model_source = None
             else:
-                features, _ = AIService._prepare_data(operational_data)
-                model_path = os.path.join(AIService.MODELS_DIR, f"failure_model_{equipment_data.get('category', 'general')}.joblib")
-                if os.path.exists(model_path):
-                    model = joblib.load(model_path)
-                else:
-                    model = DefaultFailureModel() # Usar modelo padrão
-                failure_probability_ml = model.predict_proba(features)[-1, 1] if hasattr(model, 'predict_proba') else 0.5
+                features, _ = AIService._prepare_data(history)
+                # Modelo do equipamento -> da categoria -> padrão, mantido em cache pelo registro
+                model, model_source = await run_in_threadpool(
+                    model_registry.resolve, equipment_id, equipment_data.get("category")
+                )
+                features = AIService._model_features(model, features)
+                failure_probability_ml = float(model.predict_proba(features[-1:])[0, 1]) if hasattr(model, 'predict_proba') else 0.5
                 predicted_days_to_failure_ml = max(1, int(days_ahead * (1 - failure_probability_ml)))
 
             # Calcular probabilidade de falha com Weibull
@@ -155,7 +172,8 @@ class AIService:
                 # Extrair tempos de falha (assumindo que 'time_at_failure' é em horas de uso)
                 failure_times = [f['time_at_failure'] for f in failure_history if 'time_at_failure' in f]
                 if failure_times:
-                    alpha, beta = AIService._fit_weibull_parameters(failure_times)
+                    # Parâmetros em cache enquanto o failure_history não mudar
+                    alpha, beta = weibull_cache.parameters(equipment_id, failure_times)
                     # Prever probabilidade de falha para o tempo atual + dias_ahead
                     # Convertendo dias_ahead para horas (assumindo 24h/dia de operação para simplificar)
                     future_time_hours = total_usage_hours + (days_ahead * 24)
@@ -166,21 +184,7 @@ class AIService:
             combined_failure_probability = (failure_probability_ml + weibull_prob) / 2.0
             
             # Analisar componentes em risco
-            components_at_risk = []
-            for component in equipment_data.get("components", []):
-                component_name = component.get("name", "Componente desconhecido")
-                health = component.get("health_percentage", 100)
-                current_usage = component.get("current_usage_hours", 0)
-                estimated_lifetime = component.get("estimated_lifetime_hours", 10000)
-                
-                remaining_percentage = (estimated_lifetime - current_usage) / estimated_lifetime * 100
-                if remaining_percentage < 30 or health < 50:
-                    components_at_risk.append({
-                        "name": component_name,
-                        "health": health,
-                        "remaining_life_percentage": remaining_percentage,
-                        "risk_level": "high" if remaining_percentage < 15 or health < 30 else "medium"
-                    })
+            components_at_risk = AIService._components_at_risk(equipment_data)
             
             # Calcular Score de Risco
             risk_score = AIService._calculate_risk_score(combined_failure_probability, components_at_risk)
@@ -189,18 +193,33 @@ class AIService:
             # Por simplicidade, ainda usando a previsão do ML ou uma média
             predicted_days_to_failure = max(1, int(days_ahead * (1 - combined_failure_probability)))
 
-            # Gerar recomendação de ação e dias de falha com Ollama
+            # Gerar recomendação de ação e dias de falha com Ollama (reaproveitada se as entradas quase não mudaram)
             ollama_prompt = f"Baseado na probabilidade de falha de {combined_failure_probability:.2f} para o equipamento {equipment_data.get('name', 'desconhecido')} (ID: {equipment_id}), com MTBF de {mtbf:.2f} horas, taxa de falha de {failure_rate:.4f} e componentes em risco: {components_at_risk}, qual a previsão de dias para falha e qual a ação recomendada? Responda em formato JSON com 'predicted_failure_days' (inteiro) e 'recommended_action' (string)."
-            ollama_response_text = await AIService._call_ollama_model(ollama_prompt)
+            recommendation_key = recommendation_fingerprint(
+                equipment_id, equipment_data.get("name", ""), combined_failure_probability, mtbf, components_at_risk
+            )
+            enrichment = None
+            if deferred and recommendation_cache.get(recommendation_key) is None:
+                job_id = await EnrichmentService.submit(
+                    equipment_id, user_id, recommendation_key, ollama_prompt, predicted_days_to_failure
+                )
+                enrichment = {"job_id": job_id, "status": "pending"}
+                recommendation, recommendation_cached = None, False
+            else:
+                recommendation, recommendation_cached = await recommendation_cache.get_or_create(
+                    recommendation_key, lambda: AIService._generate_recommendation(ollama_prompt)
+                )
             
-            try:
-                ollama_response = json.loads(ollama_response_text)
-                predicted_failure_days_ai = ollama_response.get("predicted_failure_days", predicted_days_to_failure)
-                recommended_action_ai = ollama_response.get("recommended_action", "Nenhuma ação específica recomendada pela IA.")
-            except json.JSONDecodeError:
-                print(f"Erro ao decodificar JSON do Ollama: {ollama_response_text}")
+            if enrichment is not None:
+                # Texto ainda em geração: devolver a estimativa numérica
                 predicted_failure_days_ai = predicted_days_to_failure
-                recommended_action_ai = "Não foi possível obter recomendação detalhada da IA." # Fallback
+                recommended_action_ai = None
+            elif recommendation is not None:
+                predicted_failure_days_ai = recommendation.get("predicted_failure_days", predicted_days_to_failure)
+                recommended_action_ai = recommendation.get("recommended_action", "Nenhuma ação específica recomendada pela IA.")
+            else:
+                predicted_failure_days_ai = predicted_days_to_failure
+                recommended_action_ai = FALLBACK_ACTION # Fallback
 
             return {
                 "failure_probability": combined_failure_probability,
@@ -211,7 +230,10 @@ class AIService:
                 "mtbf": mtbf,
                 "failure_rate": failure_rate,
                 "weibull_probability": weibull_prob,
-                "risk_score": risk_score
+                "risk_score": risk_score,
+                "model_source": model_source,
+                "recommendation_cached": recommendation_cached,
+                "enrichment": enrichment
             }
         except HTTPException:
             raise
@@ -222,7 +244,279 @@ class AIService:
             )
     
     @staticmethod
-    async def recommend_maintenance_schedule(equipment_id: str) -> Dict[str, Any]:
+    async def get_prediction_snapshot(equipment_id: str, user_id: str, max_age: float = SNAPSHOT_MAX_AGE) -> Dict[str, Any]:
+        """Previsão pré-calculada do equipamento, recalculada se tiver mais de max_age segundos"""
+        return await prediction_snapshots.get_snapshot(equipment_id, user_id, max_age)
+    
+    @staticmethod
+    async def list_prediction_snapshots(user_id: str, max_age: float = SNAPSHOT_MAX_AGE,
+                                        category: Optional[str] = None) -> Dict[str, Any]:
+        """Previsões pré-calculadas da frota do usuário, com as mais antigas que max_age marcadas"""
+        return await prediction_snapshots.list_snapshots(user_id, max_age, category)
+    
+    @staticmethod
+    async def get_prediction_enrichment(job_id: str, user_id: str) -> Dict[str, Any]:
+        """Consulta a recomendação gerada em segundo plano para uma previsão"""
+        return await EnrichmentService.get_job(job_id, user_id)
+    
+    @staticmethod
+    async def get_training_job(job_id: str, user_id: str) -> Dict[str, Any]:
+        """Estado e progresso de um treino enfileirado"""
+        return await TrainingService.get_job(job_id, user_id)
+    
+    @staticmethod
+    async def cancel_training_job(job_id: str, user_id: str) -> Dict[str, Any]:
+        """Solicita o cancelamento de um treino enfileirado ou em execução"""
+        return await TrainingService.cancel_job(job_id, user_id)
+    
+    @staticmethod
+    def get_model_registry_stats() -> Dict[str, Any]:
+        """Métricas do cache de modelos (acertos, carregamentos, evicções), dos parâmetros de Weibull
+        e das linhas de base multivariadas"""
+        return {**model_registry.stats(), "weibull": weibull_cache.stats(), "anomaly_baselines": baseline_cache.stats()}
+    
+    @staticmethod
+    def get_llm_stats() -> Dict[str, Any]:
+        """Métricas do cliente do modelo de linguagem (fila, gerações, tempos) e do cache de recomendações"""
+        return {**llm_client.stats(), "recommendation_cache": recommendation_cache.stats()}
+    
+    @staticmethod
+    def _components_at_risk(equipment_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Lista os componentes com vida útil restante baixa ou saúde comprometida"""
+        components_at_risk = []
+        for component in equipment_data.get("components", []):
+            component_name = component.get("name", "Componente desconhecido")
+            health = component.get("health_percentage", 100)
+            current_usage = component.get("current_usage_hours", 0)
+            estimated_lifetime = component.get("estimated_lifetime_hours", 10000)
+            
+            remaining_percentage = (estimated_lifetime - current_usage) / estimated_lifetime * 100
+            if remaining_percentage < 30 or health < 50:
+                components_at_risk.append({
+                    "name": component_name,
+                    "health": health,
+                    "remaining_life_percentage": remaining_percentage,
+                    "risk_level": "high" if remaining_percentage < 15 or health < 30 else "medium"
+                })
+        return components_at_risk
+
+    @staticmethod
+    def _fleet_features(analyzers: List[HealthAnalyzer], latest: np.ndarray) -> np.ndarray:
+        """Padroniza a leitura mais recente de cada equipamento com as estatísticas do health_state.
+
+        Usado pelos modelos sem FeaturePipeline, treinados sobre o histórico
+        padronizado do próprio equipamento.
+        """
+        latest = np.nan_to_num(latest, nan=0.0)
+        means = np.array([[a.stats[c].mean for c in FEATURE_COLUMNS] for a in analyzers])
+        stds = np.array([[a.stats[c].population_std for c in FEATURE_COLUMNS] for a in analyzers])
+        return np.divide(latest - means, stds, out=np.zeros_like(latest), where=stds > 0)
+
+    @staticmethod
+    async def predict_fleet_failure(user_id: str, category: Optional[str] = None, days_ahead: int = 30,
+                                    limit: Optional[int] = None) -> Dict[str, Any]:
+        """Prevê a falha de todos os equipamentos do usuário (ou de uma categoria) de uma vez.
+
+        Uma única consulta ao Firestore; as features vêm do health_state de cada
+        equipamento, com um predict_proba por modelo e o cálculo de Weibull e do
+        score de risco vetorizados. Não consulta o modelo de linguagem.
+        """
+        try:
+            query = db.collection("equipment").where("user_id", "==", user_id)
+            if category:
+                query = query.where("category", "==", category)
+            equipment = [doc.to_dict() for doc in await run_in_threadpool(lambda: list(query.stream()))]
+
+            # Carrega modelos e ajusta Weibull: fora do loop de eventos
+            predictions = await run_in_threadpool(AIService._fleet_predictions, equipment, days_ahead)
+            ranking = sorted(predictions, key=lambda p: -p["risk_score"])
+            if limit:
+                ranking = ranking[:limit]
+
+            return {"days_ahead": days_ahead, "count": len(equipment), "equipment": ranking}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Erro ao prever falhas da frota: {str(e)}"
+            )
+
+    @staticmethod
+    def _fleet_predictions(equipment: List[Dict[str, Any]], days_ahead: int) -> List[Dict[str, Any]]:
+        """Previsão vetorizada de uma lista de documentos de equipamento, na mesma ordem"""
+        if not equipment:
+            return []
+
+        n = len(equipment)
+        analyzers = [HealthAnalyzer.from_dict(e.get("health_state")) for e in equipment]
+        # Leitura mais recente de cada equipamento (NaN quando o canal nunca foi recebido)
+        latest = np.vstack([a.latest(FEATURE_COLUMNS) for a in analyzers])
+        standardized = None
+
+        # Probabilidade do modelo de ML: um predict_proba por modelo resolvido
+        ml_probability = np.full(n, 0.5)
+        model_sources: List[Optional[str]] = [None] * n
+        groups: Dict[int, Tuple[Any, List[int]]] = {}
+        for i, equipment_data in enumerate(equipment):
+            if equipment_data.get("readings_count", 0) < 5:
+                continue
+            model, model_sources[i] = model_registry.resolve(equipment_data["id"], equipment_data.get("category"))
+            groups.setdefault(id(model), (model, []))[1].append(i)
+        for model, indices in groups.values():
+            if not hasattr(model, "predict_proba"):
+                continue
+            if isinstance(model, PIPELINE_MODELS):
+                features = latest[indices]
+            else:
+                if standardized is None:
+                    standardized = AIService._fleet_features(analyzers, latest)
+                features = standardized[indices]
+            ml_probability[indices] = model.predict_proba(features)[:, 1]
+
+        # MTBF e taxa de falha
+        total_hours = np.array([float(e.get("total_usage_hours", 0.0)) for e in equipment])
+        failures = np.array([len(e.get("failure_history", [])) for e in equipment])
+        mtbf = np.where(failures > 0, total_hours / np.maximum(failures, 1), total_hours)
+        failure_rate = np.divide(1.0, mtbf, out=np.full(n, np.inf), where=mtbf > 0)
+
+        # Weibull: parâmetros em cache por equipamento, os que faltam ajustados em lote
+        alpha = np.ones(n)
+        beta = np.ones(n)
+        has_weibull = np.zeros(n, dtype=bool)
+        weibull_ids: List[str] = []
+        weibull_times: List[List[float]] = []
+        for i, equipment_data in enumerate(equipment):
+            failure_history = equipment_data.get("failure_history", [])
+            failure_times = [f["time_at_failure"] for f in failure_history if "time_at_failure" in f]
+            if len(failure_history) >= 2 and failure_times:
+                has_weibull[i] = True
+                weibull_ids.append(equipment_data["id"])
+                weibull_times.append(failure_times)
+        if weibull_ids:
+            alpha[has_weibull], beta[has_weibull] = weibull_cache.parameters_batch(weibull_ids, weibull_times)
+        future_hours = total_hours + days_ahead * 24
+        valid = has_weibull & (alpha > 0) & (beta > 0)
+        weibull_probability = np.where(
+            valid, 1 - np.exp(-np.power(np.maximum(future_hours, 0) / alpha, beta)), 0.0
+        )
+
+        combined = (ml_probability + weibull_probability) / 2.0
+
+        # Score de risco: 70% probabilidade de falha, 30% risco dos componentes
+        components = [AIService._components_at_risk(e) for e in equipment]
+        component_score = np.array([
+            sum(30 if c["risk_level"] == "high" else 15 for c in comps) for comps in components
+        ], dtype=float)
+        risk_score = np.minimum(combined * 100 * 0.7 + np.minimum(component_score, 100) * 0.3, 100.0)
+        predicted_days = np.maximum(1, (days_ahead * (1 - combined)).astype(int))
+
+        return [
+            {
+                "equipment_id": equipment[i]["id"],
+                "name": equipment[i].get("name"),
+                "category": equipment[i].get("category"),
+                "risk_level": equipment[i].get("risk_level", "low"),
+                "failure_probability": float(combined[i]),
+                "ml_probability": float(ml_probability[i]),
+                "weibull_probability": float(weibull_probability[i]),
+                "risk_score": float(risk_score[i]),
+                "mtbf": float(mtbf[i]),
+                "failure_rate": float(failure_rate[i]),
+                "predicted_days_to_failure": int(predicted_days[i]),
+                "components_at_risk": components[i],
+                "model_source": model_sources[i]
+            }
+            for i in range(n)
+        ]
+
+    @staticmethod
+    async def detect_fleet_anomalies(user_id: str, category: Optional[str] = None, window: int = 1,
+                                     limit: Optional[int] = None) -> Dict[str, Any]:
+        """Detecta anomalias multivariadas nas leituras recentes de todos os equipamentos do usuário.
+
+        As últimas `window` leituras de cada equipamento (do health_state) são
+        comparadas, pela distância de Mahalanobis, com a linha de base da sua
+        categoria: uma chamada vetorizada por categoria, com as linhas de base
+        em cache.
+        """
+        try:
+            query = db.collection("equipment").where("user_id", "==", user_id)
+            if category:
+                query = query.where("category", "==", category)
+            equipment = [doc.to_dict() for doc in await run_in_threadpool(lambda: list(query.stream()))]
+
+            groups: Dict[Optional[str], List[int]] = {}
+            for i, equipment_data in enumerate(equipment):
+                groups.setdefault(equipment_data.get("category"), []).append(i)
+
+            results: List[Dict[str, Any]] = []
+            baselines: Dict[str, Any] = {}
+            for group_category, indices in groups.items():
+                baseline = None
+                if group_category:
+                    baseline = await run_in_threadpool(baseline_cache.baseline, group_category)
+                    baselines[group_category] = baseline.to_dict() if baseline is not None else None
+
+                windows = [
+                    HealthAnalyzer.from_dict(equipment[i].get("health_state")).window(MULTIVARIATE_COLUMNS, window)
+                    for i in indices
+                ]
+                if baseline is None:
+                    results.extend({
+                        "equipment_id": equipment[i]["id"],
+                        "name": equipment[i].get("name"),
+                        "category": group_category,
+                        "score": None,
+                        "anomalous_readings": 0,
+                        "readings": len(rows),
+                        "contributions": {}
+                    } for i, rows in zip(indices, windows))
+                    continue
+
+                # Todas as leituras da categoria avaliadas de uma vez
+                selected = [MULTIVARIATE_COLUMNS.index(c) for c in baseline.columns]
+                counts = np.array([len(rows) for rows in windows])
+                rows = np.vstack(windows)[:, selected] if counts.sum() else np.empty((0, len(selected)))
+                scores = baseline.distances(rows)
+                contributions = baseline.contributions(rows)
+                ends = np.cumsum(counts)
+
+                for i, count, end in zip(indices, counts, ends):
+                    start = end - count
+                    worst = start + int(np.argmax(scores[start:end])) if count else None
+                    results.append({
+                        "equipment_id": equipment[i]["id"],
+                        "name": equipment[i].get("name"),
+                        "category": group_category,
+                        "score": float(scores[worst]) if count else None,
+                        "anomalous_readings": int((scores[start:end] > baseline.threshold).sum()),
+                        "readings": int(count),
+                        "contributions": dict(zip(baseline.columns, contributions[worst].tolist())) if count else {}
+                    })
+
+            results.sort(key=lambda r: -1.0 if r["score"] is None else r["score"], reverse=True)
+            # Contado antes do corte por `limit`, como `count`, sobre a frota inteira
+            anomalous = sum(1 for r in results if r["anomalous_readings"])
+            if limit:
+                results = results[:limit]
+
+            return {
+                "count": len(equipment),
+                "anomalous": anomalous,
+                "baselines": baselines,
+                "equipment": results
+            }
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Erro ao detectar anomalias da frota: {str(e)}"
+            )
+
+    @staticmethod
+    async def recommend_maintenance_schedule(equipment_id: str, user_id: str) -> Dict[str, Any]:
         """Recomenda um cronograma de manutenção para o equipamento"""
         try:
             equipment_doc = db.collection("equipment").document(equipment_id).get()
@@ -232,6 +526,13 @@ class AIService:
                     detail="Equipamento não encontrado"
                 )
             equipment_data = equipment_doc.to_dict()
+
+            # Verificar se o equipamento pertence ao usuário
+            if equipment_data["user_id"] != user_id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Acesso não autorizado a este equipamento"
+                )
             
             maintenance_docs = db.collection("maintenance").where("equipment_id", "==", equipment_id).where("status", "==", "completed").stream()
             maintenance_history = []
@@ -303,45 +604,18 @@ class AIService:
             )
 
     @staticmethod
-    def _prepare_data(operational_data: List[Dict[str, Any]]) -> Tuple[pd.DataFrame, pd.Series]:
-        """Prepara os dados operacionais para o modelo de ML."""
-        df = pd.DataFrame(operational_data)
-        # Exemplo: converter timestamp para datetime e extrair features de tempo
-        if 'timestamp' in df.columns:
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            df['hour'] = df['timestamp'].dt.hour
-            df['day_of_week'] = df['timestamp'].dt.dayofweek
-        
-        # Exemplo: selecionar features e target
-        # Supondo que 'temperature', 'vibration', 'pressure' são features e 'failure_imminent' é o target
-        features = df[['temperature', 'vibration', 'pressure']] # Adicione mais features conforme necessário
-        target = pd.Series([0] * len(df)) # Target dummy, pois o modelo é para previsão de falha, não classificação direta aqui
-        
-        return features, target
-
-    @staticmethod
-    def _get_default_model():
-        """Retorna um modelo padrão para previsão de falhas quando não há modelo treinado."""
-        # Um modelo simples que sempre prevê uma probabilidade média
-        class DefaultModel:
-            def predict_proba(self, X):
-                return np.array([[0.5, 0.5]]) # 50% de chance de falha
-        return DefaultModel()
-
-
-class DefaultFailureModel:
-    """Um modelo de falha padrão para quando não há dados suficientes para treinar um modelo real."""
-    def predict_proba(self, X):
-        # Retorna uma probabilidade de 50% para 'não falha' e 50% para 'falha'
-        return np.array([[0.5, 0.5]])
-
-    def predict(self, X):
-        # Retorna 0 (não falha) ou 1 (falha) com base na probabilidade
-        return np.array([1 if self.predict_proba(X)[0, 1] > 0.5 else 0])
-
-    @staticmethod
-    async def analyze_operational_data(equipment_id: str) -> Dict[str, Any]:
-        """Analisa dados operacionais para identificar padrões e anomalias"""
+    async def analyze_operational_data(equipment_id: str, user_id: str, start: Optional[datetime] = None,
+                                       end: Optional[datetime] = None, window: int = 5,
+                                       max_points: int = 500, anomaly_limit: int = 50,
+                                       anomaly_offset: int = 0) -> Dict[str, Any]:
+        """Analisa dados operacionais para identificar padrões e anomalias.
+
+        Tudo é calculado sobre os arrays do histórico colunar, restritos ao
+        intervalo [start, end]. As médias móveis são reduzidas a no máximo
+        `max_points` pontos (LTTB) e as anomalias de cada canal são paginadas
+        por `anomaly_offset`/`anomaly_limit`, de modo que o tamanho da resposta
+        não depende do tamanho do histórico.
+        """
         try:
             equipment_doc = db.collection("equipment").document(equipment_id).get()
             if not equipment_doc.exists:
@@ -350,70 +624,159 @@ class DefaultFailureModel:
                     detail="Equipamento não encontrado"
                 )
             equipment_data = equipment_doc.to_dict()
-            operational_data = equipment_data.get("operational_data", [])
 
-            if not operational_data:
+            # Verificar se o equipamento pertence ao usuário
+            if equipment_data["user_id"] != user_id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Acesso não autorizado a este equipamento"
+                )
+
+            history = await run_in_threadpool(history_cache.get, equipment_id, equipment_data.get("readings_count"))
+
+            # Histórico ordenado pela data: o intervalo é uma fatia obtida por busca binária
+            first = int(np.searchsorted(history.dates, _to_epoch_ns([start])[0], side="left")) if start else 0
+            last = int(np.searchsorted(history.dates, _to_epoch_ns([end])[0], side="right")) if end else len(history)
+            dates = history.dates[first:last]
+            columns = {column: values[first:last] for column, values in history.columns.items()}
+
+            if not len(dates):
                 return {
                     "message": "Nenhum dado operacional disponível para análise."
                 }
 
-            df = pd.DataFrame(operational_data)
-
-            # Converter timestamp para datetime e definir como índice
-            if 'timestamp' in df.columns:
-                df['timestamp'] = pd.to_datetime(df['timestamp'])
-                df = df.set_index('timestamp')
-                df = df.sort_index()
-
-            analysis_results = {}
+            analysis_results: Dict[str, Any] = {
+                "range": {
+                    "start": AIService._iso_dates(dates[:1])[0],
+                    "end": AIService._iso_dates(dates[-1:])[0],
+                    "readings": len(dates)
+                }
+            }
 
             # Análise Descritiva
-            analysis_results['descriptive_statistics'] = df.describe().to_dict()
+            analysis_results['descriptive_statistics'] = {
+                column: AIService._describe(values) for column, values in columns.items()
+            }
 
-            # Detecção de Anomalias (Exemplo simples: IQR)
+            # Detecção de Anomalias (Exemplo simples: IQR), paginada por canal
             anomalies = {}
-            for column in ['temperature', 'vibration', 'pressure']:
-                if column in df.columns:
-                    Q1 = df[column].quantile(0.25)
-                    Q3 = df[column].quantile(0.75)
-                    IQR = Q3 - Q1
-                    lower_bound = Q1 - 1.5 * IQR
-                    upper_bound = Q3 + 1.5 * IQR
-                    
-                    anomalous_data = df[(df[column] < lower_bound) | (df[column] > upper_bound)]
-                    if not anomalous_data.empty:
-                        anomalies[column] = anomalous_data.to_dict(orient='records')
+            for column in ANALYSIS_COLUMNS:
+                values = columns[column]
+                observed = ~np.isnan(values)
+                if not observed.any():
+                    continue
+                q1, q3 = np.percentile(values[observed], [25, 75])
+                iqr = q3 - q1
+                lower_bound, upper_bound = q1 - 1.5 * iqr, q3 + 1.5 * iqr
+                anomalous = np.flatnonzero(observed & ((values < lower_bound) | (values > upper_bound)))
+                if not len(anomalous):
+                    continue
+                page = anomalous[anomaly_offset:anomaly_offset + anomaly_limit]
+                anomalies[column] = {
+                    "lower_bound": float(lower_bound),
+                    "upper_bound": float(upper_bound),
+                    "total": len(anomalous),
+                    "offset": anomaly_offset,
+                    "limit": anomaly_limit,
+                    "items": [
+                        {"date": date, "value": float(value)}
+                        for date, value in zip(AIService._iso_dates(dates[page]), values[page])
+                    ]
+                }
             analysis_results['anomalies'] = anomalies
 
-            # Análise de Tendências (Exemplo: média móvel)
+            # Análise de Tendências (média móvel), reduzida para no máximo max_points pontos
             trends = {}
-            for column in ['temperature', 'vibration', 'pressure']:
-                if column in df.columns:
-                    trends[column] = df[column].rolling(window=5).mean().dropna().to_dict()
+            for column in ANALYSIS_COLUMNS:
+                rolling = AIService._rolling_mean(columns[column], window)
+                valid = np.flatnonzero(~np.isnan(rolling))
+                if not len(valid):
+                    continue
+                kept = valid[lttb(dates[valid], rolling[valid], max_points)]
+                trends[column] = {
+                    "points": len(valid),
+                    "dates": AIService._iso_dates(dates[kept]),
+                    "values": rolling[kept].tolist()
+                }
             analysis_results['trends'] = trends
 
-            # Correlação de Pearson
-            correlation_matrix = {}
-            numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
-            if len(numeric_cols) > 1:
-                correlation_matrix = df[numeric_cols].corr(method='pearson').to_dict()
-            analysis_results['correlation_matrix'] = correlation_matrix
+            # Correlação de Pearson (pares de leituras em que ambos os canais foram medidos)
+            analysis_results['correlation_matrix'] = AIService._correlation(columns)
 
             return analysis_results
 
         except HTTPException:
             raise
         except Exception as e:
-
-
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Erro ao analisar dados operacionais: {str(e)}"
             )
     
     @staticmethod
-    async def train_custom_model(equipment_id: str, user_id: str) -> Dict[str, Any]:
-        """Treina um modelo personalizado para um equipamento específico"""
+    def _iso_dates(dates: np.ndarray) -> List[str]:
+        """Datas em nanossegundos desde a época (UTC) para ISO 8601"""
+        return np.datetime_as_string(dates.astype("datetime64[ns]"), unit="ms", timezone="UTC").tolist()
+    
+    @staticmethod
+    def _describe(values: np.ndarray) -> Dict[str, Optional[float]]:
+        """Mesmas estatísticas do DataFrame.describe(), ignorando valores ausentes"""
+        observed = values[~np.isnan(values)]
+        if not len(observed):
+            return {"count": 0.0, "mean": None, "std": None, "min": None, "25%": None, "50%": None, "75%": None, "max": None}
+        q1, median, q3 = np.percentile(observed, [25, 50, 75])
+        return {
+            "count": float(len(observed)),
+            "mean": float(observed.mean()),
+            "std": float(observed.std(ddof=1)) if len(observed) > 1 else None,
+            "min": float(observed.min()),
+            "25%": float(q1),
+            "50%": float(median),
+            "75%": float(q3),
+            "max": float(observed.max())
+        }
+    
+    @staticmethod
+    def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+        """Média móvel por somas acumuladas; NaN enquanto a janela tiver menos de `window` valores ou algum ausente"""
+        result = np.full(len(values), np.nan)
+        if len(values) < window:
+            return result
+        missing = np.isnan(values)
+        sums = np.concatenate([[0.0], np.cumsum(np.where(missing, 0.0, values))])
+        gaps = np.concatenate([[0], np.cumsum(missing)])
+        window_sums = sums[window:] - sums[:-window]
+        window_gaps = gaps[window:] - gaps[:-window]
+        result[window - 1:] = np.where(window_gaps == 0, window_sums / window, np.nan)
+        return result
+    
+    @staticmethod
+    def _correlation(columns: Dict[str, np.ndarray]) -> Dict[str, Dict[str, Optional[float]]]:
+        """Correlação de Pearson entre canais, usando as leituras em que ambos foram medidos"""
+        names = [name for name, values in columns.items() if (~np.isnan(values)).any()]
+        if len(names) < 2:
+            return {}
+        matrix: Dict[str, Dict[str, Optional[float]]] = {name: {} for name in names}
+        for i, a in enumerate(names):
+            for b in names[i:]:
+                both = ~np.isnan(columns[a]) & ~np.isnan(columns[b])
+                x, y = columns[a][both], columns[b][both]
+                if len(x) < 2 or x.std() == 0 or y.std() == 0:
+                    value = None
+                else:
+                    value = float(np.corrcoef(x, y)[0, 1])
+                matrix[a][b] = matrix[b][a] = value
+        return matrix
+    
+    @staticmethod
+    async def train_custom_model(equipment_id: str, user_id: str, mode: str = "auto") -> Dict[str, Any]:
+        """Enfileira o treino de um modelo personalizado para um equipamento específico.
+
+        O treino roda no pool de processos do TrainingService; a resposta traz
+        o ID do job, consultável em /ai/train/jobs/{job_id}. No modo auto, o
+        modelo existente é continuado apenas com as leituras novas quando a
+        política de retreino permite.
+        """
         try:
             # Buscar dados do equipamento
             equipment_doc = db.collection("equipment").document(equipment_id).get()
@@ -433,40 +796,29 @@ class DefaultFailureModel:
                     detail="Acesso não autorizado a este equipamento"
                 )
             
-            operational_data = equipment_data.get("operational_data", [])
+            history = await run_in_threadpool(history_cache.get, equipment_id, equipment_data.get("readings_count"))
             
             # Verificar se há dados suficientes para treinamento
-            if len(operational_data) < 10:
+            if len(history) < 10:
                 return {
                     "success": False,
                     "message": "Dados insuficientes para treinamento do modelo. São necessários pelo menos 10 registros.",
-                    "model_type": None,
-                    "accuracy": None
+                    "job_id": None,
+                    "status": None
                 }
             
-            # Preparar dados para treinamento
-            features, target = AIService._prepare_data(operational_data, for_training=True)
-            
-            # Treinar modelo
-            model = LGBMClassifier(n_estimators=100, random_state=42)
-            model.fit(features, target)
-            
-            # Avaliar modelo (simplificado)
-            accuracy = model.score(features, target)
-            
-            # Criar diretório para modelos se não existir
-            os.makedirs(AIService.MODELS_DIR, exist_ok=True)
-            
-            # Salvar modelo
-            category = equipment_data.get("category", "general")
-            model_path = os.path.join(AIService.MODELS_DIR, f"failure_model_{category}_{equipment_id}.joblib")
-            joblib.dump(model, model_path)
+            # Preparar dados para treinamento; o ajuste do pipeline e do modelo acontece no processo de treino
+            features, target = AIService._prepare_data(history, for_training=True)
+            job = await TrainingService.submit(
+                equipment_id, user_id, equipment_data.get("category"), FEATURE_COLUMNS, features, target,
+                history.dates, mode=mode
+            )
             
             return {
                 "success": True,
-                "message": "Modelo treinado com sucesso",
-                "model_type": "LightGBM Classifier",
-                "accuracy": accuracy
+                "message": "Treinamento do modelo enfileirado",
+                "job_id": job["id"],
+                "status": job["status"]
             }
         except HTTPException:
             raise
@@ -477,40 +829,75 @@ class DefaultFailureModel:
             )
     
     @staticmethod
-    def _prepare_data(operational_data: List[Dict[str, Any]], for_training: bool = False) -> Tuple[np.ndarray, Optional[np.ndarray]]:
-        """Prepara dados operacionais para análise ou treinamento"""
-        # Extrair features relevantes
-        features_list = []
-        for data in operational_data:
-            features = [
-                data.get("hours_used", 0),
-                data.get("temperature", 0) or 0,
-                data.get("vibration", 0) or 0,
-                data.get("noise_level", 0) or 0,
-                data.get("cycles", 0) or 0
-            ]
-            features_list.append(features)
-        
-        features_array = np.array(features_list)
-        
-        # Normalizar features
-        scaler = StandardScaler()
-        features_scaled = scaler.fit_transform(features_array)
+    async def train_category_model(category: str, user_id: str, role: str = "user") -> Dict[str, Any]:
+        """Enfileira o treino do modelo de uma categoria com as leituras de toda a frota da categoria.
+
+        O modelo publicado (failure_model_{categoria}) é usado por todos os
+        equipamentos da categoria que não têm modelo próprio, de todos os
+        usuários; por isso apenas administradores podem treiná-lo.
+        """
+        if role != "admin":
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Acesso restrito a administradores"
+            )
+
+        # A categoria precisa ter ao menos um equipamento
+        existing = await run_in_threadpool(lambda: list(
+            db.collection("equipment").where("category", "==", category).limit(1).stream()
+        ))
+        if not existing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Nenhum equipamento nesta categoria"
+            )
+
+        job = await TrainingService.submit_category(
+            category, user_id, lambda stop, progress: CategoryTrainer.collect(category, stop, progress)
+        )
+        return {
+            "success": True,
+            "message": "Treinamento do modelo da categoria enfileirado",
+            "job_id": job["id"],
+            "status": job["status"]
+        }
+    
+    @staticmethod
+    def _prepare_data(history: ColumnarHistory, for_training: bool = False) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Prepara dados operacionais para análise ou treinamento.
+
+        As features saem brutas (NaN nos canais ausentes); a padronização é
+        feita pelo FeaturePipeline salvo com o modelo.
+        """
+        # Extrair features relevantes diretamente das colunas do histórico
+        features_array = history.matrix(FEATURE_COLUMNS, fill_value=np.nan)
         
         # Para treinamento, criar target (simplificado)
         if for_training:
             # Simular target: 1 se temperatura > 80 ou vibração > 0.8, caso contrário 0
-            target = np.array([
-                1 if (data.get("temperature", 0) or 0) > 80 or (data.get("vibration", 0) or 0) > 0.8 else 0
-                for data in operational_data
-            ])
-            return features_scaled, target
+            temperature = np.nan_to_num(history.columns["temperature"])
+            vibration = np.nan_to_num(history.columns["vibration"])
+            target = ((temperature > 80) | (vibration > 0.8)).astype(int)
+            return features_array, target
         
-        return features_scaled, None
+        return features_array, None
+    
+    @staticmethod
+    def _model_features(model: Any, features: np.ndarray) -> np.ndarray:
+        """Adapta as features brutas ao modelo resolvido.
+
+        FailureModel e CompiledFailureModel aplicam o próprio pipeline; modelos salvos antes deles
+        esperam o histórico padronizado pelas estatísticas da própria série.
+        """
+        if isinstance(model, PIPELINE_MODELS):
+            return features
+        return FeaturePipeline(FEATURE_COLUMNS).fit_transform(np.nan_to_num(features, nan=0.0))
     
     @staticmethod
     def _get_default_model():
         """Retorna um modelo padrão pré-treinado"""
+        from sklearn.ensemble import RandomForestClassifier
+
         # Criar modelo simples
         model = RandomForestClassifier(n_estimators=50, random_state=42)
         
@@ -0,0 +1,194 @@
+from typing import List, Dict, Any, Optional
+import math
+import os
+
+from services.timeseries_service import _as_utc
+
+
+# Canais monitorados pelo detector online
+ANOMALY_CHANNELS = ("temperature", "vibration", "noise_level", "consumption")
+# Leituras de um canal antes de começar a sinalizar anomalias
+ANOMALY_WARMUP = int(os.getenv("ANOMALY_WARMUP", "30"))
+# Fator das cercas de Tukey (mesma regra IQR da análise de dados operacionais)
+ANOMALY_IQR_FACTOR = float(os.getenv("ANOMALY_IQR_FACTOR", "1.5"))
+# Peso da leitura mais recente na média/variância exponencial
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.1"))
+# Desvio (em desvios-padrão exponenciais) a partir do qual uma leitura é anômala
+ANOMALY_EWMA_Z = float(os.getenv("ANOMALY_EWMA_Z", "4.0"))
+# Anomalias recentes mantidas no documento do equipamento
+ANOMALY_RECENT = int(os.getenv("ANOMALY_RECENT", "20"))
+
+
+class P2Quantile:
+    """Estimador P² (Jain & Chlamtac) de um quantil em fluxo contínuo.
+
+    Mantém apenas 5 marcadores (alturas `q` e posições `n`), ajustados por
+    interpolação parabólica a cada valor: O(1) de tempo e memória. As posições
+    desejadas dos marcadores dependem só da contagem e não são persistidas.
+    """
+
+    def __init__(self, p: float, q: Optional[List[float]] = None, n: Optional[List[int]] = None):
+        self.p = p
+        self.q = list(q or [])
+        self.n = list(n or [])
+
+    @property
+    def count(self) -> int:
+        return self.n[4] + 1 if self.n else len(self.q)
+
+    def _desired(self) -> List[float]:
+        p, extra = self.p, self.count - 5
+        return [0.0, 2 * p + extra * p / 2, 4 * p + extra * p, 2 + 2 * p + extra * (1 + p) / 2, 4.0 + extra]
+
+    def push(self, x: float) -> None:
+        if not self.n:
+            self.q.append(x)
+            if len(self.q) == 5:
+                self.q.sort()
+                self.n = [0, 1, 2, 3, 4]
+            return
+
+        q, n = self.q, self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+
+        desired = self._desired()
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def value(self) -> Optional[float]:
+        if self.n:
+            return self.q[2]
+        if not self.q:
+            return None
+        ordered = sorted(self.q)
+        position = self.p * (len(ordered) - 1)
+        low = int(math.floor(position))
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"q": self.q, "n": self.n}
+
+    @classmethod
+    def from_dict(cls, p: float, data: Optional[Dict[str, Any]]) -> "P2Quantile":
+        data = data or {}
+        return cls(p, data.get("q"), data.get("n"))
+
+
+class ChannelDetector:
+    """Detector online de um canal: cercas IQR (quartis via P²) e desvio da média exponencial.
+
+    Cada leitura é avaliada contra o estado anterior a ela e só depois
+    incorporada, de modo que um pico não mascara a si mesmo.
+    """
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        data = data or {}
+        self.q1 = P2Quantile.from_dict(0.25, data.get("q1"))
+        self.median = P2Quantile.from_dict(0.5, data.get("median"))
+        self.q3 = P2Quantile.from_dict(0.75, data.get("q3"))
+        self.ewma_mean: Optional[float] = data.get("ewma_mean")
+        self.ewma_var: float = data.get("ewma_var", 0.0)
+
+    @property
+    def count(self) -> int:
+        return self.median.count
+
+    def score(self, value: float) -> Optional[Dict[str, Any]]:
+        """Retorna os detalhes da anomalia, ou None se a leitura for normal"""
+        if self.count < ANOMALY_WARMUP:
+            return None
+        rules = []
+        q1, median, q3 = self.q1.value(), self.median.value(), self.q3.value()
+        iqr = q3 - q1
+        lower_bound, upper_bound = q1 - ANOMALY_IQR_FACTOR * iqr, q3 + ANOMALY_IQR_FACTOR * iqr
+        # Com IQR nulo (sensor quase constante) as cercas sinalizariam qualquer variação
+        if iqr > 0 and not lower_bound <= value <= upper_bound:
+            rules.append("iqr")
+        ewma_std = math.sqrt(self.ewma_var)
+        ewma_z = (value - self.ewma_mean) / ewma_std if ewma_std > 0 else 0.0
+        if abs(ewma_z) > ANOMALY_EWMA_Z:
+            rules.append("ewma")
+        if not rules:
+            return None
+        return {
+            "value": value,
+            "rules": rules,
+            "median": median,
+            "lower_bound": lower_bound,
+            "upper_bound": upper_bound,
+            "ewma_z": ewma_z
+        }
+
+    def push(self, value: float) -> None:
+        self.q1.push(value)
+        self.median.push(value)
+        self.q3.push(value)
+        if self.ewma_mean is None:
+            self.ewma_mean = value
+            return
+        diff = value - self.ewma_mean
+        increment = ANOMALY_EWMA_ALPHA * diff
+        self.ewma_mean += increment
+        self.ewma_var = (1 - ANOMALY_EWMA_ALPHA) * (self.ewma_var + diff * increment)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "q1": self.q1.to_dict(),
+            "median": self.median.to_dict(),
+            "q3": self.q3.to_dict(),
+            "ewma_mean": self.ewma_mean,
+            "ewma_var": self.ewma_var
+        }
+
+
+class AnomalyDetector:
+    """Detecção de anomalias em tempo real, avaliada a cada leitura ingerida.
+
+    O estado (marcadores P² e médias exponenciais de cada canal) fica no
+    campo `anomaly_state` do documento do equipamento e é atualizado na
+    mesma transação da ingestão; cada leitura custa O(1).
+    """
+
+    def __init__(self, channels: Optional[Dict[str, ChannelDetector]] = None):
+        self.channels = channels or {channel: ChannelDetector() for channel in ANOMALY_CHANNELS}
+
+    def push(self, reading: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Avalia e incorpora uma leitura; retorna as anomalias encontradas nela"""
+        anomalies = []
+        for channel, detector in self.channels.items():
+            value = reading.get(channel)
+            if value is None or not math.isfinite(value):
+                continue
+            anomaly = detector.score(float(value))
+            if anomaly is not None:
+                anomalies.append({"channel": channel, "date": _as_utc(reading["date"]), **anomaly})
+            detector.push(float(value))
+        return anomalies
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {channel: detector.to_dict() for channel, detector in self.channels.items()}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "AnomalyDetector":
+        data = data or {}
+        return cls({channel: ChannelDetector(data.get(channel)) for channel in ANOMALY_CHANNELS})
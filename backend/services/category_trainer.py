@@ -0,0 +1,104 @@
+from typing import List, Dict, Any, Optional, Tuple
+import os
+import threading
+
+import numpy as np
+
+from config import db
+from services.history_cache import ColumnarHistory
+from services.timeseries_service import TimeSeriesService
+from services.training_service import TrainingCancelled
+
+
+# Linhas mantidas no buffer de treino de uma categoria (memória limitada)
+CATEGORY_TRAINING_MAX_ROWS = int(os.getenv("CATEGORY_TRAINING_MAX_ROWS", "200000"))
+# Buckets diários lidos por página do Firestore
+CATEGORY_TRAINING_PAGE_BUCKETS = int(os.getenv("CATEGORY_TRAINING_PAGE_BUCKETS", "30"))
+# Linhas mínimas para treinar o modelo da categoria
+MIN_CATEGORY_ROWS = 10
+
+
+class TrainingBuffer:
+    """Amostra de tamanho fixo das linhas de treino (reservoir sampling).
+
+    Enquanto há espaço, as linhas são copiadas para matrizes pré-alocadas;
+    depois, a linha de índice global i substitui uma posição sorteada em
+    [0, i] se ela cair dentro do buffer. Toda linha vista tem a mesma chance
+    de estar na amostra final, qualquer que seja o tamanho da frota.
+    """
+
+    def __init__(self, n_columns: int, capacity: int = CATEGORY_TRAINING_MAX_ROWS, seed: int = 42):
+        self.capacity = capacity
+        self.features = np.empty((capacity, n_columns), dtype=np.float64)
+        self.target = np.empty(capacity, dtype=np.int8)
+        self.size = 0
+        self.seen = 0
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, features: np.ndarray, target: np.ndarray) -> None:
+        n = len(features)
+        free = min(self.capacity - self.size, n)
+        if free > 0:
+            self.features[self.size:self.size + free] = features[:free]
+            self.target[self.size:self.size + free] = target[:free]
+            self.size += free
+
+        if free < n:
+            positions = self._rng.integers(0, np.arange(self.seen + free, self.seen + n) + 1)
+            kept = positions < self.capacity
+            self.features[positions[kept]] = features[free:][kept]
+            self.target[positions[kept]] = target[free:][kept]
+        self.seen += n
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.features[:self.size].copy(), self.target[:self.size].astype(int)
+
+
+class CategoryTrainer:
+    """Coleta as leituras de todos os equipamentos de uma categoria para treinar o modelo da categoria.
+
+    Os equipamentos são percorridos um a um e as leituras lidas em páginas de
+    CATEGORY_TRAINING_PAGE_BUCKETS dias; cada página vira features/target e
+    entra no TrainingBuffer, então a memória usada não depende do tamanho da frota.
+    """
+
+    @staticmethod
+    def category_equipment_ids(category: str) -> List[str]:
+        query = db.collection("equipment").where("category", "==", category).select(["category"])
+        return [doc.id for doc in query.stream()]
+
+    @staticmethod
+    def collect(category: str, stop: Optional[threading.Event] = None,
+                progress: Optional[Dict[str, Any]] = None,
+                capacity: int = CATEGORY_TRAINING_MAX_ROWS) -> Dict[str, Any]:
+        """Lê a frota da categoria e retorna os argumentos do ajuste (columns, features, target e contagens)"""
+        from services.ai_service import AIService, FEATURE_COLUMNS
+
+        progress = progress if progress is not None else {}
+        equipment_ids = CategoryTrainer.category_equipment_ids(category)
+        buffer = TrainingBuffer(len(FEATURE_COLUMNS), capacity)
+        progress.update({"equipment_total": len(equipment_ids), "equipment_done": 0, "rows_seen": 0, "fraction": 0.0})
+
+        for done, equipment_id in enumerate(equipment_ids, start=1):
+            for page in TimeSeriesService.iter_reading_pages(equipment_id, CATEGORY_TRAINING_PAGE_BUCKETS):
+                if stop is not None and stop.is_set():
+                    raise TrainingCancelled(category)
+                features, target = AIService._prepare_data(ColumnarHistory.from_readings(page), for_training=True)
+                buffer.add(features, target)
+                progress["rows_seen"] = buffer.seen
+            progress.update({"equipment_done": done, "fraction": done / len(equipment_ids)})
+
+        if buffer.size < MIN_CATEGORY_ROWS:
+            raise ValueError(
+                f"Dados insuficientes para treinamento do modelo da categoria. "
+                f"São necessários pelo menos {MIN_CATEGORY_ROWS} registros."
+            )
+
+        features, target = buffer.arrays()
+        return {
+            "columns": list(FEATURE_COLUMNS),
+            "features": features,
+            "target": target,
+            "equipment_count": len(equipment_ids),
+            "rows_seen": buffer.seen
+        }
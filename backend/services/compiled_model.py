@@ -0,0 +1,149 @@
+from typing import List, Dict, Any, Optional
+import re
+
+import numpy as np
+
+from services.feature_pipeline import FeaturePipeline
+
+
+# Códigos de missing_type usados pelo LightGBM
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+# Limite abaixo do qual o LightGBM considera um valor igual a zero
+ZERO_THRESHOLD = 1e-35
+# Arrays que descrevem os nós achatados das árvores
+NODE_ARRAYS = ("feature", "threshold", "default_left", "missing_type", "right", "value", "roots")
+
+
+class CompiledFailureModel:
+    """Modelo de falha compilado em arrays NumPy (árvores achatadas + pipeline).
+
+    Gerado a partir do booster do LightGBM de um FailureModel e gravado em
+    .npz; para prever não importa LightGBM nem scikit-learn e não desserializa
+    objetos Python. Todas as árvores são percorridas juntas, nível a nível,
+    para todas as linhas de uma vez (apenas os caminhos que ainda não chegaram
+    a uma folha), reproduzindo as regras de desvio do LightGBM para valores
+    ausentes.
+    """
+
+    def __init__(self, pipeline: FeaturePipeline, arrays: Dict[str, np.ndarray], sigmoid: float = 1.0):
+        self.pipeline = pipeline
+        self.arrays = arrays
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.sigmoid = sigmoid
+        # Direção de cada nó para valores zero e ausentes, já resolvida pelas regras do LightGBM:
+        # NaN vira 0 salvo em missing_type NaN; zero/NaN "ausentes" seguem default_left
+        missing_type = arrays["missing_type"]
+        default_left = arrays["default_left"]
+        self.zero_left = np.where(missing_type == MISSING_ZERO, default_left, self.threshold >= 0.0)
+        self.nan_left = np.where(missing_type == MISSING_NAN, default_left, self.zero_left)
+
+    @property
+    def columns(self) -> List[str]:
+        return self.pipeline.columns
+
+    def raw_score(self, X: np.ndarray) -> np.ndarray:
+        X = self.pipeline.transform(X)
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        flat = X.ravel()
+        # Uma posição por par (linha, árvore); só as que ainda não chegaram a uma folha são avaliadas
+        current = np.tile(self.roots, n_rows)
+        offsets = np.repeat(np.arange(n_rows) * n_features, n_trees)
+        active = np.flatnonzero(self.feature[current] >= 0)
+        while len(active):
+            nodes = current[active]
+            x = flat[offsets[active] + self.feature[nodes]]
+            go_left = x <= self.threshold[nodes]
+            special = np.flatnonzero(~(np.abs(x) > ZERO_THRESHOLD))
+            if len(special):
+                special_nodes = nodes[special]
+                go_left[special] = np.where(
+                    np.isnan(x[special]), self.nan_left[special_nodes], self.zero_left[special_nodes]
+                )
+            # Os nós são gravados em pré-ordem: o filho esquerdo é sempre o nó seguinte
+            children = np.where(go_left, nodes + 1, self.right[nodes])
+            current[active] = children
+            active = active[self.feature[children] >= 0]
+        return self.value[current].reshape(n_rows, n_trees).sum(axis=1)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        probability = 1.0 / (1.0 + np.exp(-self.sigmoid * self.raw_score(X)))
+        return np.column_stack([1.0 - probability, probability])
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(int)
+
+    def save(self, file) -> None:
+        np.savez(
+            file, columns=np.array(self.pipeline.columns), mean=self.pipeline.mean_, scale=self.pipeline.scale_,
+            sigmoid=np.array(self.sigmoid), **self.arrays
+        )
+
+    @staticmethod
+    def load(path: str) -> "CompiledFailureModel":
+        with np.load(path, allow_pickle=False) as data:
+            pipeline = FeaturePipeline([str(c) for c in data["columns"]])
+            pipeline.mean_ = data["mean"]
+            pipeline.scale_ = data["scale"]
+            arrays = {key: data[key] for key in NODE_ARRAYS}
+            return CompiledFailureModel(pipeline, arrays, float(data["sigmoid"]))
+
+
+def _flatten(node: Dict[str, Any], nodes: Dict[str, list]) -> int:
+    index = len(nodes["feature"])
+    for key in nodes:
+        nodes[key].append(0)
+
+    if "leaf_value" in node:
+        nodes["feature"][index] = -1
+        nodes["value"][index] = node["leaf_value"]
+        nodes["right"][index] = index
+        return index
+
+    if node.get("decision_type") != "<=":
+        raise ValueError(f"Divisão não suportada: {node.get('decision_type')}")
+    nodes["feature"][index] = node["split_feature"]
+    nodes["threshold"][index] = node["threshold"]
+    nodes["default_left"][index] = bool(node.get("default_left"))
+    nodes["missing_type"][index] = MISSING_TYPES[node.get("missing_type", "None")]
+    # Pré-ordem: o filho esquerdo é gravado logo após o nó (índice + 1)
+    _flatten(node["left_child"], nodes)
+    nodes["right"][index] = _flatten(node["right_child"], nodes)
+    return index
+
+
+def compile_failure_model(model: Any) -> Optional[CompiledFailureModel]:
+    """Compila um FailureModel com classificador binário do LightGBM; None se não for suportado"""
+    pipeline = getattr(model, "pipeline", None)
+    booster = getattr(getattr(model, "estimator", None), "booster_", None)
+    if pipeline is None or booster is None or len(getattr(model.estimator, "classes_", [])) != 2:
+        return None
+
+    dump = booster.dump_model()
+    sigmoid = re.match(r"binary sigmoid:([0-9.eE+-]+)", dump.get("objective", ""))
+    if sigmoid is None or dump.get("average_output") or dump.get("num_class", 1) != 1:
+        return None
+
+    nodes: Dict[str, list] = {key: [] for key in
+                              ("feature", "threshold", "default_left", "missing_type", "right", "value")}
+    try:
+        roots = [_flatten(tree["tree_structure"], nodes) for tree in dump["tree_info"]]
+    except (KeyError, ValueError) as e:
+        print(f"Modelo não compilável: {e}")
+        return None
+
+    arrays = {
+        "feature": np.array(nodes["feature"], dtype=np.int32),
+        "threshold": np.array(nodes["threshold"], dtype=np.float64),
+        "default_left": np.array(nodes["default_left"], dtype=bool),
+        "missing_type": np.array(nodes["missing_type"], dtype=np.int8),
+        "right": np.array(nodes["right"], dtype=np.int32),
+        "value": np.array(nodes["value"], dtype=np.float64),
+        "roots": np.array(roots, dtype=np.int32),
+    }
+    return CompiledFailureModel(pipeline, arrays, float(sigmoid.group(1)))
@@ -0,0 +1,103 @@
+from typing import List, Dict, Any, Optional, Tuple
+import os
+
+from services.timeseries_service import _as_utc
+
+
+# Quantidade de chaves recentes guardadas por equipamento para detectar reenvios
+DEDUPE_WINDOW = int(os.getenv("DEDUPE_WINDOW", "512"))
+
+
+class DedupeIndex:
+    """Índice compacto de leituras já aceitas de um equipamento.
+
+    Leituras com `sequence` são identificadas pelo número de sequência do
+    gateway: guardamos o maior número aceito e os números dentro da janela
+    (max - DEDUPE_WINDOW, max]; qualquer número abaixo da janela é tratado como
+    reenvio. Uma sequência já vista ou abaixo da janela, mas com data posterior
+    à da leitura de maior sequência, indica que o contador do gateway foi
+    reiniciado (ex.: reboot): a janela recomeça a partir dela, e leituras com
+    data até a última leitura do contador anterior passam a ser reenvios
+    (leituras do novo contador que chegam atrasadas continuam aceitas). Os
+    reinícios detectados ficam em `resets`, para serem registrados fora da
+    transação, que pode ser repetida. Leituras sem
+    `sequence` usam o par (equipamento, data) como chave, com as DEDUPE_WINDOW
+    datas mais recentes em milissegundos.
+
+    O estado fica no campo `dedupe_index` do documento do equipamento e é lido
+    na mesma transação da ingestão, sem leituras extras.
+    """
+
+    def __init__(self, window: int = DEDUPE_WINDOW, max_sequence: Optional[int] = None,
+                 sequences: Optional[List[int]] = None, timestamps: Optional[List[int]] = None,
+                 max_sequence_at: Optional[int] = None, reset_at: Optional[int] = None):
+        self.window = window
+        self.max_sequence = max_sequence
+        # Data (ms) da leitura com a maior sequência, usada para detectar o reinício do contador
+        self.max_sequence_at = max_sequence_at
+        # Data (ms) da última leitura do contador anterior ao último reinício
+        self.reset_at = reset_at
+        # Reinícios (sequência anterior, nova sequência) detectados nesta instância; não persistido
+        self.resets: List[Tuple[int, int]] = []
+        self.sequences = set(sequences or [])
+        # Mantida em ordem de chegada para descartar as chaves mais antigas
+        self.timestamps = list(timestamps or [])
+        self._timestamp_set = set(self.timestamps)
+
+    def add(self, reading: Dict[str, Any]) -> bool:
+        """Registra a leitura; retorna False se ela já tinha sido aceita"""
+        sequence = reading.get("sequence")
+        timestamp = int(_as_utc(reading["date"]).timestamp() * 1000)
+        if sequence is not None:
+            return self._add_sequence(int(sequence), timestamp)
+        return self._add_timestamp(timestamp)
+
+    def _add_sequence(self, sequence: int, timestamp: int) -> bool:
+        if self.reset_at is not None and timestamp <= self.reset_at:
+            # Numerada pelo contador anterior ao reinício
+            return False
+        seen = sequence in self.sequences or (
+            self.max_sequence is not None and sequence <= self.max_sequence - self.window
+        )
+        if seen:
+            if self.max_sequence_at is None or timestamp <= self.max_sequence_at:
+                return False
+            # Sequência "antiga" com data mais recente: o contador do gateway recomeçou
+            self.resets.append((self.max_sequence, sequence))
+            self.reset_at = self.max_sequence_at
+            self.sequences = set()
+            self.max_sequence = None
+
+        self.sequences.add(sequence)
+        if self.max_sequence is None or sequence > self.max_sequence:
+            self.max_sequence = sequence
+            self.max_sequence_at = timestamp
+            low = self.max_sequence - self.window
+            self.sequences = {s for s in self.sequences if s > low}
+        return True
+
+    def _add_timestamp(self, timestamp: int) -> bool:
+        if timestamp in self._timestamp_set:
+            return False
+        self.timestamps.append(timestamp)
+        self._timestamp_set.add(timestamp)
+        if len(self.timestamps) > self.window:
+            for expired in self.timestamps[:-self.window]:
+                self._timestamp_set.discard(expired)
+            self.timestamps = self.timestamps[-self.window:]
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "max_sequence": self.max_sequence,
+            "max_sequence_at": self.max_sequence_at,
+            "reset_at": self.reset_at,
+            "sequences": sorted(self.sequences),
+            "timestamps": self.timestamps,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]], window: int = DEDUPE_WINDOW) -> "DedupeIndex":
+        data = data or {}
+        return cls(window, data.get("max_sequence"), data.get("sequences"), data.get("timestamps"),
+                   data.get("max_sequence_at"), data.get("reset_at"))
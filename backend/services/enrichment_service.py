@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Set
+import asyncio
+import os
+import uuid
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+
+from config import db
+from services.recommendation_cache import recommendation_cache
+
+
+ENRICHMENT_COLLECTION = "enrichment_jobs"
+# Tempo (segundos) após o qual um job ainda pendente é considerado perdido (ex.: worker reiniciado)
+ENRICHMENT_JOB_TIMEOUT = float(os.getenv("ENRICHMENT_JOB_TIMEOUT", "300"))
+# Tempo (segundos) em que um job fica disponível para consulta. O campo `expires_at` é
+# removido pela política de TTL do Firestore, criada uma vez por projeto:
+#   gcloud firestore fields ttls update expires_at --collection-group=enrichment_jobs --enable-ttl
+ENRICHMENT_JOB_RETENTION = float(os.getenv("ENRICHMENT_JOB_RETENTION", str(24 * 3600)))
+
+FALLBACK_ACTION = "Não foi possível obter recomendação detalhada da IA."
+
+# Referências às tarefas em andamento, para que não sejam coletadas antes de terminar
+_running_tasks: Set[asyncio.Task] = set()
+
+
+class EnrichmentService:
+    """Geração em segundo plano das recomendações do modelo de linguagem.
+
+    A previsão numérica é devolvida imediatamente com o ID do job; o texto é
+    gerado pelo worker que recebeu a requisição e gravado em
+    `enrichment_jobs/{job_id}`, onde qualquer worker pode consultá-lo.
+    """
+
+    @staticmethod
+    async def submit(equipment_id: str, user_id: Optional[str], recommendation_key: str,
+                     prompt: str, fallback_days: int) -> str:
+        """Registra o job e dispara a geração da recomendação; retorna o ID do job"""
+        job_id = str(uuid.uuid4())
+        created_at = datetime.utcnow()
+        await run_in_threadpool(db.collection(ENRICHMENT_COLLECTION).document(job_id).set, {
+            "id": job_id,
+            "equipment_id": equipment_id,
+            "user_id": user_id,
+            "status": "pending",
+            "result": None,
+            "error": None,
+            "created_at": created_at,
+            "completed_at": None,
+            "expires_at": created_at + timedelta(seconds=ENRICHMENT_JOB_RETENTION)
+        })
+
+        task = asyncio.create_task(EnrichmentService._run(job_id, recommendation_key, prompt, fallback_days))
+        _running_tasks.add(task)
+        task.add_done_callback(_running_tasks.discard)
+        return job_id
+
+    @staticmethod
+    async def _run(job_id: str, recommendation_key: str, prompt: str, fallback_days: int) -> None:
+        from services.ai_service import AIService
+
+        try:
+            recommendation, _ = await recommendation_cache.get_or_create(
+                recommendation_key, lambda: AIService._generate_recommendation(prompt)
+            )
+            recommendation = recommendation or {}
+            update_data = {
+                "status": "completed",
+                "result": {
+                    "predicted_days_to_failure": recommendation.get("predicted_failure_days", fallback_days),
+                    "recommended_action": recommendation.get("recommended_action", FALLBACK_ACTION)
+                }
+            }
+        except HTTPException as e:
+            update_data = {"status": "failed", "error": str(e.detail)}
+        except Exception as e:
+            update_data = {"status": "failed", "error": str(e)}
+
+        update_data["completed_at"] = datetime.utcnow()
+        try:
+            await run_in_threadpool(db.collection(ENRICHMENT_COLLECTION).document(job_id).update, update_data)
+        except Exception as e:
+            print(f"Erro ao gravar resultado do job de recomendação {job_id}: {e}")
+
+    @staticmethod
+    async def get_job(job_id: str, user_id: str) -> Dict[str, Any]:
+        """Consulta o estado de um job de recomendação"""
+        job_doc = await run_in_threadpool(db.collection(ENRICHMENT_COLLECTION).document(job_id).get)
+        job = job_doc.to_dict() if job_doc.exists else None
+        # A remoção pelo TTL não é imediata: jobs vencidos são tratados como inexistentes
+        expires_at = job.get("expires_at") if job else None
+        if job is None or (expires_at is not None and expires_at.replace(tzinfo=None) <= datetime.utcnow()):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job de recomendação não encontrado"
+            )
+
+        if job.get("user_id") != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Acesso não autorizado a este job"
+            )
+
+        created_at = job.get("created_at")
+        if job["status"] == "pending" and created_at is not None:
+            created_at = created_at.replace(tzinfo=None)
+            if datetime.utcnow() - created_at > timedelta(seconds=ENRICHMENT_JOB_TIMEOUT):
+                job["status"] = "expired"
+        return job
@@ -1,13 +1,34 @@
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import uuid
 
 from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from firebase_admin import firestore
 
 from config import db
-from models.equipment import Equipment, EquipmentCreate, EquipmentUpdate, OperationalData
+from models.equipment import Equipment, EquipmentCreate, EquipmentUpdate, OperationalData, OperationalDataAck
+from services.timeseries_service import TimeSeriesService, _as_utc
+from services.health_analyzer import HealthAnalyzer
+from services.dedupe_index import DedupeIndex
+from services.anomaly_detector import AnomalyDetector, ANOMALY_RECENT
+from services.history_cache import history_cache
+from services.ingest_queue import ingest_queue
+from services.rollup_service import RollupService
+from services.snapshot_service import prediction_snapshots
 
 class EquipmentService:
+    @staticmethod
+    async def _migrate_legacy_readings(equipment_id: str) -> Dict[str, Any]:
+        """Migra o array legado `operational_data` para os buckets no primeiro acesso
+        e devolve o documento atualizado"""
+        migrated = await run_in_threadpool(TimeSeriesService.migrate_embedded_readings, equipment_id)
+        if migrated:
+            history_cache.invalidate(equipment_id)
+            prediction_snapshots.mark_dirty(equipment_id)
+        equipment_doc = await run_in_threadpool(db.collection("equipment").document(equipment_id).get)
+        return equipment_doc.to_dict()
+
     @staticmethod
     async def create_equipment(user_id: str, equipment_data: EquipmentCreate) -> Equipment:
         try:
@@ -23,8 +44,8 @@ class EquipmentService:
                 "risk_level": "low",
                 "needs_maintenance": False,
                 "components": [],
-                "operational_data": [],
                 "total_usage_hours": 0,
+                "readings_count": 0,
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             })
@@ -59,6 +80,9 @@ class EquipmentService:
                     detail="Acesso não autorizado a este equipamento"
                 )
             
+            if "operational_data" in equipment_data:
+                equipment_data = await EquipmentService._migrate_legacy_readings(equipment_id)
+            
             return Equipment(**equipment_data)
         except HTTPException:
             raise
@@ -76,6 +100,8 @@ class EquipmentService:
             equipment_list = []
             for doc in equipment_docs:
                 equipment_data = doc.to_dict()
+                if "operational_data" in equipment_data:
+                    equipment_data = await EquipmentService._migrate_legacy_readings(doc.id)
                 equipment_list.append(Equipment(**equipment_data))
             
             return equipment_list
@@ -115,8 +141,13 @@ class EquipmentService:
             # Verificar se o equipamento existe e pertence ao usuário
             equipment = await EquipmentService.get_equipment_by_id(equipment_id, user_id)
             
-            # Excluir do Firestore
+            # Excluir leituras (subcoleções não são removidas em cascata) e o documento
+            TimeSeriesService.delete_readings(equipment_id)
+            RollupService.delete_rollups(equipment_id)
             db.collection("equipment").document(equipment_id).delete()
+            prediction_snapshots.delete(equipment_id)
+            history_cache.invalidate(equipment_id)
+            ingest_queue.invalidate_owner(equipment_id)
             
             return {"message": "Equipamento excluído com sucesso"}
         except HTTPException:
@@ -128,86 +159,171 @@ class EquipmentService:
             )
     
     @staticmethod
-    async def add_operational_data(equipment_id: str, user_id: str, data: OperationalData) -> Equipment:
+    async def add_operational_data(equipment_id: str, user_id: str, data: OperationalData) -> OperationalDataAck:
+        return await EquipmentService.ingest_operational_batch(equipment_id, user_id, [data.dict()])
+    
+    @staticmethod
+    async def ingest_operational_batch(equipment_id: str, user_id: str, readings: List[Dict[str, Any]]) -> OperationalDataAck:
+        """Ingere um lote de leituras de um equipamento.
+
+        Com a fila local ativa (INGEST_QUEUE_PATH), as leituras são gravadas em
+        disco e confirmadas imediatamente; o flusher as envia ao Firestore depois.
+        """
+        try:
+            if ingest_queue.enabled:
+                await ingest_queue.append(equipment_id, user_id, readings)
+                return OperationalDataAck(equipment_id=equipment_id, accepted_count=len(readings), queued=True)
+            return await EquipmentService.ingest_readings(equipment_id, user_id, readings)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Erro ao adicionar dados operacionais: {str(e)}"
+            )
+    
+    @staticmethod
+    async def ingest_readings(equipment_id: str, user_id: str, readings: List[Dict[str, Any]]) -> OperationalDataAck:
+        """Grava um lote de leituras no Firestore em uma única transação"""
+        ack, counter_resets = await run_in_threadpool(
+            EquipmentService._ingest_transaction, db.transaction(), equipment_id, user_id, readings
+        )
+        
+        # Registrado aqui, e não na transação, que o Firestore pode repetir
+        for previous, sequence in counter_resets:
+            print(f"Contador de sequência do equipamento {equipment_id} reiniciado ({previous} -> {sequence}); "
+                  f"janela de deduplicação recomeçada")
+        
+        # Novas leituras: o snapshot de previsão é recalculado no próximo ciclo
+        if ack.accepted_count:
+            prediction_snapshots.mark_dirty(equipment_id)
+        
+        # Se o risco passou a ser alto, criar um alerta
+        if ack.risk_changed and ack.risk_level == "high":
+            from services.alert_service import AlertService
+            await AlertService.create_alert_for_equipment(equipment_id, user_id)
+        
+        return ack
+    
+    @staticmethod
+    @firestore.transactional
+    def _ingest_transaction(transaction, equipment_id: str, user_id: str,
+                            readings: List[Dict[str, Any]]) -> Tuple[OperationalDataAck, List[Tuple[int, int]]]:
+        """Verifica a posse, anexa as leituras, soma as horas de uso e reavalia o risco
+        em uma única transação, com uma só leitura (o documento do equipamento).
+
+        Reenvios de leituras já aceitas (mesma `sequence` ou, sem ela, mesma data)
+        são descartados pelo índice de deduplicação e não alteram os totais.
+        Retorna a confirmação e os reinícios de contador detectados.
+        """
+        equipment_ref = db.collection("equipment").document(equipment_id)
+        equipment_doc = equipment_ref.get(transaction=transaction)
+        
+        if not equipment_doc.exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Equipamento não encontrado"
+            )
+        
+        equipment_data = equipment_doc.to_dict()
+        if equipment_data["user_id"] != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Acesso não autorizado a este equipamento"
+            )
+        
+        dedupe_index = DedupeIndex.from_dict(equipment_data.get("dedupe_index"))
+        received = len(readings)
+        readings = [r for r in sorted(readings, key=lambda r: _as_utc(r["date"])) if dedupe_index.add(r)]
+        
+        if not readings:
+            # Apenas reenvios: nada a gravar, devolve o estado atual
+            return OperationalDataAck(
+                equipment_id=equipment_id,
+                accepted_count=0,
+                duplicates=received,
+                total_usage_hours=equipment_data.get("total_usage_hours", 0),
+                readings_count=equipment_data.get("readings_count", 0),
+                risk_level=equipment_data.get("risk_level", "low"),
+                needs_maintenance=equipment_data.get("needs_maintenance", False)
+            ), dedupe_index.resets
+        
+        # Estado incremental (buffer circular + estatísticas) mantido no documento do equipamento
+        current_risk = (equipment_data.get("risk_level", "low"), equipment_data.get("needs_maintenance", False))
+        analyzer = HealthAnalyzer.from_dict(equipment_data.get("health_state"))
+        for reading in readings:
+            analyzer.push(reading)
+        risk_level, needs_maintenance = analyzer.evaluate(current_risk)
+        risk_changed = (risk_level, needs_maintenance) != current_risk
+        
+        # Detector online: cada leitura é avaliada contra o estado anterior a ela
+        detector = AnomalyDetector.from_dict(equipment_data.get("anomaly_state"))
+        anomalies = [anomaly for reading in readings for anomaly in detector.push(reading)]
+        recent_anomalies = (equipment_data.get("recent_anomalies") or []) + anomalies
+        
+        total_usage_hours = equipment_data.get("total_usage_hours", 0) + sum(r["hours_used"] for r in readings)
+        readings_count = equipment_data.get("readings_count", 0) + len(readings)
+        last_reading_at = equipment_data.get("last_reading_at")
+        if readings and (last_reading_at is None or _as_utc(readings[-1]["date"]) > _as_utc(last_reading_at)):
+            last_reading_at = readings[-1]["date"]
+        
+        for ref, write_data in TimeSeriesService.append_writes(equipment_id, readings):
+            transaction.set(ref, write_data, merge=True)
+        transaction.update(equipment_ref, {
+            "total_usage_hours": total_usage_hours,
+            "readings_count": readings_count,
+            "last_reading_at": last_reading_at,
+            "health_state": analyzer.to_dict(),
+            "dedupe_index": dedupe_index.to_dict(),
+            "anomaly_state": detector.to_dict(),
+            "recent_anomalies": recent_anomalies[-ANOMALY_RECENT:],
+            "risk_level": risk_level,
+            "needs_maintenance": needs_maintenance,
+            "updated_at": datetime.utcnow()
+        })
+        
+        return OperationalDataAck(
+            equipment_id=equipment_id,
+            accepted_count=len(readings),
+            duplicates=received - len(readings),
+            total_usage_hours=total_usage_hours,
+            readings_count=readings_count,
+            risk_level=risk_level,
+            needs_maintenance=needs_maintenance,
+            risk_changed=risk_changed,
+            anomalies=anomalies
+        ), dedupe_index.resets
+    
+    @staticmethod
+    async def get_operational_data(equipment_id: str, user_id: str, start: Optional[datetime] = None,
+                                   end: Optional[datetime] = None, limit: Optional[int] = None) -> List[OperationalData]:
         try:
             # Verificar se o equipamento existe e pertence ao usuário
-            equipment = await EquipmentService.get_equipment_by_id(equipment_id, user_id)
-            
-            # Adicionar dados operacionais
-            operational_data = data.dict()
+            await EquipmentService.get_equipment_by_id(equipment_id, user_id)
             
-            # Atualizar no Firestore usando arrayUnion para adicionar ao array
-            db.collection("equipment").document(equipment_id).update({
-                "operational_data": firestore.ArrayUnion([operational_data]),
-                "total_usage_hours": equipment.total_usage_hours + data.hours_used,
-                "updated_at": datetime.utcnow()
-            })
-            
-            # Analisar dados e atualizar status de risco se necessário
-            await EquipmentService._analyze_equipment_health(equipment_id, user_id)
-            
-            # Buscar equipamento atualizado
-            updated_equipment = await EquipmentService.get_equipment_by_id(equipment_id, user_id)
-            return updated_equipment
+            readings = TimeSeriesService.get_readings(equipment_id, start=start, end=end, limit=limit)
+            return [OperationalData(**reading) for reading in readings]
         except HTTPException:
             raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Erro ao adicionar dados operacionais: {str(e)}"
+                detail=f"Erro ao buscar dados operacionais: {str(e)}"
             )
     
     @staticmethod
-    async def _analyze_equipment_health(equipment_id: str, user_id: str) -> None:
-        """Analisa a saúde do equipamento com base nos dados operacionais e atualiza o nível de risco"""
+    async def get_operational_rollups(equipment_id: str, user_id: str, resolution: str = "day",
+                                      start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                      limit: Optional[int] = None) -> List[Dict[str, Any]]:
         try:
-            # Buscar equipamento
-            equipment = await EquipmentService.get_equipment_by_id(equipment_id, user_id)
+            # Verificar se o equipamento existe e pertence ao usuário
+            await EquipmentService.get_equipment_by_id(equipment_id, user_id)
             
-            # Implementação simplificada de análise
-            # Em um sistema real, isso usaria algoritmos de ML mais complexos
-            if len(equipment.operational_data) < 3:
-                return  # Dados insuficientes para análise
-            
-            # Ordenar dados por data
-            sorted_data = sorted(equipment.operational_data, key=lambda x: x.date)
-            recent_data = sorted_data[-3:]  # Últimos 3 registros
-            
-            # Verificar tendências de temperatura e vibração
-            temp_trend = [d.temperature for d in recent_data if d.temperature is not None]
-            vibration_trend = [d.vibration for d in recent_data if d.vibration is not None]
-            
-            risk_level = "low"
-            needs_maintenance = False
-            
-            # Lógica simplificada de análise
-            if temp_trend and len(temp_trend) >= 3:
-                if temp_trend[-1] > 80 or (temp_trend[-1] > temp_trend[-2] > temp_trend[-3] and temp_trend[-1] > 70):
-                    risk_level = "high"
-                    needs_maintenance = True
-                elif temp_trend[-1] > 60:
-                    risk_level = "medium"
-            
-            if vibration_trend and len(vibration_trend) >= 3:
-                if vibration_trend[-1] > 0.8 or (vibration_trend[-1] > vibration_trend[-2] > vibration_trend[-3] and vibration_trend[-1] > 0.6):
-                    risk_level = "high"
-                    needs_maintenance = True
-                elif vibration_trend[-1] > 0.5:
-                    risk_level = "medium"
-            
-            # Atualizar equipamento se o risco mudou
-            if risk_level != equipment.risk_level or needs_maintenance != equipment.needs_maintenance:
-                db.collection("equipment").document(equipment_id).update({
-                    "risk_level": risk_level,
-                    "needs_maintenance": needs_maintenance,
-                    "updated_at": datetime.utcnow()
-                })
-                
-                # Se o risco for alto, criar um alerta
-                if risk_level == "high":
-                    from services.alert_service import AlertService
-                    await AlertService.create_alert_for_equipment(equipment_id, user_id)
-                    
+            return RollupService.get_rollups(equipment_id, resolution, start=start, end=end, limit=limit)
+        except HTTPException:
+            raise
         except Exception as e:
-            print(f"Erro ao analisar saúde do equipamento: {str(e)}")
-            # Não propagar exceção para não interromper o fluxo principal
\ No newline at end of file
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Erro ao buscar agregados operacionais: {str(e)}"
+            )
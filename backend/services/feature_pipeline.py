@@ -0,0 +1,71 @@
+from typing import List, Any, Optional, Sequence
+
+import numpy as np
+
+
+class FeaturePipeline:
+    """Transformação das features dos modelos de falha, ajustada no treino.
+
+    Guarda a média e o desvio de cada coluna calculados sobre os dados de
+    treino; na inferência, valores ausentes (NaN) recebem a média da coluna e
+    todas as linhas são padronizadas de uma vez, sem novo ajuste.
+    """
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = list(columns)
+        self.mean_: Optional[np.ndarray] = None
+        self.scale_: Optional[np.ndarray] = None
+
+    def fit(self, matrix: np.ndarray) -> "FeaturePipeline":
+        matrix = np.asarray(matrix, dtype=np.float64)
+        observed = ~np.isnan(matrix)
+        counts = observed.sum(axis=0)
+        sums = np.where(observed, matrix, 0.0).sum(axis=0)
+        mean = np.divide(sums, counts, out=np.zeros(matrix.shape[1]), where=counts > 0)
+        squares = np.where(observed, (matrix - mean) ** 2, 0.0).sum(axis=0)
+        std = np.sqrt(np.divide(squares, counts, out=np.zeros(matrix.shape[1]), where=counts > 0))
+        self.mean_ = mean
+        # Colunas constantes não são escaladas
+        self.scale_ = np.where(std > 0, std, 1.0)
+        return self
+
+    def transform(self, matrix: np.ndarray) -> np.ndarray:
+        if self.mean_ is None:
+            raise ValueError("FeaturePipeline não ajustado")
+        matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float64))
+        matrix = np.where(np.isnan(matrix), self.mean_, matrix)
+        return (matrix - self.mean_) / self.scale_
+
+    def fit_transform(self, matrix: np.ndarray) -> np.ndarray:
+        return self.fit(matrix).transform(matrix)
+
+
+class FailureModel:
+    """Modelo de falha treinado junto com seu FeaturePipeline.
+
+    Serializado como um único arquivo; recebe as features brutas (com NaN
+    para ausentes) e aplica a mesma transformação usada no treino. Guarda
+    também a marca d'água do treino (data da última leitura usada, em
+    nanossegundos desde a época) usada pelos treinos incrementais.
+    """
+
+    def __init__(self, estimator: Any, pipeline: FeaturePipeline, trained_through: Optional[int] = None,
+                 rows_trained: int = 0, full_rows: int = 0, incremental_updates: int = 0):
+        self.estimator = estimator
+        self.pipeline = pipeline
+        self.trained_through = trained_through
+        # Leituras cobertas pelo modelo e leituras do último treino completo
+        self.rows_trained = rows_trained
+        self.full_rows = full_rows
+        # Treinos incrementais aplicados desde o último treino completo
+        self.incremental_updates = incremental_updates
+
+    @property
+    def columns(self) -> List[str]:
+        return self.pipeline.columns
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        return self.estimator.predict_proba(self.pipeline.transform(X))
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.estimator.predict(self.pipeline.transform(X))
@@ -0,0 +1,254 @@
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from services.timeseries_service import _as_utc
+
+
+# Canais acompanhados pelo analisador incremental (hours_used alimenta as features dos modelos)
+CHANNELS = ("temperature", "vibration", "noise_level", "consumption", "cycles", "hours_used")
+# Capacidade do buffer circular de leituras recentes
+HEALTH_WINDOW_SIZE = 16
+# Número de leituras recentes consideradas na avaliação de risco
+RISK_WINDOW = 3
+
+
+def _to_list(values: np.ndarray) -> List[Optional[float]]:
+    """Converte um array para lista serializável no Firestore (NaN -> None)"""
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+def _from_list(values: List[Optional[float]], capacity: int) -> np.ndarray:
+    array = np.full(capacity, np.nan)
+    if values:
+        array[:len(values)] = [np.nan if v is None else v for v in values[:capacity]]
+    return array
+
+
+class RingBuffer:
+    """Buffer circular de tamanho fixo apoiado em um array NumPy"""
+
+    def __init__(self, capacity: int, values: Optional[np.ndarray] = None, head: int = 0, count: int = 0):
+        self.capacity = capacity
+        self.values = values if values is not None else np.full(capacity, np.nan)
+        self.head = head  # posição onde será escrito o próximo valor
+        self.count = count
+
+    def push(self, value: Optional[float]) -> None:
+        self.values[self.head] = np.nan if value is None else value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def last(self, n: Optional[int] = None) -> np.ndarray:
+        """Retorna os últimos n valores em ordem cronológica"""
+        n = self.count if n is None else min(n, self.count)
+        indices = (self.head - n + np.arange(n)) % self.capacity
+        return self.values[indices]
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Persistido já em ordem cronológica para facilitar a leitura do documento
+        return {"values": _to_list(self.last())}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]], capacity: int) -> "RingBuffer":
+        values = (data or {}).get("values", [])[-capacity:]
+        count = len(values)
+        return cls(capacity, _from_list(values, capacity), head=count % capacity, count=count)
+
+
+class RunningStats:
+    """Estatísticas acumuladas (Welford) de um canal, atualizadas em O(1)"""
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0,
+                 minimum: Optional[float] = None, maximum: Optional[float] = None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.min = minimum
+        self.max = maximum
+
+    def push(self, value: Optional[float]) -> None:
+        if value is None or np.isnan(value):
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, values: np.ndarray) -> None:
+        """Incorpora um lote de valores de uma vez (algoritmo paralelo de Chan)"""
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        n = values.size
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.min = float(values.min()) if self.min is None else min(self.min, float(values.min()))
+        self.max = float(values.max()) if self.max is None else max(self.max, float(values.max()))
+
+    def combine(self, other: "RunningStats") -> None:
+        """Incorpora as estatísticas de outro conjunto de valores (mesma fórmula de Chan)"""
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / total
+        self.count = total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else 0.0
+
+    @property
+    def population_std(self) -> float:
+        return float(np.sqrt(self.m2 / self.count)) if self.count > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "RunningStats":
+        data = data or {}
+        return cls(data.get("count", 0), data.get("mean", 0.0), data.get("m2", 0.0), data.get("min"), data.get("max"))
+
+
+class HealthAnalyzer:
+    """Analisador incremental da saúde do equipamento.
+
+    Mantém um buffer circular das leituras mais recentes e estatísticas
+    acumuladas por canal. O estado é persistido no campo `health_state` do
+    documento do equipamento, de modo que cada nova leitura custa O(1)
+    independentemente do tamanho do histórico.
+    """
+
+    def __init__(self, capacity: int = HEALTH_WINDOW_SIZE):
+        self.capacity = capacity
+        self.buffers = {channel: RingBuffer(capacity) for channel in CHANNELS}
+        self.stats = {channel: RunningStats() for channel in CHANNELS}
+        self.last_date: Optional[datetime] = None
+
+    def push(self, reading: Dict[str, Any]) -> None:
+        """Incorpora uma leitura ao estado"""
+        date = _as_utc(reading["date"])
+        for channel in CHANNELS:
+            self.stats[channel].push(reading.get(channel))
+
+        # Leituras fora de ordem (mais antigas que a última) atualizam apenas as estatísticas
+        if self.last_date is not None and date < self.last_date:
+            return
+        for channel in CHANNELS:
+            self.buffers[channel].push(reading.get(channel))
+        self.last_date = date
+
+    def extend(self, readings: List[Dict[str, Any]]) -> None:
+        """Incorpora um lote de leituras (ex.: importação em massa) de forma vetorizada"""
+        if not readings:
+            return
+        readings = sorted(readings, key=lambda r: _as_utc(r["date"]))
+        for channel in CHANNELS:
+            values = np.array([np.nan if r.get(channel) is None else r[channel] for r in readings], dtype=float)
+            self.stats[channel].merge(values)
+
+        recent = [r for r in readings if self.last_date is None or _as_utc(r["date"]) >= self.last_date]
+        for reading in recent[-self.capacity:]:
+            for channel in CHANNELS:
+                self.buffers[channel].push(reading.get(channel))
+        if recent:
+            self.last_date = _as_utc(recent[-1]["date"])
+
+    def merge(self, other: "HealthAnalyzer", recent: List[Dict[str, Any]]) -> None:
+        """Incorpora o estado de um lote processado à parte (ex.: importação em massa).
+
+        `other` traz as estatísticas do lote e `recent` as suas leituras mais
+        recentes (ao menos `capacity`); o resultado é o mesmo de `extend` com
+        todas as leituras do lote.
+        """
+        for channel in CHANNELS:
+            self.stats[channel].combine(other.stats[channel])
+        recent = sorted(recent, key=lambda r: _as_utc(r["date"]))
+        recent = [r for r in recent if self.last_date is None or _as_utc(r["date"]) >= self.last_date]
+        for reading in recent[-self.capacity:]:
+            for channel in CHANNELS:
+                self.buffers[channel].push(reading.get(channel))
+        if recent:
+            self.last_date = _as_utc(recent[-1]["date"])
+
+    @property
+    def window_count(self) -> int:
+        return self.buffers[CHANNELS[0]].count
+
+    def recent(self, channel: str, n: int = RISK_WINDOW) -> np.ndarray:
+        """Últimos n valores do canal entre as n leituras mais recentes (sem valores ausentes)"""
+        values = self.buffers[channel].last(n)
+        return values[~np.isnan(values)]
+
+    def latest(self, channels) -> np.ndarray:
+        """Valor mais recente de cada canal (NaN quando ausente)"""
+        return np.array([self.buffers[c].last(1)[0] if self.buffers[c].count else np.nan for c in channels])
+
+    def window(self, channels, n: Optional[int] = None) -> np.ndarray:
+        """Matriz (leituras x canais) das n leituras mais recentes da janela (NaN quando ausente)"""
+        return np.column_stack([self.buffers[c].last(n) for c in channels])
+
+    def evaluate(self, current: Tuple[str, bool] = ("low", False)) -> Tuple[str, bool]:
+        """Avalia o risco a partir das leituras mais recentes.
+
+        Com menos de RISK_WINDOW leituras, mantém a avaliação `current`.
+        """
+        if self.window_count < RISK_WINDOW:
+            return current
+
+        temp_trend = self.recent("temperature")
+        vibration_trend = self.recent("vibration")
+
+        risk_level = "low"
+        needs_maintenance = False
+
+        # Lógica simplificada de análise
+        if len(temp_trend) >= 3:
+            if temp_trend[-1] > 80 or (temp_trend[-1] > temp_trend[-2] > temp_trend[-3] and temp_trend[-1] > 70):
+                risk_level = "high"
+                needs_maintenance = True
+            elif temp_trend[-1] > 60:
+                risk_level = "medium"
+
+        if len(vibration_trend) >= 3:
+            if vibration_trend[-1] > 0.8 or (vibration_trend[-1] > vibration_trend[-2] > vibration_trend[-3] and vibration_trend[-1] > 0.6):
+                risk_level = "high"
+                needs_maintenance = True
+            elif vibration_trend[-1] > 0.5:
+                risk_level = "medium"
+
+        return risk_level, needs_maintenance
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "last_date": self.last_date,
+            "buffers": {channel: buffer.to_dict() for channel, buffer in self.buffers.items()},
+            "stats": {channel: stats.to_dict() for channel, stats in self.stats.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "HealthAnalyzer":
+        data = data or {}
+        analyzer = cls(data.get("capacity", HEALTH_WINDOW_SIZE))
+        buffers = data.get("buffers", {})
+        stats = data.get("stats", {})
+        for channel in CHANNELS:
+            analyzer.buffers[channel] = RingBuffer.from_dict(buffers.get(channel), analyzer.capacity)
+            analyzer.stats[channel] = RunningStats.from_dict(stats.get(channel))
+        if data.get("last_date") is not None:
+            analyzer.last_date = _as_utc(data["last_date"])
+        return analyzer
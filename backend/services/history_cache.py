@@ -0,0 +1,234 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Sequence
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from services.timeseries_service import TimeSeriesService, _as_utc
+
+
+# Quantidade máxima de equipamentos mantidos em memória
+HISTORY_CACHE_MAX_EQUIPMENT = int(os.getenv("HISTORY_CACHE_MAX_EQUIPMENT", "64"))
+# Diretório opcional para persistir o histórico em arquivos mapeados em memória
+HISTORY_CACHE_DIR = os.getenv("HISTORY_CACHE_DIR", "")
+# Locks (fixos) que serializam a atualização do histórico; cada equipamento usa sempre o mesmo
+HISTORY_CACHE_LOCK_STRIPES = 64
+
+VALUE_COLUMNS = ("hours_used", "temperature", "consumption", "noise_level", "vibration", "cycles")
+
+
+def _to_epoch_ns(dates: Sequence[datetime]) -> np.ndarray:
+    return np.array([int(_as_utc(d).timestamp() * 1_000_000) * 1000 for d in dates], dtype=np.int64)
+
+
+class ColumnarHistory:
+    """Histórico de leituras de um equipamento em formato colunar (arrays NumPy).
+
+    As datas são mantidas como nanossegundos desde a época (UTC) e cada canal
+    como float64, com NaN para valores ausentes.
+    """
+
+    def __init__(self, dates: Optional[np.ndarray] = None, columns: Optional[Dict[str, np.ndarray]] = None):
+        self.dates = dates if dates is not None else np.empty(0, dtype=np.int64)
+        self.columns = columns or {column: np.empty(0, dtype=np.float64) for column in VALUE_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @property
+    def last_date(self) -> Optional[datetime]:
+        if not len(self.dates):
+            return None
+        return pd.Timestamp(int(self.dates[-1]), tz="UTC").to_pydatetime()
+
+    @staticmethod
+    def from_readings(readings: List[Dict[str, Any]]) -> "ColumnarHistory":
+        dates = _to_epoch_ns([r["date"] for r in readings])
+        columns = {
+            column: np.array([np.nan if r.get(column) is None else r[column] for r in readings], dtype=np.float64)
+            for column in VALUE_COLUMNS
+        }
+        order = np.argsort(dates, kind="stable")
+        return ColumnarHistory(dates[order], {c: v[order] for c, v in columns.items()})
+
+    def concat(self, other: "ColumnarHistory") -> "ColumnarHistory":
+        """Novo histórico com as leituras de `other` anexadas (reordenado se vierem fora de ordem).
+
+        Não altera `self`, que pode estar sendo lido por outras requisições.
+        """
+        if not len(other):
+            return self
+        dates = np.concatenate([self.dates, other.dates])
+        columns = {c: np.concatenate([self.columns[c], other.columns[c]]) for c in VALUE_COLUMNS}
+        if len(self.dates) and other.dates[0] < self.dates[-1]:
+            order = np.argsort(dates, kind="stable")
+            dates = dates[order]
+            columns = {c: v[order] for c, v in columns.items()}
+        return ColumnarHistory(dates, columns)
+
+    def matrix(self, columns: Sequence[str], fill_value: float = 0.0) -> np.ndarray:
+        """Empilha os canais pedidos em uma matriz (linhas = leituras)"""
+        matrix = np.column_stack([self.columns[c] for c in columns]) if len(self) else np.empty((0, len(columns)))
+        return np.nan_to_num(matrix, nan=fill_value)
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame indexado pela data da leitura"""
+        index = pd.DatetimeIndex(pd.to_datetime(self.dates, utc=True), name="date")
+        return pd.DataFrame({c: self.columns[c] for c in VALUE_COLUMNS}, index=index)
+
+
+class SensorHistoryCache:
+    """Cache LRU do histórico colunar de cada equipamento.
+
+    A validade é verificada pelo `readings_count` do documento do equipamento
+    (que o chamador já leu): se bater com o cache, nenhuma leitura adicional ao
+    Firestore é feita; caso contrário, só as leituras posteriores à última data
+    em cache são buscadas. Com HISTORY_CACHE_DIR definido, os arrays também são
+    gravados em disco e reabertos com np.memmap após reinícios ou evicções.
+    """
+
+    def __init__(self, max_entries: int = HISTORY_CACHE_MAX_EQUIPMENT, cache_dir: str = HISTORY_CACHE_DIR):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries: "OrderedDict[str, ColumnarHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Atualização do histórico e escrita em disco de um equipamento não podem se sobrepor;
+        # um conjunto fixo de locks mantém a memória constante, qualquer que seja a frota
+        self._equipment_locks = [threading.Lock() for _ in range(HISTORY_CACHE_LOCK_STRIPES)]
+        self.metrics = {"hits": 0, "misses": 0, "incremental_refreshes": 0, "full_reloads": 0, "evictions": 0}
+
+    def _count(self, metric: str) -> None:
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def _equipment_lock(self, equipment_id: str) -> threading.Lock:
+        return self._equipment_locks[hash(equipment_id) % len(self._equipment_locks)]
+
+    def get(self, equipment_id: str, readings_count: Optional[int] = None) -> ColumnarHistory:
+        """Retorna o histórico do equipamento, atualizando-o de forma incremental se necessário.
+
+        Requisições simultâneas para o mesmo equipamento esperam a que chegou
+        primeiro e reaproveitam o histórico já atualizado; o objeto devolvido
+        nunca é alterado depois (cada atualização cria um novo).
+        """
+        with self._equipment_lock(equipment_id):
+            with self._lock:
+                history = self._entries.get(equipment_id)
+                if history is not None:
+                    self._entries.move_to_end(equipment_id)
+
+            if history is None:
+                history = self._load_from_disk(equipment_id)
+
+            if history is not None and readings_count is not None and len(history) == readings_count:
+                self._count("hits")
+            elif history is None:
+                self._count("misses")
+                history = self._full_reload(equipment_id)
+            else:
+                self._count("incremental_refreshes")
+                history = self._refresh(equipment_id, history, readings_count)
+
+            self._store(equipment_id, history)
+            return history
+
+    def invalidate(self, equipment_id: str) -> None:
+        with self._equipment_lock(equipment_id):
+            with self._lock:
+                self._entries.pop(equipment_id, None)
+            if self.cache_dir:
+                shutil.rmtree(self._equipment_dir(equipment_id), ignore_errors=True)
+
+    def _refresh(self, equipment_id: str, history: ColumnarHistory, readings_count: Optional[int]) -> ColumnarHistory:
+        last_date = history.last_date
+        new_readings = [
+            r for r in TimeSeriesService.get_readings(equipment_id, start=last_date)
+            if _as_utc(r["date"]) > last_date
+        ] if last_date else TimeSeriesService.get_readings(equipment_id)
+
+        # Leituras retroativas (ex.: importação de dados antigos) não aparecem após a
+        # última data em cache: nesse caso a contagem não fecha e o histórico é recarregado
+        if readings_count is not None and len(history) + len(new_readings) != readings_count:
+            return self._full_reload(equipment_id)
+
+        increment = ColumnarHistory.from_readings(new_readings)
+        self._append_to_disk(equipment_id, increment)
+        return history.concat(increment)
+
+    def _full_reload(self, equipment_id: str) -> ColumnarHistory:
+        self._count("full_reloads")
+        history = ColumnarHistory.from_readings(TimeSeriesService.get_readings(equipment_id))
+        if self.cache_dir:
+            shutil.rmtree(self._equipment_dir(equipment_id), ignore_errors=True)
+            self._append_to_disk(equipment_id, history)
+        return history
+
+    def _store(self, equipment_id: str, history: ColumnarHistory) -> None:
+        with self._lock:
+            self._entries[equipment_id] = history
+            self._entries.move_to_end(equipment_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.metrics["evictions"] += 1
+
+    def _equipment_dir(self, equipment_id: str) -> str:
+        return os.path.join(self.cache_dir, equipment_id)
+
+    def _append_to_disk(self, equipment_id: str, history: ColumnarHistory) -> None:
+        """Anexa os arrays aos arquivos binários do equipamento (um arquivo por coluna)"""
+        if not self.cache_dir or not len(history):
+            return
+        directory = self._equipment_dir(equipment_id)
+        os.makedirs(directory, exist_ok=True)
+        existing = self._disk_count(directory)
+        arrays = {"date": history.dates, **history.columns}
+        for name, values in arrays.items():
+            path = os.path.join(directory, f"{name}.bin")
+            # Descarta bytes de uma escrita anterior interrompida antes de anexar
+            if os.path.exists(path) and os.path.getsize(path) != existing * 8:
+                os.truncate(path, existing * 8)
+            with open(path, "ab") as f:
+                f.write(np.ascontiguousarray(values).tobytes())
+        # O contador só é atualizado depois das colunas, protegendo contra escritas parciais
+        meta_path = os.path.join(directory, "meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"count": existing + len(history)}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    @staticmethod
+    def _disk_count(directory: str) -> int:
+        try:
+            with open(os.path.join(directory, "meta.json")) as f:
+                return json.load(f)["count"]
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _load_from_disk(self, equipment_id: str) -> Optional[ColumnarHistory]:
+        if not self.cache_dir:
+            return None
+        directory = self._equipment_dir(equipment_id)
+        count = self._disk_count(directory)
+        if not count:
+            return None
+        try:
+            dates = np.memmap(os.path.join(directory, "date.bin"), dtype=np.int64, mode="r", shape=(count,))
+            columns = {
+                column: np.memmap(os.path.join(directory, f"{column}.bin"), dtype=np.float64, mode="r", shape=(count,))
+                for column in VALUE_COLUMNS
+            }
+        except (OSError, ValueError) as e:
+            print(f"Erro ao abrir histórico em disco de {equipment_id}: {e}")
+            return None
+        if not np.all(dates[1:] >= dates[:-1]):
+            # Arquivos gravados com leituras fora de ordem: descartar e recarregar
+            return None
+        return ColumnarHistory(dates, columns)
+
+
+# Instância compartilhada pelo processo
+history_cache = SensorHistoryCache()
@@ -0,0 +1,300 @@
+from datetime import datetime
+from typing import List, Dict, Any, Iterator, Optional, BinaryIO, Tuple
+import os
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from firebase_admin import firestore
+
+from config import db
+from services.timeseries_service import TimeSeriesService, _as_utc
+from services.health_analyzer import HealthAnalyzer
+from services.anomaly_detector import AnomalyDetector
+from services.snapshot_service import prediction_snapshots
+from utils.wire_format import CONTENT_TYPE as FRAME_CONTENT_TYPE, WireFormatError, read_frames, frame_to_dataframe
+
+
+# Número de linhas processadas (validadas e gravadas) por vez
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "5000"))
+# Quantidade máxima de erros de linha devolvidos na resposta
+MAX_REPORTED_ERRORS = 100
+
+NUMERIC_COLUMNS = ["hours_used", "temperature", "consumption", "noise_level", "vibration", "cycles", "sequence"]
+INTEGER_COLUMNS = ("cycles", "sequence")
+
+# Nomes alternativos de colunas aceitos nos arquivos enviados
+COLUMN_ALIASES = {
+    "timestamp": "date",
+    "data": "date",
+    "datetime": "date",
+    "hours": "hours_used",
+    "hours_operated": "hours_used",
+    "horas": "hours_used",
+    "temperatura": "temperature",
+    "fuel_consumption": "consumption",
+    "consumo": "consumption",
+    "noise": "noise_level",
+    "ruido": "noise_level",
+    "vibracao": "vibration",
+    "ciclos": "cycles",
+}
+
+
+def _detect_format(filename: str, content_type: Optional[str]) -> str:
+    name = (filename or "").lower()
+    if name.endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or content_type in ("application/x-ndjson", "application/jsonlines"):
+        return "ndjson"
+    if name.endswith(".xlsx") or content_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet":
+        return "xlsx"
+    if name.endswith(".agf") or content_type == FRAME_CONTENT_TYPE:
+        return "frame"
+    raise HTTPException(
+        status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+        detail="Formato não suportado. Use CSV, XLSX, NDJSON ou frames binários .agf (arquivos .xls devem ser convertidos para .xlsx)"
+    )
+
+
+def _iter_xlsx_chunks(file: BinaryIO, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Lê uma planilha XLSX em modo streaming, produzindo DataFrames de até chunk_rows linhas"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else "" for c in header]
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=columns)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _iter_frame_chunks(file: BinaryIO, chunk_rows: int, equipment_id: Optional[str]) -> Iterator[pd.DataFrame]:
+    """Decodifica frames binários (utils.wire_format) em DataFrames de até chunk_rows linhas"""
+    try:
+        for frame_equipment, columns in read_frames(file):
+            if frame_equipment and equipment_id and frame_equipment != equipment_id:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Frame pertence a outro equipamento: {frame_equipment}"
+                )
+            frame = frame_to_dataframe(columns)
+            for offset in range(0, len(frame), chunk_rows):
+                yield frame.iloc[offset:offset + chunk_rows].reset_index(drop=True)
+    except WireFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Frame binário inválido: {str(e)}")
+
+
+def iter_chunks(file: BinaryIO, file_format: str, chunk_rows: int = IMPORT_CHUNK_ROWS,
+                equipment_id: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    """Itera sobre o arquivo em blocos de linhas sem carregá-lo inteiro em memória"""
+    if file_format == "csv":
+        yield from pd.read_csv(file, chunksize=chunk_rows, skipinitialspace=True)
+    elif file_format == "ndjson":
+        yield from pd.read_json(file, lines=True, chunksize=chunk_rows)
+    elif file_format == "xlsx":
+        yield from _iter_xlsx_chunks(file, chunk_rows)
+    elif file_format == "frame":
+        yield from _iter_frame_chunks(file, chunk_rows, equipment_id)
+
+
+def validate_chunk(chunk: pd.DataFrame, first_row: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Valida um bloco de linhas de forma vetorizada contra o esquema de OperationalData.
+
+    Retorna (leituras válidas, erros). `first_row` é o número da primeira
+    linha do bloco no arquivo (1 = primeira linha de dados).
+    """
+    chunk = chunk.rename(columns=lambda c: COLUMN_ALIASES.get(str(c).strip().lower(), str(c).strip().lower()))
+    row_numbers = np.arange(first_row, first_row + len(chunk))
+
+    if "date" not in chunk.columns or "hours_used" not in chunk.columns:
+        return [], [{"row": int(first_row), "error": "Colunas obrigatórias ausentes: date, hours_used"}]
+
+    dates = pd.to_datetime(chunk["date"], errors="coerce", utc=True)
+    invalid = dates.isna().to_numpy()
+    reasons = np.where(invalid, "date inválida", "")
+
+    columns = {}
+    for column in NUMERIC_COLUMNS:
+        if column not in chunk.columns:
+            continue
+        raw = chunk[column]
+        values = pd.to_numeric(raw, errors="coerce")
+        # Valores preenchidos que não puderam ser convertidos são erros; vazios são aceitos
+        bad = (values.isna() & raw.notna()).to_numpy()
+        if column in INTEGER_COLUMNS:
+            bad = bad | (values.notna() & (values % 1 != 0)).to_numpy()
+        reasons = np.where(bad & ~invalid, f"{column} inválido", reasons)
+        invalid = invalid | bad
+        columns[column] = values
+
+    hours = columns["hours_used"]
+    bad_hours = (hours.isna() | (hours < 0)).to_numpy()
+    reasons = np.where(bad_hours & ~invalid, "hours_used ausente ou negativo", reasons)
+    invalid = invalid | bad_hours
+
+    valid = ~invalid
+    errors = [
+        {"row": int(row), "error": str(reason)}
+        for row, reason in zip(row_numbers[invalid][:MAX_REPORTED_ERRORS], reasons[invalid][:MAX_REPORTED_ERRORS])
+    ]
+
+    frame = pd.DataFrame({"date": dates[valid].dt.to_pydatetime()})
+    for column, values in columns.items():
+        values = values[valid]
+        if column in INTEGER_COLUMNS:
+            values = values.astype("Int64")
+        frame[column] = values.astype(object).where(values.notna(), None).to_numpy()
+
+    return frame.to_dict(orient="records"), errors
+
+
+class ImportService:
+    @staticmethod
+    def _import_chunk(equipment_id: str, chunk: pd.DataFrame, first_row: int, analyzer: HealthAnalyzer,
+                      recent: List[Dict[str, Any]], detector: AnomalyDetector) -> Dict[str, Any]:
+        """Valida e grava um bloco; apenas leituras ainda não armazenadas entram nos totais e no estado"""
+        readings, errors = validate_chunk(chunk, first_row)
+        readings.sort(key=lambda r: _as_utc(r["date"]))
+        new = TimeSeriesService.new_readings(equipment_id, readings)
+        TimeSeriesService.append_readings(equipment_id, new)
+        analyzer.extend(new)
+        # O histórico importado alimenta a linha de base do detector online, sem gerar anomalias
+        for reading in new:
+            detector.push(reading)
+        # Leituras mais recentes do arquivo, aplicadas ao buffer do equipamento no final
+        recent[:] = sorted(recent + new[-analyzer.capacity:], key=lambda r: _as_utc(r["date"]))[-analyzer.capacity:]
+        return {
+            "rows": len(chunk),
+            "valid": len(readings),
+            "imported": len(new),
+            "errors": errors,
+            "hours_used": float(sum(r["hours_used"] for r in new)),
+            "last_date": max((r["date"] for r in new), default=None),
+        }
+
+    @staticmethod
+    @firestore.transactional
+    def _apply_import(transaction, equipment_id: str, analyzer: HealthAnalyzer, recent: List[Dict[str, Any]],
+                      detector: AnomalyDetector, imported: int, total_hours: float,
+                      last_date: Optional[datetime]) -> Tuple[Tuple[str, bool], Tuple[str, bool]]:
+        """Aplica os totais e o estado da importação sobre o documento atual do equipamento.
+
+        O documento é relido na transação, então leituras ingeridas durante a
+        importação não são sobrescritas. O detector de anomalias, que não pode
+        ser combinado, é substituído pelo alimentado com o histórico importado
+        (leituras ao vivo recebidas durante a importação ficam fora da sua
+        linha de base). Retorna o risco anterior e o novo.
+        """
+        equipment_ref = db.collection("equipment").document(equipment_id)
+        equipment_doc = equipment_ref.get(transaction=transaction)
+        if not equipment_doc.exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Equipamento não encontrado"
+            )
+
+        equipment_data = equipment_doc.to_dict()
+        current_risk = (equipment_data.get("risk_level", "low"), equipment_data.get("needs_maintenance", False))
+        health = HealthAnalyzer.from_dict(equipment_data.get("health_state"))
+        health.merge(analyzer, recent)
+        risk_level, needs_maintenance = health.evaluate(current_risk)
+
+        update_data = {
+            "total_usage_hours": equipment_data.get("total_usage_hours", 0) + total_hours,
+            "readings_count": equipment_data.get("readings_count", 0) + imported,
+            "health_state": health.to_dict(),
+            "anomaly_state": detector.to_dict(),
+            "risk_level": risk_level,
+            "needs_maintenance": needs_maintenance,
+            "updated_at": datetime.utcnow()
+        }
+        last_reading_at = equipment_data.get("last_reading_at")
+        if last_reading_at is None or last_date > _as_utc(last_reading_at):
+            update_data["last_reading_at"] = last_date
+        transaction.update(equipment_ref, update_data)
+        return current_risk, (risk_level, needs_maintenance)
+
+    @staticmethod
+    async def import_operational_data(equipment_id: str, user_id: str, file: UploadFile) -> Dict[str, Any]:
+        """Importa leituras operacionais em massa a partir de um arquivo CSV, XLSX, NDJSON ou de frames binários.
+
+        Leituras já armazenadas (mesma data e sequência) são ignoradas e
+        contadas em `duplicates`, de modo que reenviar um arquivo não altera os totais.
+        """
+        from services.equipment_service import EquipmentService
+
+        try:
+            # Verificar se o equipamento existe e pertence ao usuário
+            equipment = await EquipmentService.get_equipment_by_id(equipment_id, user_id)
+            file_format = _detect_format(file.filename, file.content_type)
+
+            imported = 0
+            rejected = 0
+            duplicates = 0
+            total_hours = 0.0
+            last_date = None
+            errors: List[Dict[str, Any]] = []
+            chunks = iter_chunks(file.file, file_format, equipment_id=equipment_id)
+            # Estado apenas das leituras importadas, combinado ao do equipamento no final
+            analyzer = HealthAnalyzer()
+            recent: List[Dict[str, Any]] = []
+            detector = AnomalyDetector.from_dict(equipment.anomaly_state)
+            next_row = 1
+
+            while True:
+                chunk = await run_in_threadpool(next, chunks, None)
+                if chunk is None:
+                    break
+                result = await run_in_threadpool(
+                    ImportService._import_chunk, equipment_id, chunk, next_row, analyzer, recent, detector
+                )
+                next_row += result["rows"]
+                imported += result["imported"]
+                rejected += result["rows"] - result["valid"]
+                duplicates += result["valid"] - result["imported"]
+                total_hours += result["hours_used"]
+                if result["last_date"] and (last_date is None or result["last_date"] > last_date):
+                    last_date = result["last_date"]
+                errors.extend(result["errors"][:MAX_REPORTED_ERRORS - len(errors)])
+
+            if imported:
+                # Reavaliar o risco uma única vez ao final da importação
+                current_risk, (risk_level, needs_maintenance) = await run_in_threadpool(
+                    ImportService._apply_import, db.transaction(), equipment_id, analyzer, recent, detector,
+                    imported, total_hours, last_date
+                )
+                if (risk_level, needs_maintenance) != current_risk and risk_level == "high":
+                    from services.alert_service import AlertService
+                    await AlertService.create_alert_for_equipment(equipment_id, user_id)
+                # Novas leituras: o snapshot de previsão é recalculado no próximo ciclo
+                prediction_snapshots.mark_dirty(equipment_id)
+
+            return {
+                "equipment_id": equipment_id,
+                "format": file_format,
+                "rows": next_row - 1,
+                "imported": imported,
+                "duplicates": duplicates,
+                "rejected": rejected,
+                "errors": errors
+            }
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Erro ao importar dados operacionais: {str(e)}"
+            )
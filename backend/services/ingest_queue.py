@@ -0,0 +1,305 @@
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+
+from config import db
+
+
+# Arquivo SQLite da fila local; vazio desativa a fila (ingestão direta no Firestore)
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "")
+# Entradas drenadas por ciclo do flusher
+INGEST_FLUSH_BATCH = int(os.getenv("INGEST_FLUSH_BATCH", "200"))
+# Intervalo (segundos) entre ciclos quando a fila está vazia
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))
+# Tentativas antes de mover uma entrada para a tabela de falhas (dead letter)
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "20"))
+# Espera máxima (segundos) entre tentativas, com recuo exponencial
+INGEST_MAX_BACKOFF = 300.0
+# Tempo (segundos) em que uma entrada reservada fica invisível para outros flushers
+INGEST_LEASE_SECONDS = 120.0
+# Leituras por transação, como na ingestão por stream
+INGEST_TRANSACTION_READINGS = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    equipment_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_due ON entries (next_attempt_at, id);
+CREATE INDEX IF NOT EXISTS entries_equipment ON entries (equipment_id, id);
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    equipment_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    failed_at REAL NOT NULL,
+    error TEXT
+);
+"""
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        # Escalares NumPy vindos da validação vetorizada
+        return value.item()
+    return str(value)
+
+
+def _encode_readings(readings: List[Dict[str, Any]]) -> str:
+    return json.dumps(readings, default=_json_default)
+
+
+def _decode_readings(payload: str) -> List[Dict[str, Any]]:
+    readings = json.loads(payload)
+    for reading in readings:
+        reading["date"] = datetime.fromisoformat(reading["date"])
+    return readings
+
+
+class IngestQueue:
+    """Fila local persistente (write-ahead log em SQLite) à frente do Firestore.
+
+    `append` grava as leituras em disco (journal WAL, synchronous=FULL) e
+    retorna assim que a escrita é confirmada; o flusher em segundo plano drena
+    as entradas para o Firestore em lotes, com uma transação por equipamento.
+    Falhas transitórias são repetidas com recuo exponencial; equipamentos
+    inexistentes ou de outro usuário, e entradas que esgotam as tentativas, vão
+    para a tabela `dead_letter`. As leituras de um equipamento são gravadas na
+    ordem de chegada: uma entrada só é reservada quando todas as anteriores do
+    mesmo equipamento também estão vencidas, e uma falha interrompe as
+    seguintes até a nova tentativa. Se o processo cair após o commit no
+    Firestore e antes da remoção da entrada, a reentrega é descartada pelo
+    DedupeIndex.
+    """
+
+    def __init__(self, path: str = INGEST_QUEUE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Dono de cada equipamento já verificado, para aceitar leituras sem ler o Firestore
+        self._owners: Dict[str, str] = {}
+        self.metrics = {"appended": 0, "flushed": 0, "retries": 0, "dead_letters": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _check_owner(self, equipment_id: str, user_id: str) -> None:
+        owner = self._owners.get(equipment_id)
+        if owner is None:
+            equipment_doc = db.collection("equipment").document(equipment_id).get()
+            if not equipment_doc.exists:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Equipamento não encontrado"
+                )
+            owner = equipment_doc.to_dict()["user_id"]
+            self._owners[equipment_id] = owner
+        if owner != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Acesso não autorizado a este equipamento"
+            )
+
+    def invalidate_owner(self, equipment_id: str) -> None:
+        """Esquece o dono em cache de um equipamento (ex.: equipamento excluído)"""
+        self._owners.pop(equipment_id, None)
+
+    def _append(self, equipment_id: str, user_id: str, readings: List[Dict[str, Any]]) -> int:
+        self._check_owner(equipment_id, user_id)
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                "INSERT INTO entries (equipment_id, user_id, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (equipment_id, user_id, _encode_readings(readings), now, now)
+            )
+        self.metrics["appended"] += len(readings)
+        return cursor.lastrowid
+
+    async def append(self, equipment_id: str, user_id: str, readings: List[Dict[str, Any]]) -> int:
+        """Grava as leituras na fila local e retorna o ID da entrada"""
+        return await run_in_threadpool(self._append, equipment_id, user_id, readings)
+
+    def _claim(self, limit: int) -> List[Tuple[int, str, str, str, int]]:
+        """Reserva as entradas vencidas (em ordem de chegada) por INGEST_LEASE_SECONDS.
+
+        Entradas com uma anterior do mesmo equipamento ainda não vencida (em
+        recuo ou reservada por outro ciclo) ficam para depois, para que as
+        leituras não sejam gravadas fora de ordem.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute(
+                    "SELECT id, equipment_id, user_id, payload, attempts FROM entries AS e "
+                    "WHERE next_attempt_at <= ? AND NOT EXISTS ("
+                    "SELECT 1 FROM entries AS p WHERE p.equipment_id = e.equipment_id AND p.id < e.id "
+                    "AND p.next_attempt_at > ?) ORDER BY id LIMIT ?",
+                    (now, now, limit)
+                ).fetchall()
+                connection.executemany(
+                    "UPDATE entries SET next_attempt_at = ? WHERE id = ?",
+                    [(now + INGEST_LEASE_SECONDS, row[0]) for row in rows]
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _complete(self, entry_ids: List[int]) -> None:
+        with self._lock:
+            self._connect().executemany("DELETE FROM entries WHERE id = ?", [(i,) for i in entry_ids])
+
+    def _release(self, entry_ids: List[int]) -> None:
+        """Devolve entradas reservadas sem contar uma tentativa"""
+        now = time.time()
+        with self._lock:
+            self._connect().executemany(
+                "UPDATE entries SET next_attempt_at = ? WHERE id = ?", [(now, i) for i in entry_ids]
+            )
+
+    def _fail(self, entry_ids: List[int], attempts: Dict[int, int], error: str, permanent: bool) -> None:
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for entry_id in entry_ids:
+                    attempt = attempts[entry_id] + 1
+                    if permanent or attempt >= INGEST_MAX_ATTEMPTS:
+                        connection.execute(
+                            "INSERT INTO dead_letter (id, equipment_id, user_id, payload, attempts, created_at, failed_at, error) "
+                            "SELECT id, equipment_id, user_id, payload, ?, created_at, ?, ? FROM entries WHERE id = ?",
+                            (attempt, now, error, entry_id)
+                        )
+                        connection.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+                        self.metrics["dead_letters"] += 1
+                    else:
+                        backoff = min(INGEST_MAX_BACKOFF, 2 ** attempt)
+                        connection.execute(
+                            "UPDATE entries SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                            (attempt, now + backoff, error, entry_id)
+                        )
+                        self.metrics["retries"] += 1
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    async def flush_once(self) -> int:
+        """Drena um lote de entradas para o Firestore; retorna o número de entradas processadas"""
+        from services.equipment_service import EquipmentService
+
+        rows = await run_in_threadpool(self._claim, INGEST_FLUSH_BATCH)
+        if not rows:
+            return 0
+
+        groups: Dict[Tuple[str, str], List[Tuple[int, List[Dict[str, Any]]]]] = {}
+        attempts = {}
+        for entry_id, equipment_id, user_id, payload, entry_attempts in rows:
+            groups.setdefault((equipment_id, user_id), []).append((entry_id, _decode_readings(payload)))
+            attempts[entry_id] = entry_attempts
+
+        async def drain(equipment_id: str, user_id: str, entries: List[Tuple[int, List[Dict[str, Any]]]]):
+            # Entradas consecutivas são agrupadas até o limite de leituras por transação
+            pending_ids: List[int] = []
+            pending: List[Dict[str, Any]] = []
+            chunks = []
+            for entry_id, readings in entries:
+                if pending and len(pending) + len(readings) > INGEST_TRANSACTION_READINGS:
+                    chunks.append((pending_ids, pending))
+                    pending_ids, pending = [], []
+                pending_ids.append(entry_id)
+                pending.extend(readings)
+            chunks.append((pending_ids, pending))
+
+            for index, (entry_ids, readings) in enumerate(chunks):
+                try:
+                    await EquipmentService.ingest_readings(equipment_id, user_id, readings)
+                except Exception as e:
+                    if isinstance(e, HTTPException):
+                        await run_in_threadpool(self._fail, entry_ids, attempts, str(e.detail), True)
+                        self.invalidate_owner(equipment_id)
+                    else:
+                        await run_in_threadpool(self._fail, entry_ids, attempts, str(e), False)
+                    # As entradas seguintes esperam a nova tentativa desta, preservando a ordem
+                    remaining = [entry_id for later_ids, _ in chunks[index + 1:] for entry_id in later_ids]
+                    if remaining:
+                        await run_in_threadpool(self._release, remaining)
+                    return
+                await run_in_threadpool(self._complete, entry_ids)
+                self.metrics["flushed"] += len(readings)
+
+        await asyncio.gather(*(drain(eid, uid, entries) for (eid, uid), entries in groups.items()))
+        return len(rows)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                processed = await self.flush_once()
+            except Exception as e:
+                print(f"Erro ao drenar a fila de ingestão: {e}")
+                processed = 0
+            if not processed:
+                await asyncio.sleep(INGEST_FLUSH_INTERVAL)
+
+    def start(self) -> None:
+        """Inicia o flusher em segundo plano (chamado na inicialização da aplicação)"""
+        if self.enabled and self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Interrompe o flusher; entradas pendentes continuam no disco para a próxima execução"""
+        if self._task is None:
+            return
+        self._stopping = True
+        await self._task
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            connection = self._connect()
+            pending = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            dead_letters = connection.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+        return {"pending_entries": pending, "dead_letter_entries": dead_letters, **self.metrics}
+
+
+# Instância compartilhada pelo processo
+ingest_queue = IngestQueue()
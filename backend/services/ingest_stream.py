@@ -0,0 +1,241 @@
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import json
+import os
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+
+from models.equipment import OperationalData
+from services.import_service import validate_chunk
+from utils.wire_format import WireFormatError, decode_frames, frame_to_dataframe
+
+
+# Quantidade máxima de leituras agrupadas em uma descarga
+STREAM_MAX_BATCH = int(os.getenv("STREAM_MAX_BATCH", "500"))
+# Tempo máximo (segundos) que uma leitura espera na fila antes de ser gravada
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.5"))
+# Capacidade da fila por conexão; quando cheia, o cliente recebe "throttle"
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "2000"))
+# Leituras por transação: cada leitura pode gerar até 3 escritas (bucket e
+# rollups horário/diário), mantendo a transação abaixo de 500 operações
+STREAM_TRANSACTION_READINGS = 100
+
+
+def parse_stream_message(message: Dict[str, Any]) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[Dict[str, Any]]]:
+    """Extrai as leituras de uma mensagem do stream.
+
+    Aceita uma leitura avulsa (`{"equipment_id": ..., "date": ..., ...}`) ou um
+    lote (`{"readings": [...]}`), em que cada leitura pode trazer seu próprio
+    `equipment_id` ou herdar o da mensagem. Retorna ([(equipment_id, leitura)], erros).
+    """
+    default_equipment = message.get("equipment_id")
+    items = message["readings"] if isinstance(message.get("readings"), list) else [message]
+
+    readings = []
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"index": index, "detail": "Leitura inválida"})
+            continue
+        item = dict(item)
+        equipment_id = item.pop("equipment_id", None) or default_equipment
+        if not equipment_id:
+            errors.append({"index": index, "detail": "equipment_id ausente"})
+            continue
+        try:
+            readings.append((str(equipment_id), OperationalData(**item).dict()))
+        except ValidationError as e:
+            errors.append({"index": index, "equipment_id": equipment_id, "detail": e.errors()[0].get("msg")})
+    return readings, errors
+
+
+def parse_binary_message(data: bytes) -> Tuple[List[Tuple[str, Dict[str, Any]]], List[Dict[str, Any]]]:
+    """Extrai as leituras de uma mensagem binária com um ou mais frames (utils.wire_format).
+
+    Cada frame deve trazer o equipment_id no cabeçalho; a validação é vetorizada.
+    """
+    try:
+        frames = decode_frames(data)
+    except WireFormatError as e:
+        return [], [{"detail": f"Frame binário inválido: {str(e)}"}]
+
+    readings = []
+    errors = []
+    for index, (equipment_id, columns) in enumerate(frames):
+        if not equipment_id:
+            errors.append({"frame": index, "detail": "equipment_id ausente"})
+            continue
+        frame_readings, frame_errors = validate_chunk(frame_to_dataframe(columns), 0)
+        readings.extend((equipment_id, reading) for reading in frame_readings)
+        errors.extend(
+            {"frame": index, "index": error["row"], "equipment_id": equipment_id, "detail": error["error"]}
+            for error in frame_errors
+        )
+    return readings, errors
+
+
+class IngestStream:
+    """Sessão de ingestão contínua de leituras por WebSocket.
+
+    Aceita mensagens de texto em JSON ou binárias com frames compactos
+    (utils.wire_format). As leituras recebidas entram em uma fila limitada e são gravadas em
+    micro-lotes (até STREAM_MAX_BATCH leituras ou STREAM_FLUSH_INTERVAL
+    segundos), agrupadas por equipamento, com uma transação por grupo. Quando
+    a gravação não acompanha o ritmo de envio, a fila enche, o cliente recebe
+    `{"type": "throttle"}` e a conexão deixa de ser lida até a fila cair para
+    metade da capacidade (`{"type": "resume"}`), propagando a contrapressão
+    até o gateway.
+    """
+
+    def __init__(self, user_id: str, max_batch: int = STREAM_MAX_BATCH,
+                 flush_interval: float = STREAM_FLUSH_INTERVAL, queue_size: int = STREAM_QUEUE_SIZE):
+        self.user_id = user_id
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.queue: "asyncio.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = asyncio.Queue(maxsize=queue_size)
+        self._send_lock = asyncio.Lock()
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+        self._websocket: Optional[WebSocket] = None
+        self._connected = False
+
+    async def serve(self, websocket: WebSocket) -> None:
+        """Recebe mensagens até o cliente desconectar; a conexão já deve ter sido aceita"""
+        self._websocket = websocket
+        self._connected = True
+        flusher = asyncio.create_task(self._flush_loop())
+        try:
+            while True:
+                received = await websocket.receive()
+                if received["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(received.get("code", 1000))
+
+                if received.get("bytes") is not None:
+                    readings, errors = parse_binary_message(received["bytes"])
+                else:
+                    try:
+                        message = json.loads(received.get("text") or "")
+                    except ValueError:
+                        message = None
+                    if not isinstance(message, dict):
+                        await self._send({"type": "error", "detail": "Mensagem JSON inválida"})
+                        continue
+                    readings, errors = parse_stream_message(message)
+                if errors:
+                    await self._send({"type": "error", "errors": errors})
+                for item in readings:
+                    await self._enqueue(item)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._connected = False
+            self._resumed.set()
+            # As leituras já recebidas são gravadas mesmo após a desconexão
+            await self.queue.put(None)
+            await flusher
+
+    async def _enqueue(self, item: Tuple[str, Dict[str, Any]]) -> None:
+        if self.queue.full() and self._resumed.is_set():
+            self._resumed.clear()
+            await self._send({"type": "throttle", "queued": self.queue.qsize()})
+        await self._resumed.wait()
+        await self.queue.put(item)
+
+    async def _release_backpressure(self) -> None:
+        if not self._resumed.is_set() and self.queue.qsize() <= self.queue.maxsize // 2:
+            self._resumed.set()
+            await self._send({"type": "resume"})
+
+    async def _send(self, payload: Dict[str, Any]) -> None:
+        if not self._connected or self._websocket is None:
+            return
+        async with self._send_lock:
+            try:
+                await self._websocket.send_json(payload)
+            except (WebSocketDisconnect, RuntimeError):
+                self._connected = False
+
+    async def _next_batch(self) -> Tuple[List[Tuple[str, Dict[str, Any]]], bool]:
+        """Aguarda a primeira leitura e reúne as seguintes até o tamanho ou o prazo do lote"""
+        first = await self.queue.get()
+        if first is None:
+            return [], True
+
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        await self._release_backpressure()
+        return batch, False
+
+    async def _flush_loop(self) -> None:
+        closed = False
+        while not closed:
+            batch, closed = await self._next_batch()
+            if batch:
+                await self._send(await self.flush(batch))
+
+    async def flush(self, batch: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+        """Grava um micro-lote, com uma transação por equipamento (e por bloco de leituras)"""
+        from services.equipment_service import EquipmentService
+
+        by_equipment: Dict[str, List[Dict[str, Any]]] = {}
+        for equipment_id, reading in batch:
+            by_equipment.setdefault(equipment_id, []).append(reading)
+
+        async def ingest(equipment_id: str, readings: List[Dict[str, Any]]):
+            ack = None
+            duplicates = 0
+            anomalies = []
+            for offset in range(0, len(readings), STREAM_TRANSACTION_READINGS):
+                chunk = readings[offset:offset + STREAM_TRANSACTION_READINGS]
+                try:
+                    ack = await EquipmentService.ingest_operational_batch(equipment_id, self.user_id, chunk)
+                except HTTPException as e:
+                    return equipment_id, ack, duplicates, anomalies, len(readings) - offset, e.detail
+                duplicates += ack.duplicates
+                anomalies += ack.anomalies
+            return equipment_id, ack, duplicates, anomalies, 0, None
+
+        results = await asyncio.gather(*(ingest(eid, readings) for eid, readings in by_equipment.items()))
+
+        # Reenvios contam como aceitos: o gateway pode descartá-los da sua fila
+        accepted = 0
+        duplicates = 0
+        equipment = {}
+        errors = []
+        for equipment_id, ack, equipment_duplicates, anomalies, rejected, detail in results:
+            accepted += len(by_equipment[equipment_id]) - rejected
+            duplicates += equipment_duplicates
+            if ack is not None:
+                equipment[equipment_id] = {
+                    "queued": ack.queued,
+                    "total_usage_hours": ack.total_usage_hours,
+                    "readings_count": ack.readings_count,
+                    "risk_level": ack.risk_level,
+                    "needs_maintenance": ack.needs_maintenance,
+                    "anomalies": jsonable_encoder(anomalies),
+                }
+            if detail:
+                errors.append({"equipment_id": equipment_id, "rejected": rejected, "detail": detail})
+
+        return {
+            "type": "ack",
+            "accepted": accepted,
+            "rejected": len(batch) - accepted,
+            "duplicates": duplicates,
+            "equipment": equipment,
+            "errors": errors,
+        }
@@ -0,0 +1,131 @@
+from typing import Dict, Any, Optional
+import asyncio
+import os
+import time
+
+import httpx
+
+
+OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/generate")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3:8b")
+# Tempo máximo (segundos) de uma geração
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
+# Gerações simultâneas permitidas por worker
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+# Tempo máximo (segundos) de espera por uma vaga antes de desistir
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "10"))
+
+
+class LLMUnavailableError(Exception):
+    """O modelo não respondeu a tempo ou não havia vaga para a geração"""
+
+
+class LLMError(Exception):
+    """Erro de comunicação ou resposta inválida do modelo"""
+
+
+class LLMClient:
+    """Cliente assíncrono do Ollama com pool de conexões compartilhado.
+
+    Um semáforo limita as gerações simultâneas (OLLAMA_MAX_CONCURRENCY); as
+    chamadas excedentes esperam na fila até OLLAMA_QUEUE_TIMEOUT. Cada geração
+    tem prazo próprio para a chamada inteira, fila incluída (OLLAMA_TIMEOUT
+    por padrão), e as métricas registram o tempo de fila e de geração.
+    """
+
+    def __init__(self, url: str = OLLAMA_API_URL, model: str = OLLAMA_MODEL,
+                 timeout: float = OLLAMA_TIMEOUT, max_concurrency: int = OLLAMA_MAX_CONCURRENCY,
+                 queue_timeout: float = OLLAMA_QUEUE_TIMEOUT):
+        self.url = url
+        self.model = model
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.metrics = {
+            "requests": 0, "completed": 0, "errors": 0, "timeouts": 0, "rejected": 0,
+            "in_flight": 0, "waiting": 0,
+            "queue_seconds_total": 0.0, "queue_seconds_max": 0.0, "generation_seconds_total": 0.0,
+        }
+
+    def _ensure_client(self) -> httpx.AsyncClient:
+        # Criados sob demanda para ficarem ligados ao event loop da aplicação
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """Gera uma resposta para o prompt; `timeout` substitui o prazo padrão da geração.
+
+        O prazo vale para a chamada inteira (espera na fila + geração), e não
+        apenas para cada operação de rede do httpx.
+        """
+        deadline = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(self._generate(prompt, deadline), deadline)
+        except asyncio.TimeoutError:
+            self.metrics["timeouts"] += 1
+            raise LLMUnavailableError(f"Tempo esgotado na geração ({deadline:g}s)")
+
+    async def _generate(self, prompt: str, deadline: float) -> str:
+        client = self._ensure_client()
+        self.metrics["requests"] += 1
+
+        queued_at = time.perf_counter()
+        self.metrics["waiting"] += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), min(self.queue_timeout, deadline))
+        except asyncio.TimeoutError:
+            self.metrics["rejected"] += 1
+            raise LLMUnavailableError("Fila de gerações do modelo de IA cheia")
+        finally:
+            self.metrics["waiting"] -= 1
+
+        queue_seconds = time.perf_counter() - queued_at
+        self.metrics["queue_seconds_total"] += queue_seconds
+        self.metrics["queue_seconds_max"] = max(self.metrics["queue_seconds_max"], queue_seconds)
+
+        self.metrics["in_flight"] += 1
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                self.url,
+                json={"model": self.model, "prompt": prompt, "stream": False},
+                timeout=deadline
+            )
+            response.raise_for_status()
+            self.metrics["completed"] += 1
+            return response.json().get("response", "")
+        except httpx.TimeoutException as e:
+            self.metrics["timeouts"] += 1
+            raise LLMUnavailableError(f"Tempo esgotado na geração: {e}")
+        except (httpx.HTTPError, ValueError) as e:
+            self.metrics["errors"] += 1
+            raise LLMError(str(e))
+        finally:
+            self.metrics["in_flight"] -= 1
+            self.metrics["generation_seconds_total"] += time.perf_counter() - started
+            self._semaphore.release()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    def stats(self) -> Dict[str, Any]:
+        started = self.metrics["requests"] - self.metrics["rejected"] - self.metrics["waiting"]
+        return {
+            **self.metrics,
+            "max_concurrency": self.max_concurrency,
+            "queue_seconds_avg": self.metrics["queue_seconds_total"] / started if started > 0 else 0.0,
+        }
+
+
+# Instância compartilhada pelo processo
+llm_client = LLMClient()
@@ -0,0 +1,181 @@
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+
+from services.compiled_model import CompiledFailureModel, compile_failure_model
+
+
+# Diretório dos modelos treinados
+MODELS_DIR = os.getenv("MODELS_DIR", "./models/ai")
+# Quantidade máxima de modelos desserializados mantidos em memória
+MODEL_REGISTRY_MAX_MODELS = int(os.getenv("MODEL_REGISTRY_MAX_MODELS", "16"))
+# Preferir o artefato compilado (.npz) ao modelo completo (.joblib) nas previsões
+MODEL_REGISTRY_COMPILED = os.getenv("MODEL_REGISTRY_COMPILED", "true").lower() in ("true", "1", "t")
+
+COMPILED_EXTENSION = ".npz"
+
+
+# Definir um modelo de falha padrão para uso quando não houver dados suficientes
+class DefaultFailureModel:
+    def predict_proba(self, X):
+        # Retorna uma probabilidade de 50% para não falha e 50% para falha
+        return np.tile([0.5, 0.5], (len(X), 1))
+
+    def predict(self, X):
+        # Retorna 0 (não falha) por padrão
+        return np.zeros(len(X), dtype=int)
+
+
+def model_filename(category: Optional[str], equipment_id: Optional[str] = None) -> str:
+    """Nome do arquivo do modelo de uma categoria ou de um equipamento específico"""
+    category = category or "general"
+    if equipment_id:
+        return f"failure_model_{category}_{equipment_id}.joblib"
+    return f"failure_model_{category}.joblib"
+
+
+def compiled_path(path: str) -> str:
+    """Caminho do artefato compilado correspondente a um modelo .joblib"""
+    return os.path.splitext(path)[0] + COMPILED_EXTENSION
+
+
+class ModelRegistry:
+    """Resolve e mantém em cache os modelos de falha.
+
+    A ordem de resolução é: modelo do equipamento -> modelo da categoria ->
+    DefaultFailureModel. Para cada nível, o artefato compilado (.npz, avaliado
+    só com NumPy) tem preferência sobre o .joblib completo, que continua sendo
+    a base dos treinos incrementais. Os modelos carregados ficam em um cache
+    LRU indexado pelo caminho do arquivo; cada consulta faz apenas um os.stat
+    e recarrega o modelo quando o mtime/tamanho do arquivo mudam (ex.: após um
+    novo treino).
+    """
+
+    def __init__(self, models_dir: str = MODELS_DIR, max_models: int = MODEL_REGISTRY_MAX_MODELS,
+                 prefer_compiled: bool = MODEL_REGISTRY_COMPILED):
+        self.models_dir = models_dir
+        self.max_models = max_models
+        self.prefer_compiled = prefer_compiled
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._default = DefaultFailureModel()
+        self.metrics = {"hits": 0, "loads": 0, "reloads": 0, "evictions": 0, "defaults": 0, "load_seconds": 0.0}
+
+    def path_for(self, category: Optional[str], equipment_id: Optional[str] = None) -> str:
+        return os.path.join(self.models_dir, model_filename(category, equipment_id))
+
+    def candidates(self, equipment_id: Optional[str], category: Optional[str]) -> List[Tuple[str, str]]:
+        """Caminhos candidatos em ordem de preferência, com a origem de cada um"""
+        candidates = []
+        if equipment_id:
+            candidates.append(("equipment", self.path_for(category, equipment_id)))
+        candidates.append(("category", self.path_for(category)))
+        return candidates
+
+    def resolve(self, equipment_id: Optional[str], category: Optional[str]) -> Tuple[Any, str]:
+        """Retorna (modelo, origem), com origem em equipment, category ou default"""
+        for source, path in self.candidates(equipment_id, category):
+            model = self.load(compiled_path(path)) if self.prefer_compiled else None
+            if model is None:
+                model = self.load(path)
+            if model is not None:
+                return model, source
+        self.metrics["defaults"] += 1
+        return self._default, "default"
+
+    def load(self, path: str) -> Optional[Any]:
+        """Carrega um modelo pelo caminho, usando o cache enquanto o arquivo não mudar"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return None
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == version:
+                self._entries.move_to_end(path)
+                self.metrics["hits"] += 1
+                return cached[1]
+
+        started = time.perf_counter()
+        try:
+            if path.endswith(COMPILED_EXTENSION):
+                model = CompiledFailureModel.load(path)
+            else:
+                model = joblib.load(path)
+        except Exception as e:
+            print(f"Erro ao carregar modelo {path}: {e}")
+            return None
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.metrics["reloads" if cached is not None else "loads"] += 1
+            self.metrics["load_seconds"] += elapsed
+            self._store(path, version, model)
+        return model
+
+    def save(self, model: Any, category: Optional[str], equipment_id: Optional[str] = None) -> str:
+        """Grava o modelo de forma atômica (arquivo temporário + rename) e o coloca no cache.
+
+        Modelos compiláveis também são exportados para o .npz; se a compilação
+        não for possível, um .npz anterior é removido para não ficar desatualizado.
+        """
+        os.makedirs(self.models_dir, exist_ok=True)
+        path = self.path_for(category, equipment_id)
+        self._write_atomic(path, lambda f: joblib.dump(model, f), model)
+
+        compiled = compile_failure_model(model)
+        if compiled is not None:
+            self._write_atomic(compiled_path(path), compiled.save, compiled)
+        else:
+            try:
+                os.remove(compiled_path(path))
+            except OSError:
+                pass
+            self.invalidate(compiled_path(path))
+        return path
+
+    def _write_atomic(self, path: str, write, model: Any) -> None:
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with open(tmp_path, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        stat = os.stat(path)
+        with self._lock:
+            self._store(path, (stat.st_mtime_ns, stat.st_size), model)
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    def _store(self, path: str, version: Tuple[int, int], model: Any) -> None:
+        self._entries[path] = (version, model)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.max_models:
+            self._entries.popitem(last=False)
+            self.metrics["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            cached = [os.path.basename(path) for path in self._entries]
+        return {**self.metrics, "cached_models": cached, "max_models": self.max_models}
+
+
+# Instância compartilhada pelo processo
+model_registry = ModelRegistry()
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Sequence
+import os
+import threading
+import time
+
+import numpy as np
+
+from config import db
+from services.health_analyzer import HealthAnalyzer
+
+
+# Canais combinados na distância de Mahalanobis
+MULTIVARIATE_COLUMNS = ("temperature", "vibration", "noise_level", "consumption")
+# Leituras válidas (todos os canais presentes) necessárias para montar uma linha de base
+MULTIVARIATE_MIN_ROWS = int(os.getenv("MULTIVARIATE_MIN_ROWS", "30"))
+# Quantil das distâncias da própria frota usado como limite de anomalia
+MULTIVARIATE_THRESHOLD_QUANTILE = float(os.getenv("MULTIVARIATE_THRESHOLD_QUANTILE", "0.995"))
+# Fração das leituras mais distantes descartada no segundo ajuste (leituras já anômalas na frota)
+MULTIVARIATE_TRIM = float(os.getenv("MULTIVARIATE_TRIM", "0.025"))
+# Validade (segundos) de uma linha de base em memória antes de ser recalculada
+MULTIVARIATE_BASELINE_TTL = float(os.getenv("MULTIVARIATE_BASELINE_TTL", "3600"))
+# Categorias mantidas em memória
+MULTIVARIATE_CACHE_MAX_CATEGORIES = int(os.getenv("MULTIVARIATE_CACHE_MAX_CATEGORIES", "64"))
+
+
+class MahalanobisBaseline:
+    """Linha de base multivariada de uma categoria: média e matriz de precisão dos canais.
+
+    A distância de Mahalanobis pondera cada desvio pela covariância da frota,
+    de modo que combinações incomuns (temperatura e vibração subindo juntas
+    fora da relação habitual) são detectadas mesmo quando cada canal, isolado,
+    ainda está dentro da faixa normal. Canais sem dados suficientes na
+    categoria ficam fora da linha de base.
+    """
+
+    def __init__(self, columns: List[str], mean: np.ndarray, precision: np.ndarray, threshold: float,
+                 rows: int, computed_at: Optional[datetime] = None):
+        self.columns = columns
+        self.mean = mean
+        self.precision = precision
+        self.threshold = threshold
+        self.rows = rows
+        self.computed_at = computed_at or datetime.utcnow()
+
+    @staticmethod
+    def _precision(rows: np.ndarray) -> np.ndarray:
+        covariance = np.atleast_2d(np.cov(rows, rowvar=False))
+        # Regularização leve: canais quase constantes ou colineares não tornam a matriz singular
+        ridge = 1e-6 * max(float(np.trace(covariance)) / len(covariance), 1e-12)
+        return np.linalg.pinv(covariance + ridge * np.eye(len(covariance)))
+
+    @staticmethod
+    def fit(X: np.ndarray, columns: Sequence[str]) -> Optional["MahalanobisBaseline"]:
+        """Ajusta a linha de base às leituras X (linhas x colunas); None se os dados forem insuficientes"""
+        X = np.asarray(X, dtype=np.float64)
+        present = np.isfinite(X).sum(axis=0) >= MULTIVARIATE_MIN_ROWS
+        X = X[:, present]
+        rows = X[np.isfinite(X).all(axis=1)] if X.shape[1] else X[:0]
+        if len(rows) < MULTIVARIATE_MIN_ROWS:
+            return None
+
+        columns = [c for c, keep in zip(columns, present) if keep]
+        mean = rows.mean(axis=0)
+        precision = MahalanobisBaseline._precision(rows)
+        # Segundo ajuste sem as leituras mais distantes, para que anomalias da frota não inflem a covariância
+        trimmed = MahalanobisBaseline(columns, mean, precision, np.inf, len(rows)).distances(rows)
+        keep = trimmed <= np.quantile(trimmed, 1 - MULTIVARIATE_TRIM)
+        if keep.sum() > len(columns):
+            mean = rows[keep].mean(axis=0)
+            precision = MahalanobisBaseline._precision(rows[keep])
+
+        baseline = MahalanobisBaseline(columns, mean, precision, np.inf, len(rows))
+        baseline.threshold = float(np.quantile(baseline.distances(rows), MULTIVARIATE_THRESHOLD_QUANTILE))
+        return baseline
+
+    def _centered(self, X: np.ndarray) -> np.ndarray:
+        # Canais ausentes assumem a média da categoria (não contribuem para a distância)
+        centered = np.asarray(X, dtype=np.float64) - self.mean
+        centered[~np.isfinite(centered)] = 0.0
+        return centered
+
+    def distances(self, X: np.ndarray) -> np.ndarray:
+        """Distância de Mahalanobis ao quadrado de cada linha de X (colunas em self.columns)"""
+        centered = self._centered(X)
+        return np.einsum("ij,jk,ik->i", centered, self.precision, centered)
+
+    def contributions(self, X: np.ndarray) -> np.ndarray:
+        """Parcela de cada canal na distância ao quadrado (cada linha soma a distância)"""
+        centered = self._centered(X)
+        return centered * (centered @ self.precision)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "columns": self.columns,
+            "rows": self.rows,
+            "threshold": self.threshold,
+            "mean": dict(zip(self.columns, self.mean.tolist())),
+            "computed_at": self.computed_at
+        }
+
+
+class BaselineCache:
+    """Linhas de base por categoria, calculadas sob demanda e mantidas em memória por um TTL.
+
+    As leituras vêm das janelas recentes do health_state de todos os
+    equipamentos da categoria (uma consulta, sem ler a série temporal).
+    """
+
+    def __init__(self, ttl: float = MULTIVARIATE_BASELINE_TTL, max_entries: int = MULTIVARIATE_CACHE_MAX_CATEGORIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "builds": 0, "evictions": 0}
+
+    @staticmethod
+    def _load_rows(category: str) -> np.ndarray:
+        query = db.collection("equipment").where("category", "==", category).select(["health_state"])
+        windows = []
+        for doc in query.stream():
+            analyzer = HealthAnalyzer.from_dict((doc.to_dict() or {}).get("health_state"))
+            if analyzer.window_count:
+                windows.append(analyzer.window(MULTIVARIATE_COLUMNS))
+        if not windows:
+            return np.empty((0, len(MULTIVARIATE_COLUMNS)))
+        return np.vstack(windows)
+
+    def baseline(self, category: str) -> Optional[MahalanobisBaseline]:
+        """Linha de base da categoria (bloqueante: pode consultar o Firestore)"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(category)
+            if cached is not None and now - cached[0] < self.ttl:
+                self._entries.move_to_end(category)
+                self.metrics["hits"] += 1
+                return cached[1]
+
+        baseline = MahalanobisBaseline.fit(self._load_rows(category), MULTIVARIATE_COLUMNS)
+
+        with self._lock:
+            self.metrics["builds"] += 1
+            self._entries[category] = (now, baseline)
+            self._entries.move_to_end(category)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.metrics["evictions"] += 1
+        return baseline
+
+    def invalidate(self, category: Optional[str] = None) -> None:
+        with self._lock:
+            if category is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(category, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.metrics, "entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl}
+
+
+# Instância compartilhada pelo processo
+baseline_cache = BaselineCache()
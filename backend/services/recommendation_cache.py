@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
+import asyncio
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+
+# Validade (segundos) de uma recomendação gerada pelo modelo de linguagem
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", str(6 * 3600)))
+# Quantidade máxima de recomendações em cache
+RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.getenv("RECOMMENDATION_CACHE_MAX_ENTRIES", "1024"))
+# Arquivo JSON opcional para manter o cache entre reinícios
+RECOMMENDATION_CACHE_PATH = os.getenv("RECOMMENDATION_CACHE_PATH", "")
+# Intervalo (segundos) entre gravações do arquivo, se houver recomendações novas
+RECOMMENDATION_CACHE_SAVE_INTERVAL = float(os.getenv("RECOMMENDATION_CACHE_SAVE_INTERVAL", "30"))
+
+# Largura das faixas usadas na quantização das entradas do prompt
+PROBABILITY_STEP = 0.05
+# Faixas logarítmicas do MTBF: 4 por oitava (~19% de variação por faixa)
+MTBF_BINS_PER_OCTAVE = 4
+
+
+def recommendation_fingerprint(equipment_id: str, equipment_name: str, failure_probability: float,
+                               mtbf: float, components_at_risk: List[Dict[str, Any]]) -> str:
+    """Chave da recomendação a partir das entradas do prompt quantizadas.
+
+    Pequenas variações de probabilidade e MTBF caem na mesma faixa; os
+    componentes entram apenas pelo nome e nível de risco.
+    """
+    probability_bucket = int(round(failure_probability / PROBABILITY_STEP))
+    if mtbf and mtbf > 0 and math.isfinite(mtbf):
+        mtbf_bucket = int(round(math.log2(mtbf) * MTBF_BINS_PER_OCTAVE))
+    else:
+        mtbf_bucket = None
+    components = sorted((c.get("name", ""), c.get("risk_level", "")) for c in components_at_risk)
+    key = json.dumps([equipment_id, equipment_name, probability_bucket, mtbf_bucket, components])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+class RecommendationCache:
+    """Cache LRU com validade (TTL) das recomendações do modelo de linguagem.
+
+    Chamadas simultâneas para a mesma chave compartilham uma única geração.
+    Com RECOMMENDATION_CACHE_PATH definido, as entradas válidas são gravadas
+    em JSON por um laço em segundo plano (em uma thread, no máximo a cada
+    RECOMMENDATION_CACHE_SAVE_INTERVAL e no encerramento) e recarregadas na
+    inicialização.
+    """
+
+    def __init__(self, ttl: float = RECOMMENDATION_CACHE_TTL, max_entries: int = RECOMMENDATION_CACHE_MAX_ENTRIES,
+                 path: str = RECOMMENDATION_CACHE_PATH, save_interval: float = RECOMMENDATION_CACHE_SAVE_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.save_interval = save_interval
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._pending: Dict[str, "asyncio.Future"] = {}
+        self._lock = threading.Lock()
+        # Há recomendações ainda não gravadas no arquivo
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {"hits": 0, "misses": 0, "shared": 0, "expirations": 0, "evictions": 0, "saves": 0}
+        self._load()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self.metrics["expirations"] += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.metrics["evictions"] += 1
+            self._dirty = True
+
+    async def get_or_create(self, key: str,
+                            factory: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Retorna (recomendação, veio_do_cache). Resultados None não são guardados."""
+        value = self.get(key)
+        if value is not None:
+            self.metrics["hits"] += 1
+            return value, True
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.metrics["shared"] += 1
+            return await asyncio.shield(pending), True
+
+        self.metrics["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await factory()
+            if value is not None:
+                self.set(key, value)
+            future.set_result(value)
+            return value, False
+        except BaseException as e:
+            future.set_exception(e)
+            # Evita aviso de exceção não consumida quando ninguém mais aguardava
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Erro ao carregar cache de recomendações: {e}")
+            return
+        now = time.time()
+        for key, expires_at, value in stored[-self.max_entries:]:
+            if expires_at > now:
+                self._entries[key] = (expires_at, value)
+
+    def _save(self) -> None:
+        """Grava as entradas no arquivo se houver alterações (bloqueante)"""
+        with self._lock:
+            if not self.path or not self._dirty:
+                return
+            stored = [[key, expires_at, value] for key, (expires_at, value) in self._entries.items()]
+            self._dirty = False
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(stored, f)
+            os.replace(self.path + ".tmp", self.path)
+            self.metrics["saves"] += 1
+        except OSError as e:
+            self._dirty = True
+            print(f"Erro ao gravar cache de recomendações: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.save_interval)
+            await run_in_threadpool(self._save)
+
+    def start(self) -> None:
+        """Inicia a gravação periódica do arquivo (chamado na inicialização da aplicação)"""
+        if self.path and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Interrompe a gravação periódica e grava as entradas pendentes"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await run_in_threadpool(self._save)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.metrics, "entries": len(self._entries), "max_entries": self.max_entries, "ttl_seconds": self.ttl}
+
+
+# Instância compartilhada pelo processo
+recommendation_cache = RecommendationCache()
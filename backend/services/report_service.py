@@ -8,6 +8,8 @@ from fastapi import HTTPException, status
 from firebase_admin import firestore, storage
 
 from config import db, bucket
+from services.timeseries_service import TimeSeriesService
+from services.rollup_service import RollupService
 from models.report import Report, ReportCreate, ReportUpdate, HealthReportContent, MaintenanceReportContent, PredictionReportContent
 
 class ReportService:
@@ -277,12 +279,14 @@ class ReportService:
         if equipment_data.get("total_usage_hours", 0) > 5000:
             recommendations.append("Considerar revisão geral devido ao alto tempo de uso")
         
-        # Gerar tendência histórica (simplificada)
+        # Gerar tendência histórica (simplificada) a partir dos agregados diários
         historical_trend = []
-        for i, data in enumerate(equipment_data.get("operational_data", [])[-5:]):
+        for i, rollup in enumerate(RollupService.get_rollups(equipment_data["id"], "day", limit=5)):
             historical_trend.append({
-                "date": data.get("date", datetime.utcnow() - timedelta(days=30-i*5)),
-                "health": max(0, min(100, overall_health - (5-i)*5))
+                "date": rollup.get("period_start", datetime.utcnow() - timedelta(days=30-i*5)),
+                "health": max(0, min(100, overall_health - (5-i)*5)),
+                "temperature": rollup.get("temperature"),
+                "vibration": rollup.get("vibration")
             })
         
         return {
@@ -357,8 +361,8 @@ class ReportService:
         # Implementação simplificada - em um sistema real, usaria modelos de ML mais complexos
         
         # Analisar dados operacionais
-        operational_data = equipment_data.get("operational_data", [])
-        data_points_analyzed = len(operational_data)
+        operational_data = TimeSeriesService.get_recent_readings(equipment_data["id"], 5)
+        data_points_analyzed = equipment_data.get("readings_count", len(operational_data))
         
         # Previsões de falha (simplificadas)
         predicted_failures = []
@@ -0,0 +1,159 @@
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+import math
+
+import numpy as np
+from firebase_admin import firestore
+
+from config import db
+from services.timeseries_service import _as_utc, MAX_BATCH_WRITES
+
+
+# Canais agregados nos rollups
+ROLLUP_CHANNELS = ("temperature", "vibration", "noise_level", "consumption", "cycles")
+
+# Resoluções disponíveis: subcoleção, formato do ID e função de truncamento
+RESOLUTIONS = {
+    "hour": ("rollups_hourly", "%Y%m%d%H", lambda d: d.replace(minute=0, second=0, microsecond=0)),
+    "day": ("rollups_daily", "%Y%m%d", lambda d: d.replace(hour=0, minute=0, second=0, microsecond=0)),
+}
+
+# Histograma logarítmico (estilo DDSketch) usado para estimar percentis:
+# cada bin cobre um fator HIST_GAMMA, o que garante erro relativo de ~2,5% no p95
+HIST_GAMMA = 1.05
+_LOG_GAMMA = math.log(HIST_GAMMA)
+_ZERO_THRESHOLD = 1e-9
+
+
+def _hist_keys(values: np.ndarray) -> np.ndarray:
+    """Calcula a chave do bin de cada valor: 'p{i}' (positivo), 'n{i}' (negativo) ou 'z'"""
+    magnitude = np.abs(values)
+    indices = np.floor(np.log(np.maximum(magnitude, _ZERO_THRESHOLD)) / _LOG_GAMMA).astype(int)
+    prefixes = np.where(values > _ZERO_THRESHOLD, "p", np.where(values < -_ZERO_THRESHOLD, "n", "z"))
+    return np.array([p if p == "z" else f"{p}{i}" for p, i in zip(prefixes, indices)])
+
+
+def _bin_value(key: str) -> float:
+    """Valor representativo (centro geométrico) de um bin do histograma"""
+    if key == "z":
+        return 0.0
+    value = HIST_GAMMA ** (int(key[1:]) + 0.5)
+    return value if key[0] == "p" else -value
+
+
+def _percentile(hist: Dict[str, int], q: float) -> Optional[float]:
+    if not hist:
+        return None
+    items = sorted(((_bin_value(k), n) for k, n in hist.items()), key=lambda item: item[0])
+    total = sum(n for _, n in items)
+    threshold = q * total
+    cumulative = 0
+    for value, n in items:
+        cumulative += n
+        if cumulative >= threshold:
+            return value
+    return items[-1][0]
+
+
+class RollupService:
+    @staticmethod
+    def _rollups_ref(equipment_id: str, resolution: str):
+        collection, _, _ = RESOLUTIONS[resolution]
+        return db.collection("equipment").document(equipment_id).collection(collection)
+
+    @staticmethod
+    def rollup_writes(equipment_id: str, readings: List[Dict[str, Any]]) -> List[Tuple[Any, Dict[str, Any]]]:
+        """Agrega as leituras por hora e por dia e monta as escritas correspondentes.
+
+        As escritas usam apenas transformações do Firestore (Increment, Minimum,
+        Maximum) com merge, então podem entrar em lotes ou transações sem leitura
+        prévia dos documentos de rollup.
+        """
+        if not readings:
+            return []
+
+        dates = [_as_utc(r["date"]) for r in readings]
+        writes = []
+        for resolution, (_, id_format, truncate) in RESOLUTIONS.items():
+            periods: Dict[datetime, List[int]] = {}
+            for index, date in enumerate(dates):
+                periods.setdefault(truncate(date), []).append(index)
+
+            for period_start, indices in periods.items():
+                channels = {}
+                for channel in ROLLUP_CHANNELS:
+                    values = np.array(
+                        [readings[i][channel] for i in indices if readings[i].get(channel) is not None],
+                        dtype=np.float64
+                    )
+                    if values.size == 0:
+                        continue
+                    keys, counts = np.unique(_hist_keys(values), return_counts=True)
+                    channels[channel] = {
+                        "count": firestore.Increment(int(values.size)),
+                        "sum": firestore.Increment(float(values.sum())),
+                        "min": firestore.Minimum(float(values.min())),
+                        "max": firestore.Maximum(float(values.max())),
+                        "hist": {str(k): firestore.Increment(int(n)) for k, n in zip(keys, counts)},
+                    }
+                ref = RollupService._rollups_ref(equipment_id, resolution).document(period_start.strftime(id_format))
+                writes.append((ref, {
+                    "period_start": period_start,
+                    "readings": firestore.Increment(len(indices)),
+                    "channels": channels,
+                    "updated_at": datetime.utcnow(),
+                }))
+        return writes
+
+    @staticmethod
+    def summarize(doc_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Converte um documento de rollup em min/max/média/contagem/p95 por canal"""
+        summary = {"period_start": doc_data.get("period_start"), "readings": doc_data.get("readings", 0)}
+        for channel, agg in (doc_data.get("channels") or {}).items():
+            count = agg.get("count", 0)
+            summary[channel] = {
+                "count": count,
+                "mean": agg.get("sum", 0.0) / count if count else None,
+                "min": agg.get("min"),
+                "max": agg.get("max"),
+                "p95": _percentile(agg.get("hist") or {}, 0.95),
+            }
+        return summary
+
+    @staticmethod
+    def get_rollups(equipment_id: str, resolution: str = "day", start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Retorna os agregados do intervalo em ordem cronológica"""
+        _, _, truncate = RESOLUTIONS[resolution]
+        query = RollupService._rollups_ref(equipment_id, resolution)
+        if start:
+            query = query.where("period_start", ">=", truncate(_as_utc(start)))
+        if end:
+            query = query.where("period_start", "<=", _as_utc(end))
+
+        if limit:
+            # Os períodos mais recentes, devolvidos em ordem cronológica
+            query = query.order_by("period_start", direction=firestore.Query.DESCENDING).limit(limit)
+            docs = reversed(list(query.stream()))
+        else:
+            docs = query.order_by("period_start").stream()
+        return [RollupService.summarize(doc.to_dict()) for doc in docs]
+
+    @staticmethod
+    def delete_rollups(equipment_id: str) -> int:
+        """Remove os agregados de todas as resoluções de um equipamento"""
+        deleted = 0
+        for resolution in RESOLUTIONS:
+            batch = db.batch()
+            pending = 0
+            for doc in RollupService._rollups_ref(equipment_id, resolution).stream():
+                batch.delete(doc.reference)
+                pending += 1
+                deleted += 1
+                if pending >= MAX_BATCH_WRITES:
+                    batch.commit()
+                    batch = db.batch()
+                    pending = 0
+            if pending:
+                batch.commit()
+        return deleted
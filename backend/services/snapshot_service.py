@@ -0,0 +1,264 @@
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Set
+import asyncio
+import os
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from firebase_admin import firestore
+
+from config import db
+from services.timeseries_service import MAX_BATCH_WRITES
+
+
+SNAPSHOT_COLLECTION = "prediction_snapshots"
+# Documento que registra o último recálculo periódico (compartilhado entre os workers)
+SNAPSHOT_RUNS_COLLECTION = "snapshot_runs"
+# Intervalo (segundos) entre recálculos de toda a frota; 0 desativa o recálculo periódico
+SNAPSHOT_REFRESH_INTERVAL = float(os.getenv("SNAPSHOT_REFRESH_INTERVAL", "900"))
+# Intervalo (segundos) entre recálculos dos equipamentos que receberam leituras
+SNAPSHOT_DIRTY_INTERVAL = float(os.getenv("SNAPSHOT_DIRTY_INTERVAL", "30"))
+# Idade máxima (segundos) de um snapshot servido sem recálculo, se a requisição não informar outra
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", "3600"))
+# Horizonte (dias) das previsões gravadas
+SNAPSHOT_DAYS_AHEAD = int(os.getenv("SNAPSHOT_DAYS_AHEAD", "30"))
+# Equipamentos lidos e previstos por página no recálculo da frota
+SNAPSHOT_PAGE_SIZE = int(os.getenv("SNAPSHOT_PAGE_SIZE", "200"))
+
+
+def _age_seconds(computed_at: Optional[datetime]) -> Optional[float]:
+    if computed_at is None:
+        return None
+    return (datetime.utcnow() - computed_at.replace(tzinfo=None)).total_seconds()
+
+
+class PredictionSnapshots:
+    """Previsões de falha pré-calculadas, gravadas em `prediction_snapshots/{equipment_id}`.
+
+    Um laço em segundo plano recalcula a frota inteira a cada
+    SNAPSHOT_REFRESH_INTERVAL (apenas um worker por intervalo, coordenado pelo
+    Firestore) e, a cada SNAPSHOT_DIRTY_INTERVAL, os equipamentos que
+    receberam leituras neste worker. As previsões são as mesmas da previsão
+    da frota (sem o modelo de linguagem); painéis leem um documento pronto.
+    """
+
+    def __init__(self):
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.metrics = {"periodic_runs": 0, "data_runs": 0, "read_refreshes": 0, "written": 0, "orphans_deleted": 0,
+                        "errors": 0}
+
+    def mark_dirty(self, equipment_id: str) -> None:
+        """Agenda o recálculo do snapshot do equipamento (novas leituras)"""
+        self._dirty.add(equipment_id)
+
+    def delete(self, equipment_id: str) -> None:
+        """Remove o snapshot de um equipamento excluído (bloqueante)"""
+        self._dirty.discard(equipment_id)
+        db.collection(SNAPSHOT_COLLECTION).document(equipment_id).delete()
+
+    @staticmethod
+    def _write(equipment: List[Dict[str, Any]], trigger: str) -> List[Dict[str, Any]]:
+        """Calcula e grava os snapshots de uma lista de documentos de equipamento (bloqueante)"""
+        from services.ai_service import AIService
+
+        predictions = AIService._fleet_predictions(equipment, SNAPSHOT_DAYS_AHEAD)
+        computed_at = datetime.utcnow()
+        # Equipamentos excluídos durante o cálculo não ganham um snapshot órfão
+        refs = [db.collection("equipment").document(e["id"]) for e in equipment]
+        existing = {doc.id for doc in db.get_all(refs) if doc.exists}
+        snapshots = []
+        batch = db.batch()
+        pending = 0
+        for equipment_data, prediction in zip(equipment, predictions):
+            if equipment_data["id"] not in existing:
+                continue
+            snapshot = {
+                **prediction,
+                "user_id": equipment_data.get("user_id"),
+                "days_ahead": SNAPSHOT_DAYS_AHEAD,
+                "readings_count": equipment_data.get("readings_count", 0),
+                "trigger": trigger,
+                "computed_at": computed_at
+            }
+            batch.set(db.collection(SNAPSHOT_COLLECTION).document(equipment_data["id"]), snapshot)
+            snapshots.append(snapshot)
+            pending += 1
+            if pending >= MAX_BATCH_WRITES:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+        return snapshots
+
+    def refresh_all(self) -> int:
+        """Recalcula os snapshots de todos os equipamentos, em páginas, e remove os órfãos (bloqueante)"""
+        query = db.collection("equipment").order_by("__name__").limit(SNAPSHOT_PAGE_SIZE)
+        last_doc = None
+        written = 0
+        seen: Set[str] = set()
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = list(page_query.stream())
+            if not docs:
+                break
+            seen.update(doc.id for doc in docs)
+            written += len(self._write([doc.to_dict() for doc in docs], "periodic"))
+            if len(docs) < SNAPSHOT_PAGE_SIZE:
+                break
+            last_doc = docs[-1]
+        self.metrics["written"] += written
+        self.metrics["orphans_deleted"] += self._delete_orphans(seen)
+        return written
+
+    def _delete_orphans(self, seen: Set[str]) -> int:
+        """Remove snapshots cujo equipamento não existe mais (ex.: excluído durante um recálculo)"""
+        candidates = [doc.id for doc in db.collection(SNAPSHOT_COLLECTION).select([]).stream() if doc.id not in seen]
+        if not candidates:
+            return 0
+        # Confirma a ausência: equipamentos criados depois da varredura não estão em `seen`
+        refs = [db.collection("equipment").document(equipment_id) for equipment_id in candidates]
+        orphans = [doc.id for doc in db.get_all(refs) if not doc.exists]
+        for offset in range(0, len(orphans), MAX_BATCH_WRITES):
+            batch = db.batch()
+            for equipment_id in orphans[offset:offset + MAX_BATCH_WRITES]:
+                batch.delete(db.collection(SNAPSHOT_COLLECTION).document(equipment_id))
+            batch.commit()
+        return len(orphans)
+
+    def refresh_equipment(self, equipment_ids: List[str], trigger: str = "data") -> int:
+        """Recalcula os snapshots dos equipamentos informados (bloqueante)"""
+        refs = [db.collection("equipment").document(equipment_id) for equipment_id in equipment_ids]
+        equipment = [doc.to_dict() for doc in db.get_all(refs) if doc.exists]
+        written = 0
+        for offset in range(0, len(equipment), SNAPSHOT_PAGE_SIZE):
+            written += len(self._write(equipment[offset:offset + SNAPSHOT_PAGE_SIZE], trigger))
+        self.metrics["written"] += written
+        return written
+
+    @staticmethod
+    @firestore.transactional
+    def _claim_periodic(transaction) -> bool:
+        """Reserva o recálculo periódico para este worker se o último começou há mais de um intervalo"""
+        run_ref = db.collection(SNAPSHOT_RUNS_COLLECTION).document("periodic")
+        run_doc = run_ref.get(transaction=transaction)
+        started_at = run_doc.to_dict().get("started_at") if run_doc.exists else None
+        age = _age_seconds(started_at)
+        if age is not None and age < SNAPSHOT_REFRESH_INTERVAL:
+            return False
+        transaction.set(run_ref, {"started_at": datetime.utcnow()})
+        return True
+
+    async def run_once(self) -> None:
+        """Um ciclo do laço: recálculo periódico (se for a vez deste worker) e dos equipamentos alterados"""
+        if SNAPSHOT_REFRESH_INTERVAL > 0 and await run_in_threadpool(self._claim_periodic, db.transaction()):
+            # O recálculo completo já cobre as leituras recebidas até aqui
+            self._dirty = set()
+            await run_in_threadpool(self.refresh_all)
+            self.metrics["periodic_runs"] += 1
+        if self._dirty:
+            equipment_ids, self._dirty = list(self._dirty), set()
+            await run_in_threadpool(self.refresh_equipment, equipment_ids)
+            self.metrics["data_runs"] += 1
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.metrics["errors"] += 1
+                print(f"Erro ao recalcular snapshots de previsão: {e}")
+            await asyncio.sleep(SNAPSHOT_DIRTY_INTERVAL)
+
+    def start(self) -> None:
+        """Inicia o laço em segundo plano (chamado na inicialização da aplicação)"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def get_snapshot(self, equipment_id: str, user_id: str, max_age: float = SNAPSHOT_MAX_AGE) -> Dict[str, Any]:
+        """Snapshot do equipamento; recalculado na hora se não existir ou tiver mais de max_age segundos"""
+        snapshot_doc = await run_in_threadpool(db.collection(SNAPSHOT_COLLECTION).document(equipment_id).get)
+        if snapshot_doc.exists:
+            snapshot = snapshot_doc.to_dict()
+            if snapshot.get("user_id") != user_id:
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="Acesso não autorizado a este equipamento"
+                )
+            age = _age_seconds(snapshot.get("computed_at"))
+            if age is not None and age <= max_age:
+                return {**snapshot, "age_seconds": age, "refreshed": False}
+
+        equipment_doc = await run_in_threadpool(db.collection("equipment").document(equipment_id).get)
+        if not equipment_doc.exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Equipamento não encontrado"
+            )
+        equipment_data = equipment_doc.to_dict()
+        if equipment_data["user_id"] != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Acesso não autorizado a este equipamento"
+            )
+
+        snapshots = await run_in_threadpool(self._write, [equipment_data], "read")
+        if not snapshots:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Equipamento não encontrado"
+            )
+        snapshot = snapshots[0]
+        self.metrics["read_refreshes"] += 1
+        self.metrics["written"] += 1
+        return {**snapshot, "age_seconds": 0.0, "refreshed": True}
+
+    async def list_snapshots(self, user_id: str, max_age: float = SNAPSHOT_MAX_AGE,
+                             category: Optional[str] = None) -> Dict[str, Any]:
+        """Snapshots de todos os equipamentos do usuário, ordenados por risco.
+
+        Não recalcula nada: snapshots com mais de max_age segundos vêm marcados
+        como `stale` e são agendados para o próximo ciclo do laço.
+        """
+        query = db.collection(SNAPSHOT_COLLECTION).where("user_id", "==", user_id)
+        if category:
+            query = query.where("category", "==", category)
+        snapshots = [doc.to_dict() for doc in await run_in_threadpool(lambda: list(query.stream()))]
+
+        for snapshot in snapshots:
+            age = _age_seconds(snapshot.get("computed_at"))
+            snapshot["age_seconds"] = age
+            snapshot["stale"] = age is None or age > max_age
+            if snapshot["stale"]:
+                self.mark_dirty(snapshot["equipment_id"])
+
+        snapshots.sort(key=lambda s: -s.get("risk_score", 0.0))
+        oldest = max((s["age_seconds"] for s in snapshots if s["age_seconds"] is not None), default=None)
+        return {
+            "count": len(snapshots),
+            "stale": sum(1 for s in snapshots if s["stale"]),
+            "oldest_age_seconds": oldest,
+            "max_age": max_age,
+            "equipment": snapshots
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.metrics, "dirty": len(self._dirty), "running": self._task is not None}
+
+
+# Instância compartilhada pelo processo
+prediction_snapshots = PredictionSnapshots()
@@ -0,0 +1,346 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+
+from firebase_admin import firestore
+
+from config import db
+
+
+# Cada equipamento guarda suas leituras em equipment/{id}/readings/{AAAAMMDD}.
+# Um documento por dia mantém as leituras compactadas (chaves curtas), de modo
+# que o documento do equipamento tem tamanho constante independentemente do
+# histórico. Com ~80 bytes por leitura, um bucket diário comporta uma leitura
+# a cada ~7 segundos antes de se aproximar do limite de 1 MiB do Firestore.
+READINGS_COLLECTION = "readings"
+BUCKET_FORMAT = "%Y%m%d"
+
+# Limite de operações por lote de escrita do Firestore
+MAX_BATCH_WRITES = 500
+
+# Mapeamento entre os campos de OperationalData e as chaves compactadas
+READING_FIELDS = {
+    "date": "d",
+    "hours_used": "h",
+    "temperature": "t",
+    "consumption": "c",
+    "noise_level": "n",
+    "vibration": "v",
+    "cycles": "y",
+    "additional_data": "x",
+    "sequence": "s",
+}
+PACKED_FIELDS = {packed: field for field, packed in READING_FIELDS.items()}
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Normaliza datetimes ingênuos (assumidos em UTC) para UTC com fuso"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _bucket_start(value: datetime) -> datetime:
+    value = _as_utc(value)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class TimeSeriesService:
+    @staticmethod
+    def _readings_ref(equipment_id: str):
+        return db.collection("equipment").document(equipment_id).collection(READINGS_COLLECTION)
+
+    @staticmethod
+    def bucket_id(value: datetime) -> str:
+        """Retorna o ID do bucket diário ao qual uma leitura pertence"""
+        return _bucket_start(value).strftime(BUCKET_FORMAT)
+
+    @staticmethod
+    def pack_reading(reading: Dict[str, Any]) -> Dict[str, Any]:
+        """Converte uma leitura para o formato compacto armazenado no bucket"""
+        packed = {}
+        for field, key in READING_FIELDS.items():
+            value = reading.get(field)
+            if value is not None:
+                packed[key] = value
+        packed["d"] = _as_utc(reading["date"])
+        return packed
+
+    @staticmethod
+    def unpack_reading(packed: Dict[str, Any]) -> Dict[str, Any]:
+        """Converte uma leitura compacta de volta para o formato de OperationalData"""
+        reading = {field: None for field in READING_FIELDS}
+        for key, value in packed.items():
+            field = PACKED_FIELDS.get(key)
+            if field:
+                reading[field] = value
+        return reading
+
+    @staticmethod
+    def group_by_bucket(readings: Iterable[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        """Agrupa leituras (já compactadas) pelo bucket diário"""
+        buckets: Dict[str, List[Dict[str, Any]]] = {}
+        for packed in readings:
+            buckets.setdefault(TimeSeriesService.bucket_id(packed["d"]), []).append(packed)
+        return buckets
+
+    @staticmethod
+    def bucket_update(bucket: str, packed_readings: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Monta o payload de escrita (merge) que anexa leituras a um bucket sem lê-lo"""
+        return {
+            "bucket": bucket,
+            "start": datetime.strptime(bucket, BUCKET_FORMAT).replace(tzinfo=timezone.utc),
+            "readings": firestore.ArrayUnion(packed_readings),
+            "count": firestore.Increment(len(packed_readings)),
+            "updated_at": datetime.utcnow(),
+        }
+
+    @staticmethod
+    def append_writes(equipment_id: str, readings: List[Dict[str, Any]]) -> List[Tuple[Any, Dict[str, Any]]]:
+        """Monta as escritas (referência, dados) que anexam as leituras aos buckets
+        e atualizam os rollups, para uso em lotes ou transações"""
+        from services.rollup_service import RollupService
+
+        packed = [TimeSeriesService.pack_reading(r) for r in readings]
+        readings_ref = TimeSeriesService._readings_ref(equipment_id)
+        writes = [
+            (readings_ref.document(bucket), TimeSeriesService.bucket_update(bucket, bucket_readings))
+            for bucket, bucket_readings in TimeSeriesService.group_by_bucket(packed).items()
+        ]
+        writes.extend(RollupService.rollup_writes(equipment_id, readings))
+        return writes
+
+    @staticmethod
+    def reading_key(reading: Dict[str, Any]) -> Tuple[int, Optional[int]]:
+        """Identidade de uma leitura armazenada: data em milissegundos e sequência do gateway"""
+        return int(_as_utc(reading["date"]).timestamp() * 1000), reading.get("sequence")
+
+    @staticmethod
+    def new_readings(equipment_id: str, readings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Filtra as leituras que ainda não estão nos buckets (nem repetidas na própria lista).
+
+        Lê apenas os buckets diários tocados pelas leituras, com uma chamada
+        get_all; usado na importação em massa, onde reenviar o mesmo arquivo
+        não pode somar horas, contagens e rollups novamente.
+        """
+        if not readings:
+            return []
+        readings_ref = TimeSeriesService._readings_ref(equipment_id)
+        buckets = {TimeSeriesService.bucket_id(r["date"]) for r in readings}
+        seen = set()
+        for doc in db.get_all([readings_ref.document(bucket) for bucket in buckets]):
+            if doc.exists:
+                for packed in doc.to_dict().get("readings", []):
+                    seen.add(TimeSeriesService.reading_key(TimeSeriesService.unpack_reading(packed)))
+
+        new = []
+        for reading in readings:
+            key = TimeSeriesService.reading_key(reading)
+            if key not in seen:
+                seen.add(key)
+                new.append(reading)
+        return new
+
+    @staticmethod
+    def append_readings(equipment_id: str, readings: List[Dict[str, Any]]) -> int:
+        """Anexa leituras aos buckets do equipamento usando escritas em lote.
+
+        As escritas usam merge + ArrayUnion, portanto não exigem leitura prévia
+        dos buckets. Os rollups horários/diários são atualizados no mesmo lote.
+        Retorna o número de leituras enviadas.
+        """
+        if not readings:
+            return 0
+
+        writes = TimeSeriesService.append_writes(equipment_id, readings)
+        for offset in range(0, len(writes), MAX_BATCH_WRITES):
+            batch = db.batch()
+            for ref, data in writes[offset:offset + MAX_BATCH_WRITES]:
+                batch.set(ref, data, merge=True)
+            batch.commit()
+
+        return len(readings)
+
+    @staticmethod
+    def get_readings(equipment_id: str, start: Optional[datetime] = None,
+                     end: Optional[datetime] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Retorna as leituras do intervalo [start, end] ordenadas por data"""
+        query = TimeSeriesService._readings_ref(equipment_id)
+        if start:
+            query = query.where("start", ">=", _bucket_start(start))
+        if end:
+            query = query.where("start", "<=", _as_utc(end))
+        query = query.order_by("start")
+
+        start_utc = _as_utc(start) if start else None
+        end_utc = _as_utc(end) if end else None
+
+        readings = []
+        for doc in query.stream():
+            for packed in doc.to_dict().get("readings", []):
+                reading = TimeSeriesService.unpack_reading(packed)
+                date = _as_utc(reading["date"])
+                if start_utc and date < start_utc:
+                    continue
+                if end_utc and date > end_utc:
+                    continue
+                readings.append(reading)
+
+        readings.sort(key=lambda r: _as_utc(r["date"]))
+        if limit is not None:
+            readings = readings[-limit:]
+        return readings
+
+    @staticmethod
+    def iter_reading_pages(equipment_id: str, page_size: int = 30) -> Iterator[List[Dict[str, Any]]]:
+        """Percorre as leituras em páginas de `page_size` buckets diários, em ordem de data.
+
+        Cada página é uma consulta paginada (start_after), de modo que apenas
+        uma página fica em memória por vez.
+        """
+        query = TimeSeriesService._readings_ref(equipment_id).order_by("start").limit(page_size)
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = list(page_query.stream())
+            if not docs:
+                return
+
+            readings = [
+                TimeSeriesService.unpack_reading(packed)
+                for doc in docs for packed in doc.to_dict().get("readings", [])
+            ]
+            readings.sort(key=lambda r: _as_utc(r["date"]))
+            yield readings
+
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    @staticmethod
+    def get_recent_readings(equipment_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Retorna as últimas `limit` leituras, lendo apenas os buckets mais recentes"""
+        query = TimeSeriesService._readings_ref(equipment_id).order_by(
+            "start", direction=firestore.Query.DESCENDING
+        )
+
+        readings: List[Dict[str, Any]] = []
+        for doc in query.stream():
+            bucket_readings = [TimeSeriesService.unpack_reading(p) for p in doc.to_dict().get("readings", [])]
+            readings = bucket_readings + readings
+            if len(readings) >= limit:
+                break
+
+        readings.sort(key=lambda r: _as_utc(r["date"]))
+        return readings[-limit:] if limit else readings
+
+    @staticmethod
+    def delete_readings(equipment_id: str) -> int:
+        """Remove todos os buckets de leituras de um equipamento"""
+        readings_ref = TimeSeriesService._readings_ref(equipment_id)
+        deleted = 0
+        batch = db.batch()
+        pending = 0
+        for doc in readings_ref.stream():
+            batch.delete(doc.reference)
+            pending += 1
+            deleted += 1
+            if pending >= MAX_BATCH_WRITES:
+                batch.commit()
+                batch = db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+        return deleted
+
+    @staticmethod
+    def _migration_chunk(legacy: List[Dict[str, Any]]) -> int:
+        """Quantas leituras (do início da lista ordenada) cabem em uma transação de migração.
+
+        Cada dia gera um bucket e um rollup diário e cada hora um rollup
+        horário; uma escrita fica reservada para o documento do equipamento.
+        """
+        days, hours = set(), set()
+        for index, reading in enumerate(legacy):
+            date = _as_utc(reading["date"])
+            day, hour = date.date(), date.replace(minute=0, second=0, microsecond=0)
+            writes = 2 * len(days | {day}) + len(hours | {hour}) + 1
+            if writes > MAX_BATCH_WRITES:
+                return index
+            days.add(day)
+            hours.add(hour)
+        return len(legacy)
+
+    @staticmethod
+    @firestore.transactional
+    def _migrate_chunk(transaction, equipment_id: str) -> int:
+        """Move um lote do array legado `operational_data` para os buckets e rollups.
+
+        O documento é relido na transação, então migrações simultâneas do mesmo
+        equipamento (vários workers) não gravam as mesmas leituras duas vezes.
+        """
+        from services.health_analyzer import HealthAnalyzer
+
+        equipment_ref = db.collection("equipment").document(equipment_id)
+        equipment_doc = equipment_ref.get(transaction=transaction)
+        if not equipment_doc.exists:
+            return 0
+        equipment_data = equipment_doc.to_dict()
+        if "operational_data" not in equipment_data:
+            return 0
+
+        legacy = sorted(
+            (r for r in equipment_data.get("operational_data") or [] if r.get("date")),
+            key=lambda r: _as_utc(r["date"])
+        )
+        size = TimeSeriesService._migration_chunk(legacy)
+        chunk, remaining = legacy[:size], legacy[size:]
+
+        for ref, write_data in TimeSeriesService.append_writes(equipment_id, chunk):
+            transaction.set(ref, write_data, merge=True)
+        # As horas de uso já foram somadas quando as leituras entraram no array
+        analyzer = HealthAnalyzer.from_dict(equipment_data.get("health_state"))
+        analyzer.extend(chunk)
+        last_reading_at = equipment_data.get("last_reading_at")
+        if chunk and (last_reading_at is None or _as_utc(chunk[-1]["date"]) > _as_utc(last_reading_at)):
+            last_reading_at = chunk[-1]["date"]
+        transaction.update(equipment_ref, {
+            "operational_data": remaining if remaining else firestore.DELETE_FIELD,
+            "readings_count": equipment_data.get("readings_count", 0) + len(chunk),
+            "last_reading_at": last_reading_at,
+            "health_state": analyzer.to_dict(),
+            "updated_at": datetime.utcnow()
+        })
+        return len(chunk)
+
+    @staticmethod
+    def migrate_embedded_readings(equipment_id: str) -> int:
+        """Move o array legado `operational_data` do documento do equipamento para os buckets.
+
+        Feita em transações de até MAX_BATCH_WRITES escritas; cada uma remove do
+        array as leituras que migrou. Retorna o número de leituras migradas.
+        """
+        migrated = 0
+        while True:
+            count = TimeSeriesService._migrate_chunk(db.transaction(), equipment_id)
+            if not count:
+                return migrated
+            migrated += count
+
+    @staticmethod
+    def migrate_all(page_size: int = 100) -> Dict[str, int]:
+        """Migra as leituras legadas de todos os equipamentos (comando único, bloqueante)"""
+        query = db.collection("equipment").order_by("__name__").limit(page_size)
+        last_doc = None
+        result = {"equipment": 0, "migrated": 0}
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = list(page_query.select(["operational_data"]).stream())
+            if not docs:
+                return result
+            for doc in docs:
+                if "operational_data" in (doc.to_dict() or {}):
+                    result["equipment"] += 1
+                    result["migrated"] += TimeSeriesService.migrate_embedded_readings(doc.id)
+            if len(docs) < page_size:
+                return result
+            last_doc = docs[-1]
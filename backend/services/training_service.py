@@ -0,0 +1,440 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Set, Tuple, Callable
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import uuid
+
+import numpy as np
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+
+from config import db
+from services.feature_pipeline import FeaturePipeline, FailureModel
+from services.model_registry import ModelRegistry, model_registry
+
+
+TRAINING_COLLECTION = "training_jobs"
+# Processos de treino simultâneos por worker da API
+TRAINING_MAX_WORKERS = int(os.getenv("TRAINING_MAX_WORKERS", "1"))
+# Jobs aguardando ou em execução aceitos por worker antes de recusar novos
+TRAINING_MAX_PENDING = int(os.getenv("TRAINING_MAX_PENDING", "16"))
+# Intervalo (segundos) entre as atualizações de progresso gravadas no job
+TRAINING_PROGRESS_INTERVAL = float(os.getenv("TRAINING_PROGRESS_INTERVAL", "2"))
+# Tempo (segundos) sem atualização após o qual um job ativo é considerado perdido (ex.: worker reiniciado)
+TRAINING_JOB_TIMEOUT = float(os.getenv("TRAINING_JOB_TIMEOUT", "120"))
+# Como os processos de treino são criados; "fork" herdaria locks das threads do gRPC/Firestore e do httpx
+TRAINING_START_METHOD = os.getenv("TRAINING_START_METHOD", "forkserver")
+# Diretório dos arquivos de progresso e cancelamento trocados com os processos de treino
+TRAINING_CONTROL_DIR = os.getenv("TRAINING_CONTROL_DIR", os.path.join(tempfile.gettempdir(), "agroguard-training"))
+
+# Árvores acrescentadas ao modelo existente em um treino incremental
+TRAINING_INCREMENTAL_ROUNDS = int(os.getenv("TRAINING_INCREMENTAL_ROUNDS", "20"))
+# Leituras antigas sorteadas e misturadas às novas em um treino incremental
+TRAINING_REPLAY_ROWS = int(os.getenv("TRAINING_REPLAY_ROWS", "256"))
+# Crescimento (leituras novas / leituras do último treino completo) que exige treino completo
+TRAINING_FULL_RETRAIN_GROWTH = float(os.getenv("TRAINING_FULL_RETRAIN_GROWTH", "1.0"))
+# Treinos incrementais seguidos antes de um treino completo
+TRAINING_MAX_INCREMENTAL_UPDATES = int(os.getenv("TRAINING_MAX_INCREMENTAL_UPDATES", "10"))
+# Leituras novas mínimas para um treino incremental
+TRAINING_MIN_NEW_ROWS = int(os.getenv("TRAINING_MIN_NEW_ROWS", "10"))
+
+ACTIVE_STATUSES = ("queued", "collecting", "running")
+# Iterações do LightGBM entre duas verificações de progresso/cancelamento
+CALLBACK_EVERY = 10
+
+
+class TrainingCancelled(Exception):
+    """O treino foi interrompido a pedido do usuário"""
+
+
+def _control_path(job_id: str, kind: str) -> str:
+    return os.path.join(TRAINING_CONTROL_DIR, f"{job_id}.{kind}")
+
+
+def _training_callback(job_id: str):
+    """Callback do LightGBM: publica o progresso e interrompe o treino se houver pedido de cancelamento"""
+    progress_path = _control_path(job_id, "progress")
+
+    def callback(env) -> None:
+        # Em um treino incremental as iterações continuam a contagem do modelo existente
+        done = env.iteration - env.begin_iteration
+        if done % CALLBACK_EVERY:
+            return
+        if os.path.exists(_control_path(job_id, "cancel")):
+            raise TrainingCancelled(job_id)
+        with open(progress_path, "w") as f:
+            f.write(str((done + 1) / max(env.end_iteration - env.begin_iteration, 1)))
+
+    return callback
+
+
+def plan_training(model: Any, columns: List[str], dates: np.ndarray, mode: str = "auto") -> Tuple[str, str, int]:
+    """Decide entre treino completo, incremental ou nenhum; retorna (modo, motivo, início das leituras novas).
+
+    O incremental continua o booster existente apenas com as leituras
+    posteriores à marca d'água. O treino completo é usado quando não há modelo
+    compatível, quando chegaram leituras retroativas (anteriores à marca
+    d'água), quando o histórico cresceu mais que TRAINING_FULL_RETRAIN_GROWTH
+    desde o último treino completo ou após TRAINING_MAX_INCREMENTAL_UPDATES
+    incrementais seguidos.
+    """
+    if mode == "full":
+        return "full", "requested", 0
+    watermark = getattr(model, "trained_through", None)
+    if not isinstance(model, FailureModel) or watermark is None or model.columns != list(columns):
+        return "full", "no_incremental_model", 0
+
+    start = int(np.searchsorted(dates, watermark, side="right"))
+    new_rows = len(dates) - start
+    if start != getattr(model, "rows_trained", 0):
+        return "full", "backfilled_readings", 0
+    if new_rows == 0 or (mode == "auto" and new_rows < TRAINING_MIN_NEW_ROWS):
+        return "skipped", "up_to_date", start
+    if mode == "incremental":
+        return "incremental", "requested", start
+    if getattr(model, "incremental_updates", 0) >= TRAINING_MAX_INCREMENTAL_UPDATES:
+        return "full", "max_incremental_updates", 0
+    if new_rows > TRAINING_FULL_RETRAIN_GROWTH * max(getattr(model, "full_rows", 0), 1):
+        return "full", "history_growth", 0
+    return "incremental", "new_readings", start
+
+
+def _fit_full(job_id: str, columns: List[str], features: np.ndarray,
+              target: np.ndarray) -> Tuple[Any, FeaturePipeline, float]:
+    from lightgbm import LGBMClassifier
+
+    pipeline = FeaturePipeline(columns).fit(features)
+    transformed = pipeline.transform(features)
+    estimator = LGBMClassifier(n_estimators=100, random_state=42)
+    estimator.fit(transformed, target, callbacks=[_training_callback(job_id)])
+    # Avaliar modelo (simplificado)
+    return estimator, pipeline, float(estimator.score(transformed, target))
+
+
+def fit_failure_model(job_id: str, columns: List[str], features: np.ndarray, target: np.ndarray,
+                      dates: np.ndarray, category: Optional[str], equipment_id: str, models_dir: str,
+                      mode: str = "auto") -> Dict[str, Any]:
+    """Treina e publica o modelo de falha; executado em um processo do pool de treino"""
+    registry = ModelRegistry(models_dir)
+    existing = registry.load(registry.path_for(category, equipment_id)) if mode != "full" else None
+    mode, reason, start = plan_training(existing, columns, dates, mode)
+    if mode == "skipped":
+        return {"mode": mode, "reason": reason, "rows_used": 0, "trees": existing.estimator.booster_.num_trees()}
+
+    from lightgbm import LGBMClassifier
+
+    callbacks = [_training_callback(job_id)]
+    if mode == "incremental":
+        # Leituras novas + amostra das antigas, para o booster não esquecer o comportamento anterior
+        rng = np.random.default_rng(len(dates))
+        replay = np.sort(rng.choice(start, size=min(start, TRAINING_REPLAY_ROWS), replace=False))
+        rows = np.concatenate([replay, np.arange(start, len(dates))])
+        if set(np.unique(target[rows])) != set(existing.estimator.classes_):
+            mode, reason, rows = "full", "class_mismatch", np.arange(len(dates))
+
+    if mode == "incremental":
+        pipeline = existing.pipeline
+        transformed = pipeline.transform(features[rows])
+        estimator = LGBMClassifier(**{**existing.estimator.get_params(), "n_estimators": TRAINING_INCREMENTAL_ROUNDS})
+        estimator.fit(transformed, target[rows], init_model=existing.estimator.booster_, callbacks=callbacks)
+        model = FailureModel(
+            estimator, pipeline, trained_through=int(dates[-1]), rows_trained=len(dates),
+            full_rows=existing.full_rows, incremental_updates=existing.incremental_updates + 1
+        )
+        accuracy = float(estimator.score(transformed, target[rows]))
+        rows_used = len(rows)
+    else:
+        estimator, pipeline, accuracy = _fit_full(job_id, columns, features, target)
+        model = FailureModel(
+            estimator, pipeline, trained_through=int(dates[-1]), rows_trained=len(dates), full_rows=len(dates)
+        )
+        rows_used = len(dates)
+
+    # Gravação atômica: as previsões passam a usar o novo modelo apenas quando o arquivo está completo
+    path = registry.save(model, category, equipment_id)
+    return {
+        "model_type": "LightGBM Classifier",
+        "mode": mode,
+        "reason": reason,
+        "accuracy": accuracy,
+        "rows_used": rows_used,
+        "trees": estimator.booster_.num_trees(),
+        "model_path": os.path.basename(path)
+    }
+
+
+def fit_category_model(job_id: str, columns: List[str], features: np.ndarray, target: np.ndarray,
+                       category: str, models_dir: str, **collected: Any) -> Dict[str, Any]:
+    """Treina e publica o modelo da categoria a partir da amostra da frota; executado no pool de treino"""
+    estimator, pipeline, accuracy = _fit_full(job_id, columns, features, target)
+    path = ModelRegistry(models_dir).save(FailureModel(estimator, pipeline, rows_trained=len(target)), category)
+    return {
+        "model_type": "LightGBM Classifier",
+        "mode": "full",
+        "accuracy": accuracy,
+        "rows_used": len(target),
+        "trees": estimator.booster_.num_trees(),
+        "model_path": os.path.basename(path),
+        **collected
+    }
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Função de cancelamento da etapa atual de cada job deste worker (também limita as pendências)
+_jobs: Dict[str, Callable[[], None]] = {}
+# Referências às tarefas dos jobs, para que não sejam coletadas antes de terminar
+_job_tasks: Set[asyncio.Task] = set()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        method = TRAINING_START_METHOD if TRAINING_START_METHOD in multiprocessing.get_all_start_methods() else "spawn"
+        _executor = ProcessPoolExecutor(max_workers=TRAINING_MAX_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _executor
+
+
+class TrainingService:
+    """Fila de treinamento dos modelos de falha.
+
+    O treino roda em um pool de processos limitado (TRAINING_MAX_WORKERS),
+    fora do event loop da API. O estado de cada job fica em
+    `training_jobs/{job_id}`, consultável por qualquer worker; o worker que
+    recebeu o job grava o progresso periodicamente e atende os pedidos de
+    cancelamento registrados no documento. Jobs de categoria têm antes uma
+    etapa de coleta das leituras da frota, executada em thread.
+    """
+
+    @staticmethod
+    async def submit(equipment_id: str, user_id: str, category: Optional[str], columns: List[str],
+                     features: np.ndarray, target: np.ndarray, dates: np.ndarray,
+                     mode: str = "auto") -> Dict[str, Any]:
+        """Enfileira o treino do modelo do equipamento e retorna o job criado.
+
+        `mode` é auto (incremental quando possível, ver plan_training), full ou incremental.
+        """
+        job = await TrainingService._create_job(user_id, equipment_id=equipment_id, category=category, mode=mode)
+        TrainingService._start(job["id"], fit_failure_model, {
+            "columns": list(columns), "features": features, "target": target, "dates": np.asarray(dates),
+            "category": category, "equipment_id": equipment_id, "models_dir": model_registry.models_dir, "mode": mode
+        })
+        return job
+
+    @staticmethod
+    async def submit_category(category: str, user_id: str,
+                              collect: Callable[[threading.Event, Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        """Enfileira o treino do modelo de uma categoria.
+
+        `collect(stop, progress)` roda em thread, lê as leituras da frota e
+        retorna os argumentos do ajuste (columns, features, target, ...);
+        deve interromper a leitura com TrainingCancelled quando `stop` for sinalizado.
+        """
+        job = await TrainingService._create_job(user_id, equipment_id=None, category=category, mode="full")
+        TrainingService._start(job["id"], fit_category_model, {
+            "category": category, "models_dir": model_registry.models_dir
+        }, collect=collect)
+        return job
+
+    @staticmethod
+    async def _create_job(user_id: str, **fields: Any) -> Dict[str, Any]:
+        if len(_jobs) >= TRAINING_MAX_PENDING:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Fila de treinamento cheia. Tente novamente mais tarde."
+            )
+
+        job_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        job = {
+            "id": job_id,
+            **fields,
+            "user_id": user_id,
+            "status": "queued",
+            "progress": 0.0,
+            "cancel_requested": False,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "started_at": None,
+            "completed_at": None,
+            "updated_at": now
+        }
+        await run_in_threadpool(db.collection(TRAINING_COLLECTION).document(job_id).set, job)
+        return job
+
+    @staticmethod
+    def _start(job_id: str, fit: Callable[..., Dict[str, Any]], fit_kwargs: Dict[str, Any],
+               collect: Optional[Callable[[threading.Event, Dict[str, Any]], Dict[str, Any]]] = None) -> None:
+        # O pedido de cancelamento feito antes da primeira etapa é lido do documento no primeiro ciclo
+        _jobs[job_id] = lambda: None
+        task = asyncio.create_task(TrainingService._run(job_id, fit, fit_kwargs, collect))
+        _job_tasks.add(task)
+        task.add_done_callback(_job_tasks.discard)
+
+    @staticmethod
+    async def _run(job_id: str, fit: Callable[..., Dict[str, Any]], fit_kwargs: Dict[str, Any],
+                   collect: Optional[Callable[[threading.Event, Dict[str, Any]], Dict[str, Any]]]) -> None:
+        """Executa as etapas do job (coleta opcional e ajuste) e grava o resultado no Firestore"""
+        job_ref = db.collection(TRAINING_COLLECTION).document(job_id)
+        # Fração do progresso reservada à coleta, quando houver
+        fit_offset = 0.5 if collect is not None else 0.0
+        started: Dict[str, Any] = {}
+
+        def mark_started(update_data: Dict[str, Any]) -> Dict[str, Any]:
+            if not started:
+                started["at"] = update_data["started_at"] = update_data["updated_at"]
+            return update_data
+
+        try:
+            if collect is not None:
+                stop = threading.Event()
+                collect_progress: Dict[str, Any] = {}
+                _jobs[job_id] = stop.set
+                collecting = asyncio.ensure_future(run_in_threadpool(collect, stop, collect_progress))
+                await TrainingService._watch(job_id, collecting, lambda update_data: mark_started({
+                    **update_data, "status": "collecting",
+                    "progress": fit_offset * collect_progress.get("fraction", 0.0),
+                    "collected": {k: v for k, v in collect_progress.items() if k != "fraction"}
+                }))
+                fit_kwargs = {**fit_kwargs, **collecting.result()}
+
+            os.makedirs(TRAINING_CONTROL_DIR, exist_ok=True)
+            future = _get_executor().submit(fit, job_id=job_id, **fit_kwargs)
+            _jobs[job_id] = lambda: TrainingService._cancel_future(job_id, future)
+            wrapped = asyncio.wrap_future(future)
+            await TrainingService._watch(job_id, wrapped, lambda update_data: mark_started({
+                **update_data, "status": "running",
+                "progress": fit_offset + (1 - fit_offset) * TrainingService._read_progress(job_id)
+            }) if future.running() else update_data)
+            update_data = {"status": "completed", "progress": 1.0, "result": wrapped.result()}
+        except (asyncio.CancelledError, TrainingCancelled):
+            update_data = {"status": "cancelled"}
+        except BrokenProcessPool as e:
+            TrainingService._reset_executor()
+            update_data = {"status": "failed", "error": f"Processo de treino encerrado inesperadamente: {e}"}
+        except HTTPException as e:
+            update_data = {"status": "failed", "error": str(e.detail)}
+        except Exception as e:
+            update_data = {"status": "failed", "error": str(e)}
+
+        update_data["completed_at"] = update_data["updated_at"] = datetime.utcnow()
+        try:
+            await run_in_threadpool(job_ref.update, update_data)
+        except Exception as e:
+            print(f"Erro ao gravar resultado do job de treinamento {job_id}: {e}")
+        finally:
+            _jobs.pop(job_id, None)
+            for kind in ("progress", "cancel"):
+                try:
+                    os.remove(_control_path(job_id, kind))
+                except OSError:
+                    pass
+
+    @staticmethod
+    async def _watch(job_id: str, stage: "asyncio.Future",
+                     tick: Callable[[Dict[str, Any]], Dict[str, Any]]) -> None:
+        """Aguarda o fim da etapa, gravando periodicamente o progresso e atendendo pedidos de cancelamento"""
+        job_ref = db.collection(TRAINING_COLLECTION).document(job_id)
+        while True:
+            done, _ = await asyncio.wait({stage}, timeout=TRAINING_PROGRESS_INTERVAL)
+            if done:
+                return
+            try:
+                job_doc = await run_in_threadpool(job_ref.get)
+                if job_doc.exists and job_doc.to_dict().get("cancel_requested"):
+                    TrainingService._cancel_local(job_id)
+                await run_in_threadpool(job_ref.update, tick({"updated_at": datetime.utcnow()}))
+            except Exception as e:
+                print(f"Erro ao atualizar job de treinamento {job_id}: {e}")
+
+    @staticmethod
+    def _read_progress(job_id: str) -> float:
+        try:
+            with open(_control_path(job_id, "progress")) as f:
+                return min(float(f.read() or 0.0), 1.0)
+        except (OSError, ValueError):
+            return 0.0
+
+    @staticmethod
+    def _cancel_local(job_id: str) -> None:
+        """Cancela a etapa atual de um job deste worker"""
+        cancel = _jobs.get(job_id)
+        if cancel is not None:
+            cancel()
+
+    @staticmethod
+    def _cancel_future(job_id: str, future: Future) -> None:
+        # Ainda na fila sai dela; em execução é interrompido pelo callback do LightGBM
+        if future.cancel():
+            return
+        try:
+            open(_control_path(job_id, "cancel"), "w").close()
+        except OSError as e:
+            print(f"Erro ao sinalizar cancelamento do job de treinamento {job_id}: {e}")
+
+    @staticmethod
+    def _reset_executor() -> None:
+        global _executor
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+    @staticmethod
+    async def _get_owned_job(job_id: str, user_id: str) -> Dict[str, Any]:
+        job_doc = await run_in_threadpool(db.collection(TRAINING_COLLECTION).document(job_id).get)
+        if not job_doc.exists:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Job de treinamento não encontrado"
+            )
+
+        job = job_doc.to_dict()
+        if job.get("user_id") != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Acesso não autorizado a este job"
+            )
+        return job
+
+    @staticmethod
+    async def get_job(job_id: str, user_id: str) -> Dict[str, Any]:
+        """Consulta o estado e o progresso de um job de treinamento"""
+        job = await TrainingService._get_owned_job(job_id, user_id)
+
+        updated_at = job.get("updated_at")
+        if job["status"] in ACTIVE_STATUSES and updated_at is not None:
+            updated_at = updated_at.replace(tzinfo=None)
+            if datetime.utcnow() - updated_at > timedelta(seconds=TRAINING_JOB_TIMEOUT):
+                job["status"] = "expired"
+        return job
+
+    @staticmethod
+    async def cancel_job(job_id: str, user_id: str) -> Dict[str, Any]:
+        """Solicita o cancelamento de um job de treinamento ainda ativo"""
+        job = await TrainingService._get_owned_job(job_id, user_id)
+        if job["status"] not in ACTIVE_STATUSES:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Job de treinamento já finalizado ({job['status']})"
+            )
+
+        # O worker responsável pelo job verifica o pedido a cada atualização de progresso
+        await run_in_threadpool(
+            db.collection(TRAINING_COLLECTION).document(job_id).update, {"cancel_requested": True}
+        )
+        TrainingService._cancel_local(job_id)
+        job["cancel_requested"] = True
+        return job
+
+    @staticmethod
+    def shutdown() -> None:
+        """Encerra o pool de treino, descartando os jobs ainda na fila"""
+        global _executor
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,165 @@
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+import hashlib
+import os
+import threading
+
+import numpy as np
+from scipy.stats import weibull_min
+
+
+# Método de ajuste dos parâmetros: "mle" (otimização do scipy, padrão) ou "median_rank" (regressão, forma fechada)
+WEIBULL_FIT_METHOD = os.getenv("WEIBULL_FIT_METHOD", "mle")
+# Quantidade máxima de equipamentos com parâmetros em cache
+WEIBULL_CACHE_MAX_EQUIPMENT = int(os.getenv("WEIBULL_CACHE_MAX_EQUIPMENT", "4096"))
+
+# Parâmetros usados quando não há dados suficientes para o ajuste: alpha=1000h, beta=2 (desgaste)
+DEFAULT_ALPHA = 1000.0
+DEFAULT_BETA = 2.0
+
+
+def failure_times_fingerprint(failure_times: Sequence[float]) -> str:
+    """Identifica o conjunto de tempos de falha (independe da ordem)"""
+    times = np.sort(np.asarray(failure_times, dtype=np.float64))
+    return hashlib.sha1(times.tobytes()).hexdigest()
+
+
+def fit_median_rank_batch(failure_times: Sequence[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Ajusta alpha (escala) e beta (forma) de vários equipamentos de uma vez.
+
+    Regressão por postos medianos (aproximação de Bernard): com os tempos
+    ordenados, F_i = (i - 0.3) / (n + 0.4) e ln(-ln(1 - F_i)) = beta * ln(t_i)
+    - beta * ln(alpha). As séries são alinhadas em uma matriz com NaN nas
+    posições vazias e todas as regressões são resolvidas por somas vetorizadas.
+    Séries com menos de 2 tempos positivos distintos recebem os parâmetros padrão.
+    """
+    m = len(failure_times)
+    width = max((len(times) for times in failure_times), default=0)
+    if m == 0 or width == 0:
+        return np.full(m, DEFAULT_ALPHA), np.full(m, DEFAULT_BETA)
+
+    matrix = np.full((m, width), np.nan)
+    for i, times in enumerate(failure_times):
+        matrix[i, :len(times)] = times
+    matrix[~(matrix > 0)] = np.nan
+    # NaN vai para o fim de cada linha, então o posto de cada tempo é a sua coluna + 1
+    matrix = np.sort(matrix, axis=1)
+
+    valid = ~np.isnan(matrix)
+    n = valid.sum(axis=1).astype(np.float64)
+    ranks = np.arange(1, width + 1, dtype=np.float64)
+    median_rank = (ranks[None, :] - 0.3) / (n[:, None] + 0.4)
+    x = np.where(valid, np.log(np.where(valid, matrix, 1.0)), 0.0)
+    y = np.where(valid, np.log(-np.log1p(-np.where(valid, median_rank, 0.5))), 0.0)
+
+    sx = x.sum(axis=1)
+    sy = y.sum(axis=1)
+    sxx = (x * x).sum(axis=1)
+    sxy = (x * y).sum(axis=1)
+    denominator = n * sxx - sx * sx
+    fitted = (n >= 2) & (denominator > 1e-12)
+
+    beta = np.full(m, DEFAULT_BETA)
+    alpha = np.full(m, DEFAULT_ALPHA)
+    slope = np.divide(n * sxy - sx * sy, denominator, out=np.zeros(m), where=fitted)
+    fitted &= slope > 0
+    intercept = np.divide(sy - slope * sx, n, out=np.zeros(m), where=fitted)
+    beta[fitted] = slope[fitted]
+    alpha[fitted] = np.exp(-intercept[fitted] / slope[fitted])
+    return alpha, beta
+
+
+def fit_median_rank(failure_times: Sequence[float]) -> Tuple[float, float]:
+    alpha, beta = fit_median_rank_batch([failure_times])
+    return float(alpha[0]), float(beta[0])
+
+
+def fit_mle(failure_times: Sequence[float]) -> Tuple[float, float]:
+    """Ajuste por máxima verossimilhança (weibull_min.fit com loc=0)"""
+    if len(failure_times) < 2:
+        return DEFAULT_ALPHA, DEFAULT_BETA
+    try:
+        shape, loc, scale = weibull_min.fit(failure_times, floc=0)
+        return float(scale), float(shape)
+    except Exception as e:
+        print(f"Erro ao ajustar Weibull: {e}")
+        return DEFAULT_ALPHA, DEFAULT_BETA
+
+
+def fit_weibull(failure_times: Sequence[float], method: str = WEIBULL_FIT_METHOD) -> Tuple[float, float]:
+    if method == "mle":
+        return fit_mle(failure_times)
+    return fit_median_rank(failure_times)
+
+
+class WeibullCache:
+    """Cache LRU dos parâmetros de Weibull ajustados por equipamento.
+
+    Cada entrada guarda a impressão digital dos tempos de falha usados no
+    ajuste; o equipamento só é reajustado quando o seu failure_history muda.
+    No lote, as séries que faltam no cache são ajustadas juntas.
+    """
+
+    def __init__(self, max_entries: int = WEIBULL_CACHE_MAX_EQUIPMENT, method: str = WEIBULL_FIT_METHOD):
+        self.max_entries = max_entries
+        self.method = method
+        self._entries: "OrderedDict[str, Tuple[str, Tuple[float, float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "fits": 0, "evictions": 0}
+
+    def parameters(self, equipment_id: str, failure_times: Sequence[float]) -> Tuple[float, float]:
+        """Retorna (alpha, beta) do equipamento, reajustando apenas se os tempos mudaram"""
+        alpha, beta = self.parameters_batch([equipment_id], [failure_times])
+        return float(alpha[0]), float(beta[0])
+
+    def parameters_batch(self, equipment_ids: Sequence[str],
+                         failure_times: Sequence[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+        m = len(equipment_ids)
+        alpha = np.empty(m)
+        beta = np.empty(m)
+        fingerprints = [failure_times_fingerprint(times) for times in failure_times]
+
+        missing: List[int] = []
+        with self._lock:
+            for i, (equipment_id, fingerprint) in enumerate(zip(equipment_ids, fingerprints)):
+                cached = self._entries.get(equipment_id)
+                if cached is not None and cached[0] == fingerprint:
+                    self._entries.move_to_end(equipment_id)
+                    alpha[i], beta[i] = cached[1]
+                    self.metrics["hits"] += 1
+                else:
+                    missing.append(i)
+
+        if not missing:
+            return alpha, beta
+
+        if self.method == "mle":
+            fitted = [fit_mle(failure_times[i]) for i in missing]
+            alpha[missing] = [a for a, _ in fitted]
+            beta[missing] = [b for _, b in fitted]
+        else:
+            alpha[missing], beta[missing] = fit_median_rank_batch([failure_times[i] for i in missing])
+
+        with self._lock:
+            self.metrics["fits"] += len(missing)
+            for i in missing:
+                self._entries[equipment_ids[i]] = (fingerprints[i], (float(alpha[i]), float(beta[i])))
+                self._entries.move_to_end(equipment_ids[i])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.metrics["evictions"] += 1
+        return alpha, beta
+
+    def invalidate(self, equipment_id: Optional[str] = None) -> None:
+        with self._lock:
+            if equipment_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(equipment_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.metrics, "entries": len(self._entries), "max_entries": self.max_entries, "method": self.method}
+
+
+# Instância compartilhada pelo processo
+weibull_cache = WeibullCache()
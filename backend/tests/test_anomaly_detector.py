@@ -0,0 +1,63 @@
+import pytest
+import numpy as np
+from datetime import datetime, timedelta
+
+from services.anomaly_detector import AnomalyDetector, P2Quantile, ANOMALY_WARMUP
+
+# Dados de teste
+@pytest.fixture
+def readings():
+    rng = np.random.default_rng(3)
+    base_date = datetime(2024, 1, 1, 8, 0, 0)
+    return [
+        {"date": base_date + timedelta(minutes=i), "temperature": float(t), "vibration": 0.1}
+        for i, t in enumerate(rng.normal(70, 2, 500))
+    ]
+
+class TestP2Quantile:
+
+    @pytest.mark.parametrize("p", [0.25, 0.5, 0.75])
+    def test_tracks_exact_quantile(self, p):
+        values = np.random.default_rng(11).normal(50, 10, 5_000)
+        estimator = P2Quantile(p)
+        for value in values:
+            estimator.push(float(value))
+
+        assert estimator.value() == pytest.approx(np.percentile(values, p * 100), abs=0.5)
+
+    def test_small_samples_are_exact(self):
+        estimator = P2Quantile(0.5)
+        for value in [3.0, 1.0, 2.0]:
+            estimator.push(value)
+
+        assert estimator.value() == 2.0
+
+class TestAnomalyDetector:
+
+    def test_warmup_never_flags(self, readings):
+        detector = AnomalyDetector()
+        spiked = dict(readings[ANOMALY_WARMUP - 2], temperature=500.0)
+
+        flagged = [a for r in readings[:ANOMALY_WARMUP - 2] + [spiked] for a in detector.push(r)]
+
+        assert flagged == []
+
+    def test_flags_spike_immediately(self, readings):
+        detector = AnomalyDetector()
+        normal = [a for r in readings for a in detector.push(r)]
+        anomalies = detector.push({"date": readings[-1]["date"], "temperature": 95.0, "vibration": 0.1})
+
+        assert len(normal) < len(readings) * 0.02
+        assert [a["channel"] for a in anomalies] == ["temperature"]
+        assert set(anomalies[0]["rules"]) == {"iqr", "ewma"}
+        assert anomalies[0]["upper_bound"] < 95.0
+
+    def test_round_trip(self, readings):
+        detector = AnomalyDetector()
+        for reading in readings[:200]:
+            detector.push(reading)
+        restored = AnomalyDetector.from_dict(detector.to_dict())
+
+        for reading in readings[200:] + [dict(readings[-1], temperature=95.0)]:
+            assert restored.push(reading) == detector.push(reading)
+        assert restored.to_dict() == detector.to_dict()
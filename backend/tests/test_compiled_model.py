@@ -0,0 +1,49 @@
+import pytest
+import numpy as np
+from lightgbm import LGBMClassifier
+
+from services.compiled_model import CompiledFailureModel, compile_failure_model
+from services.feature_pipeline import FeaturePipeline, FailureModel
+from services.model_registry import ModelRegistry, compiled_path
+
+# Dados de teste
+@pytest.fixture
+def failure_model():
+    rng = np.random.default_rng(7)
+    features = rng.normal(50, 10, size=(400, 3))
+    features[rng.random(features.shape) < 0.1] = np.nan
+    target = ((np.nan_to_num(features[:, 0], nan=50) + rng.normal(0, 5, 400)) > 55).astype(int)
+
+    pipeline = FeaturePipeline(["temperature", "vibration", "cycles"]).fit(features)
+    estimator = LGBMClassifier(n_estimators=30, random_state=42, verbose=-1)
+    estimator.fit(pipeline.transform(features), target)
+    return FailureModel(estimator, pipeline), features
+
+class TestCompiledFailureModel:
+
+    def test_matches_lightgbm(self, failure_model):
+        model, features = failure_model
+        compiled = compile_failure_model(model)
+
+        rows = np.vstack([features[:50], [[np.nan, np.nan, np.nan]]])
+        np.testing.assert_allclose(compiled.predict_proba(rows), model.predict_proba(rows), atol=1e-9)
+
+    def test_registry_prefers_compiled_artifact(self, failure_model, tmp_path):
+        model, features = failure_model
+        registry = ModelRegistry(str(tmp_path))
+        path = registry.save(model, "trator", "eq-1")
+        registry.invalidate()
+
+        loaded, source = registry.resolve("eq-1", "trator")
+
+        assert source == "equipment"
+        assert isinstance(loaded, CompiledFailureModel)
+        assert (tmp_path / compiled_path(path).split("/")[-1]).exists()
+        np.testing.assert_allclose(loaded.predict_proba(features[:5]), model.predict_proba(features[:5]), atol=1e-9)
+
+        # O artefato carregado pode ser regravado sem perda
+        copy_path = tmp_path / "copy.npz"
+        with open(copy_path, "wb") as f:
+            loaded.save(f)
+        copy = CompiledFailureModel.load(str(copy_path))
+        np.testing.assert_array_equal(copy.predict_proba(features[:5]), loaded.predict_proba(features[:5]))
@@ -0,0 +1,57 @@
+import pytest
+from datetime import datetime, timedelta
+
+from services.dedupe_index import DedupeIndex
+
+# Dados de teste
+@pytest.fixture
+def base_date():
+    return datetime(2024, 1, 1, 8, 0, 0)
+
+def _reading(base_date, sequence, minutes):
+    return {"date": base_date + timedelta(minutes=minutes), "sequence": sequence}
+
+class TestDedupeIndex:
+
+    def test_drops_resent_sequences(self, base_date):
+        index = DedupeIndex(window=8)
+        accepted = [index.add(_reading(base_date, s, s)) for s in range(20)]
+
+        assert all(accepted)
+        assert not index.add(_reading(base_date, 15, 15))
+        assert not index.add(_reading(base_date, 3, 3))  # Abaixo da janela
+
+    def test_counter_reset_restarts_window(self, base_date):
+        index = DedupeIndex(window=8)
+        for s in range(1000, 1020):
+            index.add(_reading(base_date, s, s - 1000))
+
+        # Gateway reiniciado: o contador volta a 0, com datas posteriores
+        accepted = [index.add(_reading(base_date, s, 30 + s)) for s in range(5)]
+
+        assert all(accepted)
+        assert index.max_sequence == 4
+        assert not index.add(_reading(base_date, 2, 32))
+        assert not index.add(_reading(base_date, 1010, 10))  # Reenvio anterior ao reinício
+
+    def test_late_readings_after_counter_reset(self, base_date):
+        index = DedupeIndex(window=8)
+        for s in range(1000, 1020):
+            index.add(_reading(base_date, s, s - 1000))
+
+        # A leitura 3 do novo contador chega antes das leituras 0-2, mais antigas
+        assert index.add(_reading(base_date, 3, 33))
+        assert index.resets == [(1019, 3)]
+        assert all(index.add(_reading(base_date, s, 30 + s)) for s in range(3))
+        assert not index.add(_reading(base_date, 1, 31))
+        assert not index.add(_reading(base_date, 1019, 19))  # Reenvio do contador anterior
+        assert index.resets == [(1019, 3)]
+
+    def test_round_trip(self, base_date):
+        index = DedupeIndex(window=8)
+        for s in range(10):
+            index.add(_reading(base_date, s, s))
+        restored = DedupeIndex.from_dict(index.to_dict(), window=8)
+
+        assert not restored.add(_reading(base_date, 9, 9))
+        assert restored.add(_reading(base_date, 0, 60))
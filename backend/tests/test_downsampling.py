@@ -0,0 +1,28 @@
+import numpy as np
+
+from utils.downsampling import lttb
+
+class TestLTTB:
+
+    def test_short_series_is_kept(self):
+        x = np.arange(10, dtype=float)
+        assert list(lttb(x, x ** 2, 50)) == list(range(10))
+
+    def test_keeps_endpoints_and_point_count(self):
+        x = np.arange(10_000, dtype=float)
+        y = np.sin(x / 300)
+        indices = lttb(x, y, 200)
+
+        assert len(indices) == 200
+        assert indices[0] == 0 and indices[-1] == 9_999
+        assert np.all(np.diff(indices) > 0)
+
+    def test_preserves_spikes(self):
+        x = np.arange(5_000, dtype=float)
+        y = np.zeros(5_000)
+        y[1234] = 50.0
+        y[4321] = -30.0
+        indices = lttb(x, y, 100)
+
+        assert 1234 in indices
+        assert 4321 in indices
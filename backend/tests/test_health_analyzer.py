@@ -0,0 +1,111 @@
+import pytest
+import numpy as np
+from datetime import datetime, timedelta
+
+from services.health_analyzer import HealthAnalyzer, RingBuffer, RunningStats
+
+# Dados de teste
+@pytest.fixture
+def base_date():
+    return datetime(2024, 1, 1, 8, 0, 0)
+
+def _readings(base_date, temperatures, vibration=0.1):
+    return [
+        {"date": base_date + timedelta(hours=i), "hours_used": 1.0, "temperature": t, "vibration": vibration}
+        for i, t in enumerate(temperatures)
+    ]
+
+class TestRingBuffer:
+    
+    def test_keeps_last_values_in_order(self):
+        buffer = RingBuffer(3)
+        for value in [1, 2, 3, 4, 5]:
+            buffer.push(value)
+        
+        assert list(buffer.last()) == [3, 4, 5]
+        assert list(buffer.last(2)) == [4, 5]
+    
+    def test_round_trip(self):
+        buffer = RingBuffer(4)
+        for value in [1, None, 3, 4, 5]:
+            buffer.push(value)
+        
+        restored = RingBuffer.from_dict(buffer.to_dict(), 4)
+        assert restored.to_dict() == buffer.to_dict() == {"values": [None, 3.0, 4.0, 5.0]}
+
+class TestRunningStats:
+    
+    def test_push_and_merge_agree(self):
+        values = [10.0, 12.5, 9.0, 15.0, 11.0]
+        pushed = RunningStats()
+        for value in values:
+            pushed.push(value)
+        
+        merged = RunningStats()
+        merged.push(values[0])
+        merged.merge(np.array(values[1:]))
+        
+        assert merged.count == pushed.count == 5
+        assert merged.mean == pytest.approx(pushed.mean)
+        assert merged.std == pytest.approx(pushed.std)
+        assert (merged.min, merged.max) == (9.0, 15.0)
+
+class TestHealthAnalyzer:
+    
+    def test_insufficient_data_keeps_current_risk(self, base_date):
+        analyzer = HealthAnalyzer()
+        for reading in _readings(base_date, [90, 95]):
+            analyzer.push(reading)
+        
+        assert analyzer.evaluate(("medium", False)) == ("medium", False)
+    
+    def test_rising_temperature_is_high_risk(self, base_date):
+        analyzer = HealthAnalyzer()
+        for reading in _readings(base_date, [50, 72, 75, 79]):
+            analyzer.push(reading)
+        
+        assert analyzer.evaluate() == ("high", True)
+    
+    def test_out_of_order_reading_only_updates_stats(self, base_date):
+        analyzer = HealthAnalyzer()
+        for reading in _readings(base_date, [40, 41, 42]):
+            analyzer.push(reading)
+        
+        analyzer.push({"date": base_date - timedelta(days=1), "temperature": 99})
+        
+        assert list(analyzer.recent("temperature")) == [40, 41, 42]
+        assert analyzer.stats["temperature"].max == 99
+        assert analyzer.evaluate() == ("low", False)
+    
+    def test_extend_matches_push_and_survives_persistence(self, base_date):
+        readings = _readings(base_date, [55, 58, 61, 65, 63, 62])
+        pushed = HealthAnalyzer()
+        for reading in readings:
+            pushed.push(reading)
+        
+        extended = HealthAnalyzer()
+        extended.extend(list(reversed(readings)))
+        restored = HealthAnalyzer.from_dict(extended.to_dict())
+        
+        assert list(restored.recent("temperature")) == list(pushed.recent("temperature"))
+        assert restored.stats["temperature"].mean == pytest.approx(pushed.stats["temperature"].mean)
+        assert restored.evaluate() == pushed.evaluate() == ("medium", False)
+    
+    def test_merge_matches_extend(self, base_date):
+        current = _readings(base_date, [50, 52, 51])
+        batch = _readings(base_date + timedelta(days=1), [60 + i for i in range(40)])
+        extended = HealthAnalyzer()
+        extended.extend(current)
+        extended.extend(batch)
+        
+        # Lote processado à parte (importação) e combinado ao estado atual
+        separate = HealthAnalyzer()
+        separate.extend(batch)
+        merged = HealthAnalyzer()
+        merged.extend(current)
+        merged.merge(separate, batch[-separate.capacity:])
+        
+        assert list(merged.recent("temperature", 16)) == list(extended.recent("temperature", 16))
+        assert merged.stats["temperature"].count == extended.stats["temperature"].count == 43
+        assert merged.stats["temperature"].std == pytest.approx(extended.stats["temperature"].std)
+        assert merged.last_date == extended.last_date
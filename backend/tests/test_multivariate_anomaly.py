@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+
+from services.multivariate_anomaly import MahalanobisBaseline, MULTIVARIATE_COLUMNS
+
+# Dados de teste: temperatura e vibração fortemente correlacionadas
+@pytest.fixture
+def fleet_rows():
+    rng = np.random.default_rng(5)
+    temperature = rng.normal(70, 5, 2_000)
+    vibration = 0.02 * temperature + rng.normal(0, 0.02, 2_000)
+    noise = rng.normal(80, 3, 2_000)
+    consumption = np.full(2_000, np.nan)  # Canal nunca recebido na categoria
+    return np.column_stack([temperature, vibration, noise, consumption])
+
+class TestMahalanobisBaseline:
+
+    def test_drops_channels_without_data(self, fleet_rows):
+        baseline = MahalanobisBaseline.fit(fleet_rows, MULTIVARIATE_COLUMNS)
+
+        assert baseline.columns == ["temperature", "vibration", "noise_level"]
+        assert baseline.rows == 2_000
+
+    def test_detects_correlated_drift(self, fleet_rows):
+        baseline = MahalanobisBaseline.fit(fleet_rows, MULTIVARIATE_COLUMNS)
+        # Cada canal dentro da faixa da frota, mas fora da relação habitual entre eles
+        rows = np.array([[78.0, 1.56, 80.0], [78.0, 1.30, 80.0]])
+
+        scores = baseline.distances(rows)
+
+        assert scores[0] < baseline.threshold < scores[1]
+        contributions = baseline.contributions(rows)
+        np.testing.assert_allclose(contributions.sum(axis=1), scores)
+        assert np.argmax(contributions[1]) in (0, 1)
+
+    def test_missing_values_use_category_mean(self, fleet_rows):
+        baseline = MahalanobisBaseline.fit(fleet_rows, MULTIVARIATE_COLUMNS)
+
+        scores = baseline.distances(np.array([[np.nan, np.nan, np.nan]]))
+
+        assert scores[0] == pytest.approx(0.0)
+
+    def test_insufficient_data(self, fleet_rows):
+        assert MahalanobisBaseline.fit(fleet_rows[:10], MULTIVARIATE_COLUMNS) is None
@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+
+from services.weibull import (
+    DEFAULT_ALPHA, DEFAULT_BETA, WeibullCache, fit_median_rank, fit_median_rank_batch
+)
+
+# Dados de teste
+@pytest.fixture
+def failure_times():
+    # Quantis exatos de uma Weibull(alpha=1200, beta=2.5) nos postos medianos de Bernard
+    n = 20
+    ranks = (np.arange(1, n + 1) - 0.3) / (n + 0.4)
+    return list(1200.0 * (-np.log(1 - ranks)) ** (1 / 2.5))
+
+class TestMedianRankFit:
+
+    def test_recovers_parameters(self, failure_times):
+        alpha, beta = fit_median_rank(failure_times[::-1])
+
+        assert alpha == pytest.approx(1200.0, rel=1e-6)
+        assert beta == pytest.approx(2.5, rel=1e-6)
+
+    def test_batch_matches_single_fits(self, failure_times):
+        series = [failure_times, [300.0, 900.0, 1500.0], [500.0], [400.0, 400.0], [100.0, -5.0, 800.0]]
+        alpha, beta = fit_median_rank_batch(series)
+
+        for i, times in enumerate(series):
+            assert (alpha[i], beta[i]) == pytest.approx(fit_median_rank(times))
+        # Menos de 2 tempos distintos: parâmetros padrão
+        assert (alpha[2], beta[2]) == (DEFAULT_ALPHA, DEFAULT_BETA)
+        assert (alpha[3], beta[3]) == (DEFAULT_ALPHA, DEFAULT_BETA)
+
+class TestWeibullCache:
+
+    def test_refits_only_when_history_changes(self, failure_times):
+        cache = WeibullCache(method="median_rank")
+
+        first = cache.parameters("eq-1", failure_times)
+        assert cache.parameters("eq-1", list(reversed(failure_times))) == first
+        assert cache.metrics == {"hits": 1, "fits": 1, "evictions": 0}
+
+        cache.parameters("eq-1", failure_times + [2500.0])
+        assert cache.metrics["fits"] == 2
@@ -0,0 +1,63 @@
+import pytest
+import numpy as np
+import struct
+from datetime import datetime, timedelta, timezone
+
+from utils.wire_format import (
+    MAGIC, WireFormatError, encode_frame, decode_frames, read_frames, frame_to_dataframe
+)
+
+# Dados de teste
+@pytest.fixture
+def readings():
+    base = datetime(2024, 1, 1, 8, 0, 0, tzinfo=timezone.utc)
+    return [
+        {
+            "date": base + timedelta(seconds=30 * i),
+            "hours_used": 0.5,
+            "temperature": 60.0 + i,
+            "vibration": None if i == 1 else 0.25,
+            "cycles": 10 + i,
+            "sequence": 100 + i,
+        }
+        for i in range(4)
+    ]
+
+class TestWireFormat:
+
+    def test_round_trip(self, readings):
+        data = encode_frame(readings, "eq-1")
+        assert data.startswith(MAGIC)
+
+        [(equipment_id, columns)] = decode_frames(data)
+        assert equipment_id == "eq-1"
+        assert "consumption" not in columns
+        np.testing.assert_array_equal(columns["sequence"], [100, 101, 102, 103])
+        np.testing.assert_allclose(columns["temperature"], [60.0, 61.0, 62.0, 63.0])
+        assert np.isnan(columns["vibration"][1])
+
+        frame = frame_to_dataframe(columns)
+        assert [d.to_pydatetime() for d in frame["date"]] == [r["date"] for r in readings]
+
+    def test_concatenated_frames(self, readings):
+        data = encode_frame(readings[:2], "eq-1") + encode_frame(readings[2:], "eq-2")
+
+        frames = decode_frames(data)
+        assert [equipment_id for equipment_id, _ in frames] == ["eq-1", "eq-2"]
+
+        import io
+        assert [len(columns["date"]) for _, columns in read_frames(io.BytesIO(data))] == [2, 2]
+
+    def test_out_of_order_dates(self, readings):
+        [(_, columns)] = decode_frames(encode_frame(list(reversed(readings))))
+        assert list(columns["date"]) == sorted(columns["date"], reverse=True)
+
+    def test_rejects_invalid_frames(self, readings):
+        data = encode_frame(readings, "eq-1")
+
+        with pytest.raises(WireFormatError):
+            decode_frames(data[:-3])
+        with pytest.raises(WireFormatError):
+            decode_frames(b"XXXX" + data[4:])
+        with pytest.raises(WireFormatError):
+            decode_frames(data[:4] + struct.pack("<I", 10_000_000) + data[8:])
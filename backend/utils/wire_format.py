@@ -0,0 +1,185 @@
+"""Formato binário compacto para envio de leituras operacionais.
+
+Um frame contém as leituras de um equipamento em colunas (little-endian):
+
+    magic          4 bytes   b"AGF1"
+    rows           uint32    número de leituras
+    channel_mask   uint16    bit i => canal WIRE_CHANNELS[i] presente
+    flags          uint8     bit 0 => coluna de sequência presente
+    id_length      uint16    tamanho do equipment_id em UTF-8 (pode ser 0)
+    base_time      int64     data da primeira leitura (ms desde a época, UTC)
+    equipment_id   id_length bytes
+    [base_seq      int64]    se flags & 1
+    time_deltas    int32[rows]   diferença para a leitura anterior, em ms (a primeira é 0)
+    [seq_deltas    int32[rows]]  se flags & 1
+    canais         por canal presente, NaN = ausente: float64[rows] para
+                   hours_used (somado nos totais) e float32[rows] para os sensores
+
+Os deltas são decodificados com np.frombuffer + cumsum, sem laço em Python.
+Vários frames podem ser concatenados no mesmo corpo ou arquivo.
+"""
+from typing import List, Dict, Any, Iterator, BinaryIO, Tuple
+import struct
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"AGF1"
+CONTENT_TYPE = "application/x-agroguard-frame"
+
+# Ordem fixa dos canais no channel_mask
+WIRE_CHANNELS = ("hours_used", "temperature", "consumption", "noise_level", "vibration", "cycles")
+# Tipo de cada canal no frame; os sensores toleram a precisão de float32 (~7 dígitos)
+CHANNEL_DTYPES = {channel: np.dtype("<f4") for channel in WIRE_CHANNELS}
+CHANNEL_DTYPES["hours_used"] = np.dtype("<f8")
+
+# Limite de leituras por frame, para não alocar memória a partir de um cabeçalho inválido
+MAX_FRAME_ROWS = 1_000_000
+
+FLAG_SEQUENCE = 0x01
+
+_HEADER = struct.Struct("<4sIHBHq")
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+def _to_epoch_ms(dates) -> np.ndarray:
+    # Independente da resolução interna (ns/us) escolhida pelo pandas
+    stamps = pd.to_datetime(pd.Series(list(dates)), utc=True)
+    return ((stamps - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(milliseconds=1)).to_numpy(dtype=np.int64)
+
+
+def encode_frame(readings: List[Dict[str, Any]], equipment_id: str = "") -> bytes:
+    """Codifica leituras (formato de OperationalData) em um frame binário"""
+    rows = len(readings)
+    if rows > MAX_FRAME_ROWS:
+        raise WireFormatError(f"Frame com mais de {MAX_FRAME_ROWS} leituras")
+
+    times = _to_epoch_ms(r["date"] for r in readings) if rows else np.empty(0, dtype=np.int64)
+    base_time = int(times[0]) if rows else 0
+    time_deltas = np.diff(times, prepend=base_time)
+    if np.any(np.abs(time_deltas) > np.iinfo(np.int32).max):
+        raise WireFormatError("Intervalo entre leituras grande demais para um único frame")
+
+    channel_mask = 0
+    columns = []
+    for bit, channel in enumerate(WIRE_CHANNELS):
+        values = np.array([np.nan if r.get(channel) is None else r[channel] for r in readings], dtype=CHANNEL_DTYPES[channel])
+        if rows and not np.all(np.isnan(values)):
+            channel_mask |= 1 << bit
+            columns.append(values)
+
+    flags = 0
+    sequence_part = b""
+    if rows and all(r.get("sequence") is not None for r in readings):
+        sequences = np.array([r["sequence"] for r in readings], dtype=np.int64)
+        sequence_deltas = np.diff(sequences, prepend=sequences[0])
+        if np.any(np.abs(sequence_deltas) > np.iinfo(np.int32).max):
+            raise WireFormatError("Salto de sequência grande demais para um único frame")
+        flags |= FLAG_SEQUENCE
+        sequence_part = struct.pack("<q", int(sequences[0])) + sequence_deltas.astype("<i4").tobytes()
+
+    id_bytes = equipment_id.encode("utf-8")
+    header = _HEADER.pack(MAGIC, rows, channel_mask, flags, len(id_bytes), base_time)
+    return b"".join(
+        [header, id_bytes, time_deltas.astype("<i4").tobytes(), sequence_part]
+        + [values.tobytes() for values in columns]
+    )
+
+
+def _payload_size(rows: int, channel_mask: int, flags: int) -> int:
+    size = 4 * rows
+    for bit, channel in enumerate(WIRE_CHANNELS):
+        if channel_mask & (1 << bit):
+            size += CHANNEL_DTYPES[channel].itemsize * rows
+    if flags & FLAG_SEQUENCE:
+        size += 8 + 4 * rows
+    return size
+
+
+def _parse_header(data: bytes) -> Tuple[int, int, int, int, int]:
+    if len(data) < _HEADER.size:
+        raise WireFormatError("Frame truncado")
+    magic, rows, channel_mask, flags, id_length, base_time = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise WireFormatError("Cabeçalho de frame inválido")
+    if rows > MAX_FRAME_ROWS:
+        raise WireFormatError(f"Frame com mais de {MAX_FRAME_ROWS} leituras")
+    if channel_mask >> len(WIRE_CHANNELS):
+        raise WireFormatError("Canal desconhecido no frame")
+    return rows, channel_mask, flags, id_length, base_time
+
+
+def _decode_id(data: bytes) -> str:
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        raise WireFormatError("equipment_id inválido no frame")
+
+
+def _decode_body(body: bytes, rows: int, channel_mask: int, flags: int, base_time: int) -> Dict[str, np.ndarray]:
+    offset = 0
+    columns: Dict[str, np.ndarray] = {}
+
+    time_deltas = np.frombuffer(body, dtype="<i4", count=rows, offset=offset)
+    offset += 4 * rows
+    columns["date"] = base_time + np.cumsum(time_deltas, dtype=np.int64)
+
+    if flags & FLAG_SEQUENCE:
+        (base_sequence,) = struct.unpack_from("<q", body, offset)
+        offset += 8
+        sequence_deltas = np.frombuffer(body, dtype="<i4", count=rows, offset=offset)
+        offset += 4 * rows
+        columns["sequence"] = base_sequence + np.cumsum(sequence_deltas, dtype=np.int64)
+
+    for bit, channel in enumerate(WIRE_CHANNELS):
+        if channel_mask & (1 << bit):
+            dtype = CHANNEL_DTYPES[channel]
+            columns[channel] = np.frombuffer(body, dtype=dtype, count=rows, offset=offset).astype(np.float64)
+            offset += dtype.itemsize * rows
+    return columns
+
+
+def decode_frames(data: bytes) -> List[Tuple[str, Dict[str, np.ndarray]]]:
+    """Decodifica um ou mais frames concatenados em (equipment_id, colunas).
+
+    `colunas["date"]` traz as datas em ms desde a época (UTC).
+    """
+    frames = []
+    offset = 0
+    view = memoryview(data)
+    while offset < len(data):
+        rows, channel_mask, flags, id_length, base_time = _parse_header(view[offset:offset + _HEADER.size])
+        offset += _HEADER.size
+        end = offset + id_length + _payload_size(rows, channel_mask, flags)
+        if end > len(data):
+            raise WireFormatError("Frame truncado")
+        equipment_id = _decode_id(bytes(view[offset:offset + id_length]))
+        body = bytes(view[offset + id_length:end])
+        frames.append((equipment_id, _decode_body(body, rows, channel_mask, flags, base_time)))
+        offset = end
+    return frames
+
+
+def read_frames(file: BinaryIO) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+    """Lê frames de um arquivo um de cada vez, sem carregá-lo inteiro em memória"""
+    while True:
+        header = file.read(_HEADER.size)
+        if not header:
+            return
+        rows, channel_mask, flags, id_length, base_time = _parse_header(header)
+        size = id_length + _payload_size(rows, channel_mask, flags)
+        payload = file.read(size)
+        if len(payload) != size:
+            raise WireFormatError("Frame truncado")
+        equipment_id = _decode_id(payload[:id_length])
+        yield equipment_id, _decode_body(payload[id_length:], rows, channel_mask, flags, base_time)
+
+
+def frame_to_dataframe(columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """Converte as colunas de um frame em DataFrame no formato de OperationalData"""
+    frame = pd.DataFrame({name: values for name, values in columns.items() if name != "date"})
+    frame.insert(0, "date", pd.to_datetime(columns["date"], unit="ms", utc=True))
+    return frame
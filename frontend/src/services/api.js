@@ -77,6 +77,15 @@ export const equipmentService = {
   deleteEquipment: (id) => api.delete(`/equipment/${id}`),
   getEquipmentStats: () => api.get('/equipment/stats'),
   addOperationalData: (id, data) => api.post(`/equipment/${id}/operational-data`, data),
+  getOperationalData: (id, params = {}) => api.get(`/equipment/${id}/operational-data`, { params }),
+  importOperationalData: (id, file, onUploadProgress) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    return api.post(`/equipment/${id}/operational-data/import`, formData, {
+      headers: { 'Content-Type': 'multipart/form-data' },
+      onUploadProgress,
+    });
+  },
   analyzeEquipmentHealth: (id) => api.get(`/equipment/${id}/health-analysis`),
   addComponent: (id, data) => api.post(`/equipment/${id}/components`, data),
   updateComponent: (equipmentId, componentId, data) => 
@@ -155,14 +164,30 @@ export const reportService = {
 
 // Serviços de IA
 export const aiService = {
-  predictEquipmentFailure: (equipmentId, daysAhead = 30) => 
-    api.get(`/ai/predict/${equipmentId}`, { params: { days_ahead: daysAhead } }),
+  predictEquipmentFailure: (equipmentId, daysAhead = 30, deferred = false) => 
+    api.get(`/ai/predict/${equipmentId}`, { params: { days_ahead: daysAhead, deferred } }),
+  predictFleetFailure: (category = null, daysAhead = 30, limit = null) => 
+    api.get('/ai/fleet/predict', { params: { category, days_ahead: daysAhead, limit } }),
+  detectFleetAnomalies: (category = null, window = 1, limit = null) => 
+    api.get('/ai/fleet/anomalies', { params: { category, window, limit } }),
+  listPredictionSnapshots: (category = null, maxAge = null) => 
+    api.get('/ai/fleet/snapshots', { params: { category, max_age: maxAge } }),
+  getPredictionSnapshot: (equipmentId, maxAge = null) => 
+    api.get(`/ai/snapshots/${equipmentId}`, { params: { max_age: maxAge } }),
+  getPredictionEnrichment: (jobId) => 
+    api.get(`/ai/predict/enrichment/${jobId}`),
   recommendMaintenanceSchedule: (equipmentId) => 
     api.get(`/ai/maintenance-schedule/${equipmentId}`),
-  analyzeOperationalData: (equipmentId) => 
-    api.get(`/ai/analyze/${equipmentId}`),
-  trainCustomModel: (equipmentId) => 
-    api.post(`/ai/train/${equipmentId}`),
+  analyzeOperationalData: (equipmentId, params = {}) => 
+    api.get(`/ai/analyze/${equipmentId}`, { params }),
+  trainCustomModel: (equipmentId, mode = 'auto') => 
+    api.post(`/ai/train/${equipmentId}`, null, { params: { mode } }),
+  trainCategoryModel: (category) => 
+    api.post(`/ai/train/category/${encodeURIComponent(category)}`),
+  getTrainingJob: (jobId) => 
+    api.get(`/ai/train/jobs/${jobId}`),
+  cancelTrainingJob: (jobId) => 
+    api.post(`/ai/train/jobs/${jobId}/cancel`),
 };
 
 export default api;
\ No newline at end of file